@@ -6,7 +6,7 @@ import os
 from os.path import basename
 from pathlib import Path
 import shlex
-from common.data import deserialize_env
+from common.data import Limits, LogFilter, deserialize_env
 from pprint import PrettyPrinter
 from typing import TYPE_CHECKING, Any
 if TYPE_CHECKING:
@@ -27,9 +27,22 @@ ENV_DEFAULTS = {
            "PSYNC_CERT_PATH", "~/.local/share/psync/cert.pem"
        ),
     "client_origin": os.environ.get("PSYNC_CLIENT_ORIGIN", "127.0.0.1"),
-    "log_file": os.environ.get("PSYNC_LOG_FILE", "")
+    "log_file": os.environ.get("PSYNC_LOG_FILE", ""),
+    "sync_mode": os.environ.get("PSYNC_SYNC_MODE", "rsync"),
+    "watch_debounce_ms": os.environ.get("PSYNC_WATCH_DEBOUNCE_MS", "50"),
+    "ssh_persist": os.environ.get("PSYNC_SSH_PERSIST", "600"),
+    "sync_jobs": os.environ.get("PSYNC_SYNC_JOBS", "1"),
+    "priority": os.environ.get("PSYNC_PRIORITY", "0"),
+    "reconnect": os.environ.get("PSYNC_RECONNECT", "5"),
+    "log_compression": os.environ.get("PSYNC_LOG_COMPRESSION", "auto"),
+    "output_flush_bytes": os.environ.get("PSYNC_OUTPUT_FLUSH_BYTES", str(64 * 1024)),
+    "output_flush_ms": os.environ.get("PSYNC_OUTPUT_FLUSH_MS", "50"),
 }
 
+SYNC_MODES = ["rsync", "native"]
+
+LOG_COMPRESSIONS = ["auto", "none", "gzip", "zstd"]
+
 @dataclass
 class Args:
     """
@@ -93,6 +106,22 @@ class Args:
     ``rsync -e "/usr/bin/ssh {PSYNC_SSH_ARGS} -p {PSYNC_SSH_PORT}"``
     """
 
+    ssh_persist: int = int(ENV_DEFAULTS["ssh_persist"])
+    """
+    environ: ``PSYNC_SSH_PERSIST``
+
+    Seconds an idle SSH master connection is kept open for reuse by later syncs.
+    Set to 0 to open a new SSH connection for every sync.
+    """
+
+    ssh_control: str | None = None
+    """
+    ``--ssh-status``, ``--ssh-close``
+
+    Instead of running the target, check on (``check``) or close (``exit``) the
+    persistent SSH connection to the server.
+    """
+
     server_dest: str = ENV_DEFAULTS["server_dest"]
     """
     environ: ``PSYNC_SERVER_DEST``
@@ -115,13 +144,215 @@ class Args:
     variable.
     """
 
-    logfile: Logfile = None
+    logfile: Logfile = (
+        Path(ENV_DEFAULTS["log_file"]).expanduser() if ENV_DEFAULTS["log_file"] else None
+    )
     """
+    ``--log-file <path>``
     environ: ``PSYNC_LOG_FILE``
 
     Optional file where the executable's logs will be output.
     """
 
+    log_compression: str = ENV_DEFAULTS["log_compression"]
+    """
+    ``--log-compression <auto|none|gzip|zstd>``
+    environ: ``PSYNC_LOG_COMPRESSION``
+
+    Compression of the log file. ``auto`` compresses files ending in ``.gz`` with
+    gzip and files ending in ``.zst`` with zstd. zstd needs Python 3.14 or the
+    ``zstandard`` package.
+    """
+
+    split_stderr: bool = False
+    """
+    ``--split-stderr``
+
+    Keep the executable's stderr apart from its stdout, and write it to the
+    client's stderr, or to ``stderr_file``.
+    """
+
+    stderr_file: Logfile = None
+    """
+    ``--stderr-file <path>``
+
+    Write the executable's stderr to this file. Implies ``--split-stderr``. It is
+    compressed like the log file.
+    """
+
+    tee: bool = False
+    """
+    ``--tee``
+
+    Write the executable's logs to stdout (and stderr) as well as to the log files.
+    """
+
+    output_flush_bytes: int = int(ENV_DEFAULTS["output_flush_bytes"])
+    """
+    environ: ``PSYNC_OUTPUT_FLUSH_BYTES``
+
+    Bytes of output buffered before it is written out. Output is written by a
+    background thread, so that writing it never holds up receiving it.
+    """
+
+    output_flush_ms: float = float(ENV_DEFAULTS["output_flush_ms"])
+    """
+    environ: ``PSYNC_OUTPUT_FLUSH_MS``
+
+    Milliseconds after which buffered output is written out, however little of it
+    there is.
+    """
+
+    sync_mode: str = ENV_DEFAULTS["sync_mode"]
+    """
+    ``--sync <mode>``
+    environ: ``PSYNC_SYNC_MODE``
+
+    How the project is synced to the server. ``rsync`` runs rsync over SSH.
+    ``native`` syncs over the psync websocket connection, sending only the blocks
+    of files which changed, and needs no SSH access.
+    """
+
+    jobs: int = int(ENV_DEFAULTS["sync_jobs"])
+    """
+    ``--jobs -j <n>``
+    environ: ``PSYNC_SYNC_JOBS``
+
+    Number of parallel transfer streams. With rsync, the project's files are split
+    by size across this many rsync processes. With native sync, files are hashed
+    and compressed on this many threads.
+    """
+
+    watch: bool = False
+    """
+    ``--watch -w``
+
+    Keep running after the executable starts. Whenever the target or assets change,
+    sync the changes and restart the executable over the same connection.
+    """
+
+    watch_debounce_ms: int = int(ENV_DEFAULTS["watch_debounce_ms"])
+    """
+    environ: ``PSYNC_WATCH_DEBOUNCE_MS``
+
+    In watch mode, how long to wait for changes to settle before syncing.
+    """
+
+    priority: int = int(ENV_DEFAULTS["priority"])
+    """
+    ``--priority <n>``
+    environ: ``PSYNC_PRIORITY``
+
+    Scheduling priority of the run. When the server is busy, runs with a higher
+    priority are started first, e.g. interactive runs ahead of batch jobs.
+    """
+
+    reconnect: int = int(ENV_DEFAULTS["reconnect"])
+    """
+    environ: ``PSYNC_RECONNECT``
+
+    How many times to try reconnecting when the connection drops while the
+    executable is running. The executable keeps running on the server, and its
+    output resumes where it left off.
+    """
+
+    log_filter: LogFilter | None = None
+    """
+    ``--include <regex>``, ``--exclude <regex>``, ``--sample <n>``,
+    ``--sample-pattern <regex>``, ``--head <n>``, ``--tail <n>``
+
+    Lines of the executable's output to leave out. The server applies the filter, so
+    lines which are left out are never sent. See :class:`common.data.LogFilter`.
+    """
+
+    limits: Limits | None = None
+    """
+    ``--memory <size>``, ``--cpu-time <seconds>``, ``--open-files <n>``,
+    ``--nice <n>``, ``--cpus <n>``
+
+    Resources the executable may use on the server, and how many CPUs it is pinned
+    to. The server may lower these to its own limits. See
+    :class:`common.data.Limits`.
+    """
+
+    artifacts: list[str] = field(default_factory=list)
+    """
+    ``--fetch <glob>``
+
+    Glob patterns, relative to the synced project directory on the server, which
+    the executable runs in, of files to fetch back into ``artifact_dir`` once it
+    exits, e.g. profiles or plots. Files whose local copy is unchanged are not sent.
+    """
+
+    artifact_dir: Path = Path(".")
+    """
+    ``--fetch-dir <path>``
+
+    Directory the fetched files are written to, at their paths relative to the
+    project directory. Defaults to the current directory.
+    """
+
+    stats_file: Path | None = None
+    """
+    ``--stats-file <path>``
+
+    Write the resources used by the executable to this file as JSON, one line per
+    run. A summary is always logged when the executable exits.
+    """
+
+    stats_interval: float = 0
+    """
+    ``--stats-interval <seconds>``
+
+    Have the server sample the executable's resource usage this often while it runs.
+    The samples are written to ``stats_file``.
+    """
+
+    cache: bool = True
+    """
+    ``--no-cache``
+
+    Let a server with a result cache replay the output and exit code of an
+    identical earlier run instead of running the executable again. With
+    ``--no-cache``, the executable always runs and its result is not cached.
+    """
+
+    pty: bool = False
+    """
+    ``--pty``
+
+    Run the executable under a pseudo-terminal on the server, the size of the
+    client's terminal. Most programs then write their output line by line, rather
+    than in blocks or at exit.
+    """
+
+    raw: bool = False
+    """
+    ``--raw``
+
+    Pass the executable's output through byte for byte instead of decoding it as
+    UTF-8 text. Use this for binary output or output in another encoding.
+    """
+
+    hosts: list[str] = field(default_factory=list)
+    """
+    ``--hosts <host[:port],...>``, ``--hosts-file <path>``
+
+    Sync to and run the executable on each of these servers at once, instead of on
+    ``server_ip``. Hosts without a port use ``server_port``. Output written to the
+    terminal is prefixed with its host, and log files get one file per host. The
+    client exits with status 0 if the executable succeeded on every host.
+    """
+
+    balance: bool = False
+    """
+    ``--balance``
+
+    Instead of running on every one of ``hosts``, health check them all and run on
+    the least loaded one: the one with the fewest runs per slot, or the lowest load
+    average per CPU, whichever is higher.
+    """
+
     def project_hash(self) -> str:
         """
         Hash value generated from the target path. Used as the directory name for the project.
@@ -134,6 +365,12 @@ class Args:
         """
         return f"{self.server_ip}:{self.server_dest}/{self.project_hash()}/"
 
+    def sync_root(self) -> Path:
+        """
+        {server_dest}/{project_hash}
+        """
+        return Path(self.server_dest) / self.project_hash()
+
     def destination_path(self) -> Path:
         """
         {server_dest}/{project_hash}/{basename(target_path)}
@@ -151,16 +388,25 @@ Client for the psync server.
 In addition to the options above, the client is configurable through environment
 variables.
 
-Variable            | Current value
---------------------+-------------------------------
-PSYNC_SERVER_IP     | {ENV_DEFAULTS["server_ip"]}
-PSYNC_SERVER_PORT   | {ENV_DEFAULTS["server_port"]}
-PSYNC_SSH_PORT      | {ENV_DEFAULTS["server_ssh_port"]}
-PSYNC_SERVER_DEST   | {ENV_DEFAULTS["server_dest"]}
-PSYNC_SSH_ARGS      | {ENV_DEFAULTS["ssh_args"]}
-PSYNC_CERT_PATH     | {ENV_DEFAULTS["cert_path"]}
-PSYNC_CLIENT_ORIGIN | {ENV_DEFAULTS["client_origin"]}
-PSYNC_LOG_FILE      | {ENV_DEFAULTS["log_file"]}
+Variable                | Current value
+------------------------+-------------------------------
+PSYNC_SERVER_IP         | {ENV_DEFAULTS["server_ip"]}
+PSYNC_SERVER_PORT       | {ENV_DEFAULTS["server_port"]}
+PSYNC_SSH_PORT          | {ENV_DEFAULTS["server_ssh_port"]}
+PSYNC_SERVER_DEST       | {ENV_DEFAULTS["server_dest"]}
+PSYNC_SSH_ARGS          | {ENV_DEFAULTS["ssh_args"]}
+PSYNC_SSH_PERSIST       | {ENV_DEFAULTS["ssh_persist"]}
+PSYNC_CERT_PATH         | {ENV_DEFAULTS["cert_path"]}
+PSYNC_CLIENT_ORIGIN     | {ENV_DEFAULTS["client_origin"]}
+PSYNC_LOG_FILE          | {ENV_DEFAULTS["log_file"]}
+PSYNC_SYNC_MODE         | {ENV_DEFAULTS["sync_mode"]}
+PSYNC_SYNC_JOBS         | {ENV_DEFAULTS["sync_jobs"]}
+PSYNC_WATCH_DEBOUNCE_MS | {ENV_DEFAULTS["watch_debounce_ms"]}
+PSYNC_PRIORITY          | {ENV_DEFAULTS["priority"]}
+PSYNC_RECONNECT         | {ENV_DEFAULTS["reconnect"]}
+PSYNC_LOG_COMPRESSION   | {ENV_DEFAULTS["log_compression"]}
+PSYNC_OUTPUT_FLUSH_BYTES| {ENV_DEFAULTS["output_flush_bytes"]}
+PSYNC_OUTPUT_FLUSH_MS   | {ENV_DEFAULTS["output_flush_ms"]}
 
 SSH arguments will be append with "-p PSYNC_SSH_PORT"
 For more info, please read the docs: <https://psync.readthedocs.io/>\
@@ -169,6 +415,7 @@ For more info, please read the docs: <https://psync.readthedocs.io/>\
 _action = parser.add_argument(
     "path",
     help="Path to the target exectuable.",
+    nargs="?",
 )
 _action = parser.add_argument(
     "--assets",
@@ -185,11 +432,207 @@ _action = parser.add_argument(
 _action = parser.add_argument(
     "--args", "-a", help="Arguments passed to the executable.", nargs="+"
 )
+_action = parser.add_argument(
+    "--sync",
+    choices=SYNC_MODES,
+    help="How to sync the project: with rsync over SSH, or natively over the psync connection.",
+)
+_action = parser.add_argument(
+    "--jobs",
+    "-j",
+    type=int,
+    help="Number of parallel transfer streams.",
+)
+_action = parser.add_argument(
+    "--watch",
+    "-w",
+    help="Watch the target and assets, and sync and restart the executable when they change.",
+    action="store_true",
+)
+_action = parser.add_argument(
+    "--priority",
+    type=int,
+    help="Scheduling priority. Higher priority runs are started first when the server is busy.",
+)
+_action = parser.add_argument(
+    "--log-file",
+    "-o",
+    help="Write the executable's logs to this file instead of stdout.",
+)
+_action = parser.add_argument(
+    "--log-compression",
+    choices=LOG_COMPRESSIONS,
+    help="Compression of the log file. By default, picked by its extension (.gz, .zst).",
+)
+_action = parser.add_argument(
+    "--split-stderr",
+    help="Keep the executable's stderr apart from its stdout, and write it to stderr.",
+    action="store_true",
+)
+_action = parser.add_argument(
+    "--stderr-file",
+    help="Write the executable's stderr to this file. Implies --split-stderr.",
+)
+_action = parser.add_argument(
+    "--tee",
+    help="Write the logs to stdout (and stderr) as well as to the log files.",
+    action="store_true",
+)
+_filter_group = parser.add_argument_group(
+    "output filter", "Lines of output to leave out, before they are sent."
+)
+_action = _filter_group.add_argument(
+    "--include",
+    action="append",
+    metavar="REGEX",
+    help="Only send lines matching this pattern. May be given more than once.",
+)
+_action = _filter_group.add_argument(
+    "--exclude",
+    action="append",
+    metavar="REGEX",
+    help="Leave out lines matching this pattern. May be given more than once.",
+)
+_action = _filter_group.add_argument(
+    "--sample",
+    type=int,
+    metavar="N",
+    help="Only send one in every N lines matching --sample-pattern.",
+)
+_action = _filter_group.add_argument(
+    "--sample-pattern",
+    metavar="REGEX",
+    help="Lines to sample with --sample. Defaults to all lines.",
+)
+_action = _filter_group.add_argument(
+    "--head", type=int, metavar="N", help="Only send the first N lines."
+)
+_action = _filter_group.add_argument(
+    "--tail",
+    type=int,
+    metavar="N",
+    help="Only send the last N lines, once the executable exits.",
+)
+_limits_group = parser.add_argument_group(
+    "resource limits", "Resources the executable may use on the server."
+)
+_action = _limits_group.add_argument(
+    "--memory",
+    metavar="SIZE",
+    help="Address space the executable may use, in bytes or with a K, M or G suffix.",
+)
+_action = _limits_group.add_argument(
+    "--cpu-time", type=int, metavar="SECONDS", help="CPU time the executable may use."
+)
+_action = _limits_group.add_argument(
+    "--open-files", type=int, metavar="N", help="Files the executable may have open."
+)
+_action = _limits_group.add_argument(
+    "--nice", type=int, metavar="N", help="Niceness added to the executable, 0 to 19."
+)
+_action = _limits_group.add_argument(
+    "--cpus", type=int, metavar="N", help="Number of CPUs to pin the executable to."
+)
+_action = parser.add_argument(
+    "--fetch",
+    action="append",
+    metavar="GLOB",
+    help="Fetch files matching this pattern back once the executable exits. May be given more than once.",
+)
+_action = parser.add_argument(
+    "--fetch-dir",
+    metavar="PATH",
+    help="Directory fetched files are written to. Defaults to the current directory.",
+)
+_action = parser.add_argument(
+    "--stats-file",
+    metavar="PATH",
+    help="Write the resources used by the executable to this file, as JSON.",
+)
+_action = parser.add_argument(
+    "--stats-interval",
+    type=float,
+    metavar="SECONDS",
+    help="Sample the executable's resource usage this often while it runs.",
+)
+_action = parser.add_argument(
+    "--no-cache",
+    help="Always run the executable, even if the server has a cached result for it.",
+    action="store_true",
+)
+_action = parser.add_argument(
+    "--pty",
+    help="Run the executable under a pseudo-terminal, so that it writes its output line by line.",
+    action="store_true",
+)
+_action = parser.add_argument(
+    "--raw",
+    help="Pass output through as raw bytes instead of decoding it as UTF-8.",
+    action="store_true",
+)
+_hosts_group = parser.add_mutually_exclusive_group()
+_action = _hosts_group.add_argument(
+    "--hosts",
+    metavar="HOST[:PORT],...",
+    help="Run on each of these comma separated servers at once.",
+)
+_action = _hosts_group.add_argument(
+    "--hosts-file",
+    metavar="PATH",
+    help="Run on each of the servers listed in this file, one per line.",
+)
+_action = parser.add_argument(
+    "--balance",
+    help="Run on the least loaded of the servers given by --hosts, instead of on all of them.",
+    action="store_true",
+)
+_ssh_group = parser.add_mutually_exclusive_group()
+_action = _ssh_group.add_argument(
+    "--ssh-status",
+    help="Check whether a persistent SSH connection to the server is open, then exit.",
+    dest="ssh_control",
+    action="store_const",
+    const="check",
+)
+_action = _ssh_group.add_argument(
+    "--ssh-close",
+    help="Close the persistent SSH connection to the server, then exit.",
+    dest="ssh_control",
+    action="store_const",
+    const="exit",
+)
+
+
+def parse_size(text: str) -> int:
+    """Parse a size in bytes, optionally with a ``K``, ``M`` or ``G`` suffix."""
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    text = text.strip().upper().removesuffix("B").removesuffix("I")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_hosts(text: str) -> list[str]:
+    """
+    Hosts listed in ``text``, separated by commas or newlines. Blank entries and
+    ``#`` comments are ignored.
+    """
+    hosts: list[str] = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        hosts.extend(host.strip() for host in line.split(",") if host.strip())
+    return hosts
 
 
 def parse_args(input: list[str] | None = None) -> Args:
     args = vars(parser.parse_args(input))
 
+    ssh_control = args.get("ssh_control")
+    if ssh_control is not None:
+        return Args(target_path="", ssh_control=str(ssh_control))
+    if args.get("path") is None:
+        parser.error("the following arguments are required: path")
+
     target_path = str(args.get("path"))
     target_path = Path(target_path)
     if not target_path.is_file():
@@ -219,6 +662,82 @@ def parse_args(input: list[str] | None = None) -> Args:
         assets=assets or [],
         env=env,
         args=client_args,
+        watch=bool(args.get("watch")),
+        raw=bool(args.get("raw")),
+        pty=bool(args.get("pty")),
+        tee=bool(args.get("tee")),
+        split_stderr=bool(args.get("split_stderr")),
+        balance=bool(args.get("balance")),
+        cache=not args.get("no_cache"),
+    )
+    sync_mode = args.get("sync")
+    if sync_mode is not None:
+        ret.sync_mode = str(sync_mode)
+    jobs = args.get("jobs")
+    if jobs is not None:
+        ret.jobs = int(jobs)  # pyright: ignore[reportAny]
+    log_filter = LogFilter(
+        include=list(args.get("include") or []),
+        exclude=list(args.get("exclude") or []),
+        sample=int(args.get("sample") or 0),
+        sample_pattern=str(args.get("sample_pattern") or ""),
+        head=int(args.get("head") or 0),
+        tail=int(args.get("tail") or 0),
+    )
+    if log_filter != LogFilter():
+        ret.log_filter = log_filter
+    try:
+        memory = parse_size(str(args.get("memory") or 0))
+    except ValueError:
+        parser.error(f"invalid size: {args.get('memory')}")
+    limits = Limits(
+        memory=memory,
+        cpu_seconds=int(args.get("cpu_time") or 0),
+        open_files=int(args.get("open_files") or 0),
+        nice=int(args.get("nice") or 0),
+        cpus=int(args.get("cpus") or 0),
     )
+    if limits != Limits():
+        ret.limits = limits
+    ret.artifacts = list(args.get("fetch") or [])
+    fetch_dir = args.get("fetch_dir")
+    if fetch_dir is not None:
+        ret.artifact_dir = Path(str(fetch_dir)).expanduser()
+    stats_file = args.get("stats_file")
+    if stats_file is not None:
+        ret.stats_file = Path(str(stats_file)).expanduser()
+    stats_interval = args.get("stats_interval")
+    if stats_interval is not None:
+        ret.stats_interval = float(stats_interval)  # pyright: ignore[reportAny]
+    log_file = args.get("log_file")
+    if log_file is not None:
+        ret.logfile = Path(str(log_file)).expanduser()
+    stderr_file = args.get("stderr_file")
+    if stderr_file is not None:
+        ret.stderr_file = Path(str(stderr_file)).expanduser()
+        ret.split_stderr = True
+    log_compression = args.get("log_compression")
+    if log_compression is not None:
+        ret.log_compression = str(log_compression)
+    priority = args.get("priority")
+    if priority is not None:
+        ret.priority = int(priority)  # pyright: ignore[reportAny]
+    hosts = args.get("hosts")
+    if hosts is not None:
+        ret.hosts = parse_hosts(str(hosts))
+    hosts_file = args.get("hosts_file")
+    if hosts_file is not None:
+        try:
+            ret.hosts = parse_hosts(Path(str(hosts_file)).expanduser().read_text())
+        except OSError as e:
+            parser.error(f"could not read hosts file: {e}")
+    if (hosts is not None or hosts_file is not None) and not ret.hosts:
+        parser.error("no hosts given")
+    if len(set(ret.hosts)) != len(ret.hosts):
+        parser.error("a host is given more than once")
+    if ret.balance and not ret.hosts:
+        parser.error("--balance needs --hosts or --hosts-file")
+    if ret.hosts and ret.watch and not ret.balance:
+        parser.error("--watch cannot be used with --hosts")
     logging.debug(pprint(ret))
     return ret
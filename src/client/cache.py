@@ -0,0 +1,128 @@
+"""
+Client-side stat cache. Remembers what the project looked like the last time it
+was pushed, so unchanged projects can skip the transfer entirely.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from client.args import Args
+from common.data import FileEntry
+from common.sync import file_digest, walk
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(
+    os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+) / "psync"
+
+
+@dataclass
+class LocalFile:
+    """A local file as seen by the last scan."""
+
+    path: Path
+    entry: FileEntry
+    ino: int
+
+
+Scan = dict[str, LocalFile]
+"""Local files keyed by their path relative to the project."""
+
+
+class StatCache:
+    """
+    The manifest of the last successful push of a project to a server, stored per
+    :meth:`Args.project_hash` and server along with the tree token the server
+    reported after the push. Each server gets its own file, so that pushing to
+    several hosts at once, or alternating between servers, does not share one. If the local files still match the manifest by size, mtime and inode,
+    and the server still reports the same token, nothing needs to be sent.
+    """
+
+    path: Path
+    server: str
+    token: str | None = None
+    files: dict[str, tuple[int, int, int, int, str]]
+    """{[rel]: (size, mtime_ns, mode, ino, digest)}"""
+
+    def __init__(self, args: Args):
+        self.server = f"{args.server_ip}:{args.server_port}:{args.sync_root()}"
+        server_hash = hashlib.blake2s(self.server.encode(), digest_size=8).hexdigest()
+        self.path = CACHE_DIR / f"{args.project_hash()}-{server_hash}.json"
+        self.files = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)  # pyright: ignore[reportAny]
+            if data.get("server") == self.server:  # pyright: ignore[reportAny]
+                self.token = data["token"]
+                self.files = {k: tuple(v) for k, v in data["files"].items()}  # pyright: ignore[reportAny]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable stat cache {self.path}: {e}")
+
+    def scan(self, args: Args, digests: bool) -> Scan:
+        """
+        Stat every file in the project. With ``digests``, content digests are reused
+        from the cache for files whose stat is unchanged and computed for the rest,
+        on ``args.jobs`` threads; otherwise they are left empty.
+        """
+        files: Scan = {}
+        for rel, path in walk([args.target_path, *args.assets]):
+            st = path.stat()
+            mode = st.st_mode & 0o7777
+            digest = ""
+            cached = self.files.get(rel)
+            if cached is not None and cached[:4] == (
+                st.st_size,
+                st.st_mtime_ns,
+                mode,
+                st.st_ino,
+            ):
+                digest = cached[4]
+            files[rel] = LocalFile(
+                path=path,
+                entry=FileEntry(
+                    size=st.st_size, mtime_ns=st.st_mtime_ns, mode=mode, digest=digest
+                ),
+                ino=st.st_ino,
+            )
+
+        if digests:
+            missing = [f for f in files.values() if not f.entry.digest]
+            with ThreadPoolExecutor(max(1, args.jobs)) as pool:
+                for f, digest in zip(missing, pool.map(file_digest, (file.path for file in missing))):
+                    f.entry.digest = digest
+        return files
+
+    def unchanged(self, files: Scan) -> bool:
+        """Whether ``files`` matches the manifest of the last push."""
+        if self.token is None or files.keys() != self.files.keys():
+            return False
+        for rel, f in files.items():
+            e = f.entry
+            if self.files[rel][:4] != (e.size, e.mtime_ns, e.mode, f.ino):
+                return False
+        return True
+
+    def save(self, files: Scan, token: str):
+        """Record a successful push."""
+        self.token = token
+        self.files = {
+            rel: (f.entry.size, f.entry.mtime_ns, f.entry.mode, f.ino, f.entry.digest)
+            for rel, f in files.items()
+        }
+        data = {"server": self.server, "token": token, "files": self.files}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write stat cache {self.path}: {e}")
@@ -0,0 +1,27 @@
+"""
+The client's websocket connection to a psync server, shared by runs and health
+checks.
+"""
+
+import ssl
+from pathlib import Path
+
+import websockets
+from websockets.typing import Origin
+
+from client.args import Args
+from common.data import MAX_MESSAGE_SIZE, Protocol
+
+
+def connect(args: Args) -> websockets.connect:
+    """Open a connection to the server in ``args``."""
+    ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ssl_ctx.load_verify_locations(Path(args.ssl_cert_path).expanduser())
+    ssl_ctx.check_hostname = False  # not ideal
+    return websockets.connect(
+        f"wss://{args.server_ip}:{args.server_port}",
+        ssl=ssl_ctx,
+        origin=Origin(f"wss://{args.client_origin}"),
+        subprotocols=[Protocol.Binary.value, Protocol.Text.value],
+        max_size=MAX_MESSAGE_SIZE,
+    )
@@ -0,0 +1,93 @@
+"""
+Fetching artifacts, files a run leaves on the server, back into a local directory.
+Each file is written to a temporary file next to its destination and moved into
+place once it is complete and its digest checks out, so that a partly fetched file
+never replaces a good one.
+"""
+
+import logging
+import os
+import zlib
+from pathlib import Path
+
+from common.data import ArtifactResp
+from common.sync import file_digest, resolve
+
+logger = logging.getLogger(__name__)
+
+
+def local_digests(directory: Path, patterns: list[str]) -> dict[str, str]:
+    """
+    Digests of the files in ``directory`` matching ``patterns``, which the server
+    does not send again if they are unchanged.
+    """
+    digests: dict[str, str] = {}
+    for pattern in patterns:
+        try:
+            paths = list(directory.glob(pattern))
+        except ValueError:
+            # The server reports invalid patterns.
+            continue
+        for path in paths:
+            rel = path.relative_to(directory).as_posix()
+            if rel not in digests and path.is_file():
+                digests[rel] = file_digest(path)
+    return digests
+
+
+class Fetcher:
+    """
+    Writes the :class:`common.data.ArtifactResp` chunks sent by the server into
+    ``directory``. The methods do blocking file I/O and are meant to be run off the
+    event loop.
+    """
+
+    directory: Path
+    __partial: dict[str, tuple[int, Path]]
+    """{[path: str]: (file descriptor, temporary path)} of incomplete files"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.__partial = {}
+
+    def write(self, resp: ArtifactResp):
+        """
+        Write a chunk. Raises ``ValueError`` if the chunk is out of order or the
+        file does not match its digest once complete.
+        """
+        path = resolve(self.directory, resp.path)
+        if resp.offset == 0:
+            self.__discard(resp.path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.psync-tmp")
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            self.__partial[resp.path] = (fd, tmp)
+        elif resp.path not in self.__partial:
+            raise ValueError(f"Got a chunk of artifact {resp.path!r} before its start")
+        fd, tmp = self.__partial[resp.path]
+        data = zlib.decompress(resp.data) if resp.compressed else resp.data
+        _ = os.pwrite(fd, data, resp.offset)
+        if resp.offset + len(data) < resp.entry.size:
+            return
+
+        _ = self.__partial.pop(resp.path)
+        os.close(fd)
+        if file_digest(tmp) != resp.entry.digest:
+            tmp.unlink(missing_ok=True)
+            raise ValueError(f"Artifact {resp.path!r} changed while it was sent")
+        tmp.chmod(resp.entry.mode)
+        os.utime(tmp, ns=(resp.entry.mtime_ns, resp.entry.mtime_ns))
+        os.replace(tmp, path)
+        logger.info(f"Fetched {path} ({resp.entry.size} bytes)")
+
+    def close(self):
+        """Discard every incomplete file."""
+        for rel in list(self.__partial):
+            self.__discard(rel)
+
+    def __discard(self, rel: str):
+        partial = self.__partial.pop(rel, None)
+        if partial is not None:
+            fd, tmp = partial
+            os.close(fd)
+            tmp.unlink(missing_ok=True)
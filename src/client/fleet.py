@@ -0,0 +1,153 @@
+"""
+Fan-out: syncing the project to several servers and running the executable on all of
+them at once, over one connection per server.
+"""
+
+import asyncio
+import dataclasses
+import logging
+import signal
+from collections.abc import Callable
+from pathlib import Path
+from typing import Protocol
+
+from client.args import Args, Logfile
+
+logger = logging.getLogger(__name__)
+
+
+class Client(Protocol):
+    """What the fleet needs of a :class:`client.main.PsyncClient`."""
+
+    async def run(self) -> None: ...
+    async def kill(self) -> None: ...
+    async def resize(self) -> None: ...
+
+
+def split_host(host: str, default_port: int) -> tuple[str, int]:
+    """
+    Split ``host[:port]`` into its address and port. IPv6 addresses with a port are
+    written in brackets, e.g. ``[::1]:5000``.
+    """
+    if host.startswith("["):
+        address, _, rest = host[1:].partition("]")
+        port = rest.removeprefix(":")
+        return address, int(port) if port else default_port
+    address, sep, port = host.rpartition(":")
+    if not sep or ":" in address:
+        return host, default_port
+    return address, int(port)
+
+
+def host_name(host: str) -> str:
+    """``host[:port]``, made safe for file names."""
+    return host.replace(":", "_").strip("[]")
+
+
+def host_path(path: Path, host: str) -> Path:
+    """
+    The file of one host. A ``{host}`` placeholder in the file's name is replaced by
+    the host, otherwise the file's name is prefixed with it.
+    """
+    name = host_name(host)
+    if "{host}" in str(path):
+        return Path(str(path).replace("{host}", name))
+    return path.with_name(f"{name}-{path.name}")
+
+
+def host_logfile(logfile: Logfile, host: str) -> Logfile:
+    """The log file of one host, if it is a file. See :func:`host_path`."""
+    if not isinstance(logfile, Path):
+        return logfile
+    return host_path(logfile, host)
+
+
+class Fleet:
+    """
+    Runs a client for each of ``args.hosts`` concurrently, made by
+    ``make_client(args, prefix)`` from the host's arguments and the prefix of its
+    lines on the terminal. The clients must not handle signals themselves: SIGINT
+    kills the runs on every host, and a second SIGINT exits without waiting for
+    them.
+    """
+
+    args: Args
+    clients: dict[str, Client]
+    __force_exit: bool = False
+
+    def __init__(self, args: Args, make_client: Callable[[Args, str], Client]):
+        self.args = args
+        self.clients = {}
+        width = max(len(host) for host in args.hosts)
+        for host in args.hosts:
+            if host in self.clients:
+                raise ValueError(f"Host {host} is given more than once")
+            prefix = f"[{host}] ".ljust(width + 3)
+            self.clients[host] = make_client(self.host_args(host), prefix)
+
+    def host_args(self, host: str) -> Args:
+        """Arguments of the client running on ``host``."""
+        address, port = split_host(host, self.args.server_port)
+        return dataclasses.replace(
+            self.args,
+            server_ip=address,
+            server_port=port,
+            hosts=[],
+            logfile=host_logfile(self.args.logfile, host),
+            stderr_file=host_logfile(self.args.stderr_file, host),
+            artifact_dir=self.args.artifact_dir / host_name(host),
+            stats_file=(
+                None if self.args.stats_file is None else host_path(self.args.stats_file, host)
+            ),
+        )
+
+    async def run(self) -> int:
+        """
+        Run on every host and wait for all of them. Returns 0 if the executable
+        succeeded everywhere, else the exit code of the first host it failed on, or
+        130 if it was interrupted.
+        """
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGINT, lambda: asyncio.create_task(self.__kill()))
+        if self.args.pty:
+            loop.add_signal_handler(
+                signal.SIGWINCH, lambda: asyncio.create_task(self.__resize())
+            )
+        codes = await asyncio.gather(
+            *(self.__run(host, client) for host, client in self.clients.items())
+        )
+        failed = [(host, code) for host, code in zip(self.clients, codes) if code != 0]
+        for host, code in failed:
+            logger.error(f"{host}: exited with code {code}")
+        logger.info(f"Succeeded on {len(codes) - len(failed)} of {len(codes)} hosts")
+        if self.__force_exit:
+            return 130
+        return failed[0][1] if failed else 0
+
+    async def __run(self, host: str, client: Client) -> int:
+        """Run the client for one host and return its exit code."""
+        try:
+            await client.run()
+            return 0
+        except SystemExit as e:
+            # The server reports exit codes as strings.
+            try:
+                return int(e.code or 0)
+            except ValueError:
+                return 1
+        except Exception:
+            # One host failing must not stop the others, whatever went wrong.
+            logger.exception(f"{host}: run failed")
+            return 1
+
+    async def __kill(self):
+        if self.__force_exit:
+            logger.warning("Got second SIGINT, shutting down")
+            asyncio.get_event_loop().stop()
+            raise SystemExit(1)
+        logger.info("Gracefully shutting down...")
+        self.__force_exit = True
+        _ = await asyncio.gather(*(client.kill() for client in self.clients.values()))
+
+    async def __resize(self):
+        _ = await asyncio.gather(*(client.resize() for client in self.clients.values()))
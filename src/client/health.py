@@ -0,0 +1,103 @@
+"""
+Health checks of psync servers, and picking the least loaded of several servers to
+run on.
+"""
+
+import asyncio
+import dataclasses
+import logging
+
+import websockets
+
+from client.args import Args
+from client.connection import connect
+from client.fleet import split_host
+from common.data import (
+    HealthCheckReq,
+    HealthResp,
+    OkayResp,
+    negotiated,
+    pack,
+    unpack,
+)
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 5.0
+"""Seconds to wait for a server's health check before passing it over."""
+
+
+class HealthCheckError(Exception):
+    """The server replied to a health check with something else."""
+
+
+async def probe(args: Args) -> HealthResp | OkayResp:
+    """
+    Health check the server in ``args``. Servers which only speak the text protocol
+    reply with :class:`common.data.OkayResp`, without their load.
+    """
+    async with connect(args) as ws:
+        protocol = negotiated(ws.subprotocol)
+        await ws.send(pack(HealthCheckReq(path=args.server_dest), protocol))
+        resp = unpack(await ws.recv(), protocol)
+    if not isinstance(resp, (HealthResp, OkayResp)):
+        raise HealthCheckError(f"Unexpected reply to health check: {resp}")
+    return resp
+
+
+def runs_per_slot(health: HealthResp) -> float:
+    """Runs running or waiting on a server, per slot."""
+    return (health.running + health.queued) / max(health.slots, 1)
+
+
+def busyness(health: HealthResp) -> float:
+    """
+    How busy a server is: the larger of its runs per slot and its load average per
+    CPU.
+    """
+    return max(runs_per_slot(health), health.load / max(health.cpus, 1))
+
+
+async def least_loaded(args: Args) -> Args | None:
+    """
+    Health check each of ``args.hosts`` at once, and return the arguments for the
+    least busy of them. Ties go to the server with the fewest runs per slot, then
+    the one with the most free memory; servers which do not report their load come
+    last. ``None`` if no server replied.
+    """
+
+    async def check(host: str) -> tuple[Args, HealthResp | OkayResp] | None:
+        address, port = split_host(host, args.server_port)
+        host_args = dataclasses.replace(args, server_ip=address, server_port=port, hosts=[])
+        try:
+            health = await asyncio.wait_for(probe(host_args), PROBE_TIMEOUT)
+        except (
+            HealthCheckError,
+            OSError,
+            TimeoutError,
+            ValueError,
+            websockets.WebSocketException,
+        ) as e:
+            logger.warning(f"{host}: health check failed: {e}")
+            return None
+        if isinstance(health, HealthResp):
+            logger.info(
+                f"{host}: {health.running}/{health.slots} slots busy, "
+                + f"{health.queued} queued, load {health.load:.2f} on {health.cpus} CPUs, "
+                + f"{health.mem_free / 2**30:.1f} GiB memory and "
+                + f"{health.disk_free / 2**30:.1f} GiB disk free"
+            )
+        return host_args, health
+
+    def key(checked: tuple[Args, HealthResp | OkayResp]) -> tuple[bool, float, float, int]:
+        health = checked[1]
+        if not isinstance(health, HealthResp):
+            return (True, 0.0, 0.0, 0)
+        return (False, busyness(health), runs_per_slot(health), -health.mem_free)
+
+    checked = [c for c in await asyncio.gather(*map(check, args.hosts)) if c is not None]
+    if not checked:
+        return None
+    best, _health = min(checked, key=key)
+    logger.info(f"Running on {best.server_ip}:{best.server_port}")
+    return best
@@ -5,183 +5,460 @@ psync client
 import asyncio
 import logging
 import os
+import shutil
 import signal
-import ssl
-import subprocess
 import sys
-from io import TextIOWrapper
-from pathlib import Path
-from typing import TYPE_CHECKING, Any
+import time
+import uuid
+from dataclasses import dataclass, field
 
 import websockets
-from websockets.typing import Origin
+from websockets import ConnectionClosedError
 
 from client.args import (
     Args,
     parse_args,
 )
+from client.connection import connect
+from client.fetch import Fetcher, local_digests
+from client.fleet import Fleet
+from client.health import least_loaded
+from client.output import OutputWriter, open_output
+from client.ssh import control
+from client.stats import summary, write_stats
+from client.sync import SyncError, sync
+from client.watch import Watcher
 from common.data import (
+    ArtifactResp,
+    AttachReq,
+    DataResp,
     ErrorResp,
     ExitResp,
     KillReq,
     LogResp,
     OkayResp,
     OpenReq,
+    Protocol,
+    QueuedResp,
+    Req,
+    ResizeReq,
+    Resp,
     SetPidResp,
-    deserialize,
-    serialize,
+    StatsResp,
+    SyncResp,
+    TreeResp,
+    Usage,
+    negotiated,
+    pack,
+    unpack,
 )
 from common.log import InterceptHandler
 
-if TYPE_CHECKING:
+logger = logging.getLogger(__name__)
 
-    from _typeshed import SupportsWrite
-    Logfile = SupportsWrite[str]
-else:
-    Logfile = Any
+
+@dataclass
+class Run:
+    """A process started by the client over its connection."""
+
+    run_id: str
+    outfile: OutputWriter
+    """Where the process' output is written."""
+    pid: int | None = None
+    offset: int = 0
+    """Offset in the run's output up to which it was received."""
+    stderr_offset: int = 0
+    """Offset in the run's stderr up to which it was received, if it is split."""
+    samples: list[Usage] = field(default_factory=list)
+    """Samples of the run's resource usage, if they were asked for."""
+    exited: asyncio.Event = field(default_factory=asyncio.Event)
 
 
 class PsyncClient:
     """
     The primary interface for psync. The client CLI allows users to sync files with
-    rsync, then execute them remotely while receiving the logs.
+    rsync or the native sync engine, then execute them remotely while receiving the
+    logs.
     """
 
     args: Args
     pid: int | None = None
-    """ID of the current connection."""
+    """Remote PID of the current run."""
     __force_exit: bool = False
-    __outfile: Logfile
+    __outfile: OutputWriter
+    __errfile: OutputWriter | None = None
+    """Where the executable's stderr is written, when it is split from stdout."""
+    __protocol: Protocol = Protocol.Text
+    __runs: dict[str, Run]
+    """Runs which have not exited yet, by run ID."""
+    __current: Run | None = None
+    """The run started for the executable, restarted on every change in watch mode."""
+    __replies: asyncio.Queue[Req | Resp] | None = None
+    """While syncing in watch mode, receives the server's replies to the sync."""
+    __ws: websockets.ClientConnection | None = None
+    """The current connection to the server."""
+    __stats_written: bool = False
+    __fetcher: Fetcher | None = None
+    """Writes the artifacts fetched back from the server, if any were asked for."""
+    __handle_signals: bool
 
-    def __init__(self, args: Args):
+    def __init__(self, args: Args, prefix: str = "", handle_signals: bool = True):
+        """
+        ``prefix`` is prepended to every line written to the terminal. Unless
+        ``handle_signals`` is set, the caller is responsible for calling
+        :meth:`kill` on SIGINT and :meth:`resize` on SIGWINCH.
+        """
         self.args = args
-        if isinstance(self.args.logfile, Path):
-            self.__outfile = open(self.args.logfile, "w")
-        elif self.args.logfile is not None:
-            self.__outfile = self.args.logfile
-        else:
-            self.__outfile = sys.stdout
+        self.__runs = {}
+        self.__handle_signals = handle_signals
+        self.__outfile = open_output(args, prefix=prefix)
+        if args.split_stderr:
+            self.__errfile = open_output(args, stderr=True, prefix=prefix)
+        if args.artifacts:
+            self.__fetcher = Fetcher(args.artifact_dir)
 
     def __enter__(self):
         return self
 
     def __exit__(self):
-        if isinstance(self.__outfile, TextIOWrapper):
-            self.__outfile.close()
+        self.__outfile.close()
+        if self.__errfile is not None:
+            self.__errfile.close()
+
+    async def __send(self, ws: websockets.ClientConnection, msg: Req):
+        await ws.send(pack(msg, self.__protocol))
+
+    async def kill(self):
+        """Kill every run which has not exited yet."""
+        ws = self.__ws
+        if ws is None:
+            return
+        try:
+            for run in list(self.__runs.values()):
+                await self.__send(ws, KillReq(pid=run.pid or 0, run_id=run.run_id))
+        except websockets.ConnectionClosed:
+            pass
 
     def __mk_handler(self, ws: websockets.ClientConnection):
         async def inner():
             if not self.__force_exit:
-                logging.info("Gracefully shutting down...")
+                logger.info("Gracefully shutting down...")
                 self.__force_exit = True
-                if self.pid is not None:
-                    await ws.send(serialize(KillReq(pid=self.pid)))
+                await self.kill()
                 await ws.close()
                 asyncio.get_event_loop().stop()
                 raise SystemExit(130)
             else:
-                logging.warning("Got second SIGINT, shutting down")
+                logger.warning("Got second SIGINT, shutting down")
                 asyncio.get_event_loop().stop()
                 raise SystemExit(1)
 
         return lambda: asyncio.create_task(inner())
 
     async def run(self):
-        """Run the client instance."""
-        ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-        ssl_ctx.load_verify_locations(Path(self.args.ssl_cert_path).expanduser())
-        ssl_ctx.check_hostname = False  # not ideal
-        async with websockets.connect(
-            f"wss://{self.args.server_ip}:{self.args.server_port}",
-            ssl=ssl_ctx,
-            origin=Origin(f"wss://{self.args.client_origin}"),
-        ) as ws:
-            asyncio.get_event_loop().add_signal_handler(
-                signal.SIGINT, self.__mk_handler(ws)
-            )
-            await ws.send(
-                serialize(
-                    OpenReq(
-                        path=self.args.destination_path(),
-                        env=self.args.env,
-                        args=self.args.args,
+        """
+        Run the client instance. If the connection drops while the executable is
+        running, reconnect and resume its output where it left off. The output is
+        written out before this returns.
+        """
+        attempt = 0
+        try:
+            while True:
+                try:
+                    async with connect(self.args) as ws:
+                        attempt = 0
+                        await self.__session(ws)
+                        return
+                except (ConnectionClosedError, OSError) as e:
+                    resumable = self.__protocol is Protocol.Binary and (
+                        self.__runs or (self.args.watch and self.__current is not None)
                     )
+                    if not resumable or attempt >= self.args.reconnect:
+                        raise
+                    attempt += 1
+                    logger.warning(
+                        f"Connection lost ({e}), reconnecting ({attempt}/{self.args.reconnect})..."
+                    )
+                    await asyncio.sleep(min(attempt, 5))
+        finally:
+            self.__outfile.close()
+            if self.__errfile is not None:
+                self.__errfile.close()
+            if self.__fetcher is not None:
+                self.__fetcher.close()
+
+    async def __session(self, ws: websockets.ClientConnection):
+        """
+        Sync and start the executable, or re-attach to it after reconnecting, then
+        handle messages until it exits.
+        """
+        self.__ws = ws
+        self.__protocol = negotiated(ws.subprotocol)
+        logger.debug(f"Negotiated {self.__protocol.name} protocol")
+        if self.args.raw and self.__protocol is Protocol.Text:
+            logger.warning("The server does not support raw output; output is decoded")
+        if self.args.pty and self.__protocol is Protocol.Text:
+            logger.warning("The server does not support pseudo-terminals")
+        if self.args.split_stderr and self.__protocol is Protocol.Text:
+            logger.warning("The server does not support splitting stderr")
+        if self.__handle_signals:
+            loop = asyncio.get_event_loop()
+            loop.add_signal_handler(signal.SIGINT, self.__mk_handler(ws))
+            if self.args.pty and self.__protocol is Protocol.Binary:
+                loop.add_signal_handler(
+                    signal.SIGWINCH, lambda: asyncio.create_task(self.resize())
+                )
+        if self.__current is None:
+            await sync(ws, self.__protocol, self.args)
+            self.__current = await self.__open(ws, self.__outfile)
+        else:
+            for run in self.__runs.values():
+                logger.info(f"Re-attaching to run {run.run_id} at offset {run.offset}")
+                await self.__send(
+                    ws, AttachReq(run.run_id, run.offset, run.stderr_offset)
                 )
+            if self.args.pty:
+                await self.resize()
+        if self.args.watch:
+            await self.__watch(ws)
+        else:
+            await self.__recv(ws)
+
+    async def __open(self, ws: websockets.ClientConnection, outfile: OutputWriter) -> Run:
+        """
+        Start the executable as a new run, writing its output to ``outfile``. The text
+        protocol cannot carry run IDs, so its runs all share the empty ID.
+        """
+        run_id = uuid.uuid4().hex if self.__protocol is Protocol.Binary else ""
+        run = Run(run_id, outfile)
+        self.__runs[run_id] = run
+        cols, rows = shutil.get_terminal_size((0, 0))
+        digests = {}
+        if self.args.artifacts:
+            digests = await asyncio.to_thread(
+                local_digests, self.args.artifact_dir, self.args.artifacts
             )
-            async for data in ws:
-                if isinstance(data, bytes):
-                    msg = data.decode()
-                else:
-                    msg = data
+        await self.__send(
+            ws,
+            OpenReq(
+                path=self.args.destination_path(),
+                env=self.args.env,
+                args=self.args.args,
+                run_id=run_id,
+                priority=self.args.priority,
+                raw=self.args.raw,
+                filter=self.args.log_filter,
+                split_stderr=self.args.split_stderr,
+                pty=self.args.pty,
+                rows=rows,
+                cols=cols,
+                limits=self.args.limits,
+                stats_interval=self.args.stats_interval,
+                artifacts=self.args.artifacts,
+                artifact_digests=digests,
+                cache=self.args.cache,
+            ),
+        )
+        return run
 
-                try:
-                    resp = deserialize(msg)
-                except ValueError as e:
-                    logging.error(
-                        f"Failed to deserialize message '{msg}' with error '{e}'"
-                    )
-                    await ws.close()
-                    raise Exception(e)
-
-                match resp:
-                    case LogResp():
-                        print(resp.msg, end="", file=self.__outfile)
-                    case ErrorResp():
-                        logging.error(f"Received server error: {resp.msg}")
+    async def __recv(self, ws: websockets.ClientConnection):
+        """
+        Handle messages from the server until the connection closes. Outside of watch
+        mode, this exits when the executable does.
+        """
+        async for data in ws:
+            try:
+                resp = unpack(data, self.__protocol)
+            except ValueError as e:
+                logger.error(
+                    f"Failed to deserialize message '{data!r}' with error '{e}'"
+                )
+                await ws.close()
+                raise
+
+            if self.__replies is not None and isinstance(
+                resp, (ErrorResp, OkayResp, SyncResp, TreeResp)
+            ):
+                self.__replies.put_nowait(resp)
+                continue
+
+            match resp:
+                case LogResp() | DataResp():
+                    self.__output(resp)
+                case ErrorResp():
+                    logger.error(f"Received server error: {resp.msg}")
+                    if not self.args.watch:
                         await ws.close()
                         raise Exception(resp.msg)
-                    case ExitResp():
-                        logging.info(f"Exiting with code {resp.exit_code}")
+                    run = self.__runs.get(resp.run_id)
+                    if run is not None and run.pid is None:
+                        # The run failed to start.
+                        self.__exit_run(run)
+                case ExitResp():
+                    if resp.cached:
+                        logger.info("Replayed the cached result of an identical run")
+                    if resp.filtered:
+                        logger.info(f"Filtered out {resp.filtered} lines of output")
+                    self.__stats(resp)
+                    if not self.args.watch:
+                        logger.info(f"Exiting with code {resp.exit_code}")
                         await ws.close()
                         raise SystemExit(resp.exit_code)
-                    case SetPidResp():
-                        logging.info(f"Remote PID = {resp.pid}")
+                    logger.info(f"Process exited with code {resp.exit_code}")
+                    run = self.__runs.get(resp.run_id)
+                    if run is not None:
+                        self.__exit_run(run)
+                case SetPidResp():
+                    logger.info(f"Remote PID = {resp.pid}")
+                    run = self.__runs.get(resp.run_id)
+                    if run is not None:
+                        run.pid = resp.pid
+                    if run is self.__current:
                         self.pid = resp.pid
-                    case OkayResp():
-                        logging.info("OK.")
-                    case _:
-                        logging.warning(f"Got unknown request {resp}")
-
-
-def __rsync(args: Args):
-    """Runs rsync."""
-    rsync_args = [
-        "rsync",
-        "-avzr",
-        "-e",
-        f"/usr/bin/ssh {args.ssh_args} -p {str(args.server_ssh_port)}",
-        "--progress",
-        "--mkpath",
-        "--delete",
-        args.target_path,
-        *args.assets,
-        args.rsync_url(),
-    ]
-    logging.info(" ".join(rsync_args))
-    p = subprocess.run(rsync_args)
-    if p.returncode != 0:
-        msg = f"Rsync failed with exit code {p.returncode}"
-        logging.error(msg)
-        raise Exception(msg)
+                case ArtifactResp():
+                    if self.__fetcher is not None:
+                        try:
+                            await asyncio.to_thread(self.__fetcher.write, resp)
+                        except (OSError, ValueError) as e:
+                            logger.error(f"Failed to fetch {resp.path}: {e}")
+                case StatsResp():
+                    logger.debug(f"Run {resp.run_id}: {summary(resp.usage)}")
+                    run = self.__runs.get(resp.run_id)
+                    if run is not None:
+                        run.samples.append(resp.usage)
+                case QueuedResp():
+                    wait = "" if resp.eta is None else f", about {resp.eta:.0f}s to wait"
+                    logger.info(f"Server is busy; queued at position {resp.position}{wait}")
+                case OkayResp():
+                    logger.info("OK.")
+                case _:
+                    logger.warning(f"Got unknown request {resp}")
+
+    async def __watch(self, ws: websockets.ClientConnection):
+        """
+        Watch mode: on every change, sync it, then kill the running executable and
+        start it again, all over the same connection.
+        """
+        receiver = asyncio.create_task(self.__recv(ws))
+        sources = [self.args.target_path, *self.args.assets]
+        with Watcher(sources, self.args.watch_debounce_ms / 1000) as watcher:
+            logger.info(f"Watching {' '.join(sources)} for changes...")
+            try:
+                while True:
+                    changes = asyncio.create_task(watcher.changes())
+                    done, _pending = await asyncio.wait(
+                        [receiver, changes], return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if receiver in done:
+                        _ = changes.cancel()
+                        return await receiver
+
+                    start = time.perf_counter()
+                    changed = await changes
+                    logger.info(
+                        f"Changed: {' '.join(sorted(str(p) for p in changed))}"
+                    )
+                    self.__replies = asyncio.Queue()
+                    try:
+                        await sync(ws, self.__protocol, self.args, self.__replies.get)
+                    except (SyncError, OSError, ValueError) as e:
+                        logger.error(f"Sync failed, waiting for further changes: {e}")
+                        continue
+                    finally:
+                        self.__replies = None
+                    run = self.__current
+                    if run is not None and run.run_id in self.__runs:
+                        if run.pid is not None or run.run_id:
+                            await self.__send(
+                                ws, KillReq(pid=run.pid or 0, run_id=run.run_id)
+                            )
+                        _ = await run.exited.wait()
+                    self.__current = await self.__open(ws, self.__outfile)
+                    logger.info(f"Restarted in {time.perf_counter() - start:.3f}s")
+            finally:
+                _ = receiver.cancel()
+
+    def __output(self, resp: LogResp | DataResp):
+        """Write output of a run, to the stderr writer if it is from stderr."""
+        run = self.__runs.get(resp.run_id)
+        data = resp.msg.encode() if isinstance(resp, LogResp) else resp.data
+        if resp.fd == 2 and self.__errfile is not None:
+            self.__errfile.write(data)
+        else:
+            (self.__outfile if run is None else run.outfile).write(data)
+        if run is None:
+            return
+        if resp.fd == 2:
+            run.stderr_offset = resp.offset
+        else:
+            run.offset = resp.offset
+
+    async def resize(self):
+        """Propagate a change of the terminal's size to the runs."""
+        ws = self.__ws
+        cols, rows = shutil.get_terminal_size((0, 0))
+        if ws is None or not self.args.pty or rows <= 0 or cols <= 0:
+            return
+        try:
+            for run in list(self.__runs.values()):
+                await self.__send(ws, ResizeReq(run.run_id, rows, cols))
+        except websockets.ConnectionClosed:
+            # The run gets the current size when re-attaching.
+            pass
+
+    def __stats(self, resp: ExitResp):
+        """Report the resources used by a run which exited."""
+        if resp.usage is not None:
+            logger.info(f"Used {summary(resp.usage)}")
+        path = self.args.stats_file
+        if path is None:
+            return
+        run = self.__runs.get(resp.run_id)
+        samples = [] if run is None else run.samples
+        try:
+            write_stats(
+                path, resp.run_id, resp.exit_code, resp.usage, samples, self.__stats_written
+            )
+            self.__stats_written = True
+        except OSError as e:
+            logger.error(f"Failed to write stats to {path}: {e}")
+
+    def __exit_run(self, run: Run):
+        _ = self.__runs.pop(run.run_id, None)
+        run.exited.set()
+        if run is self.__current:
+            self.pid = None
 
 
 def main(args: Args | None = None):
     """
     The main executable.
-    Sync project files with rsync, then run the client.
+    Sync project files, then run the client.
     """
     log_level = os.environ.get("PSYNC_LOG", "INFO").upper()
     logging.basicConfig(handlers=[InterceptHandler()], level=log_level, force=True)
 
     args = parse_args() if args is None else args
-    __rsync(args)
+    if args.ssh_control is not None:
+        sys.exit(control(args, args.ssh_control))
+    if args.hosts and args.balance:
+        best = asyncio.run(least_loaded(args))
+        if best is None:
+            logger.error("None of the servers replied to the health check")
+            sys.exit(1)
+        args = best
+    if args.hosts:
+        fleet = Fleet(
+            args, lambda args, prefix: PsyncClient(args, prefix, handle_signals=False)
+        )
+        sys.exit(asyncio.run(fleet.run()))
 
     try:
         asyncio.run(PsyncClient(args).run())
     except SystemExit as e:
-        exit(e.code)
+        sys.exit(e.code)
     except Exception:
-        exit(1)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
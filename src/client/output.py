@@ -0,0 +1,234 @@
+"""
+Writes the executable's output from a background thread, so that a slow terminal
+or a large log file does not hold up receiving messages from the server.
+"""
+
+import atexit
+import codecs
+import gzip
+import sys
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Protocol
+
+from client.args import LOG_COMPRESSIONS, Args
+
+if TYPE_CHECKING:
+    from _typeshed import SupportsWrite
+
+_MAX_BUFFER = 64 * 2**20
+"""Bytes buffered before writes wait for the writer thread to catch up."""
+
+_MAX_LINE = 64 * 1024
+"""Length after which an incomplete line is prefixed without waiting for its end."""
+
+
+class Target(Protocol):
+    """Where the writer thread writes output."""
+
+    def write(self, data: bytes, /) -> object: ...
+    def close(self) -> object: ...
+
+
+class _Stream:
+    """A binary stream, flushed after every write. Not closed by the writer."""
+
+    stream: BinaryIO
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+
+    def write(self, data: bytes):
+        _ = self.stream.write(data)
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class _Text:
+    """A text stream, which output is decoded for. Not closed by the writer."""
+
+    stream: "SupportsWrite[str]"
+    decoder: codecs.IncrementalDecoder
+
+    def __init__(self, stream: "SupportsWrite[str]"):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def write(self, data: bytes):
+        _ = self.stream.write(self.decoder.decode(data))
+
+    def close(self):
+        _ = self.stream.write(self.decoder.decode(b"", final=True))
+
+
+class _Prefixed:
+    """
+    Writes output to ``target`` one line at a time, each prefixed with ``prefix``,
+    so that the output of several runs sharing a terminal does not interleave within
+    a line.
+    """
+
+    target: Target
+    prefix: bytes
+    partial: bytes
+    """Incomplete last line."""
+
+    def __init__(self, target: Target, prefix: str):
+        self.target = target
+        self.prefix = prefix.encode()
+        self.partial = b""
+
+    def write(self, data: bytes):
+        *lines, rest = (self.partial + data).split(b"\n")
+        self.partial = b""
+        if len(rest) >= _MAX_LINE:
+            lines.append(rest)
+        elif rest:
+            self.partial = rest
+        if lines:
+            _ = self.target.write(b"".join(self.prefix + line + b"\n" for line in lines))
+
+    def close(self):
+        if self.partial:
+            _ = self.target.write(self.prefix + self.partial + b"\n")
+            self.partial = b""
+        _ = self.target.close()
+
+
+def compression_for(path: Path, compression: str = "auto") -> str:
+    """Resolve ``auto`` compression by the extension of ``path``."""
+    if compression not in LOG_COMPRESSIONS:
+        raise ValueError(f"Unknown log compression {compression!r}")
+    if compression != "auto":
+        return compression
+    match path.suffix:
+        case ".gz":
+            return "gzip"
+        case ".zst" | ".zstd":
+            return "zstd"
+        case _:
+            return "none"
+
+
+def open_log(path: Path, compression: str = "auto") -> Target:
+    """Open a log file for writing, compressed as requested."""
+    match compression_for(path, compression):
+        case "gzip":
+            return gzip.open(path, "wb")
+        case "zstd":
+            return _open_zstd(path)
+        case _:
+            return open(path, "wb")
+
+
+def _open_zstd(path: Path) -> Target:
+    try:
+        from compression import zstd  # pyright: ignore[reportMissingImports, reportUnknownVariableType]
+
+        return zstd.open(path, "wb")  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+    except ImportError:
+        pass
+    try:
+        import zstandard  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        raise ValueError("zstd compression needs Python 3.14 or the zstandard package")
+    compressor = zstandard.ZstdCompressor()  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+    return compressor.stream_writer(open(path, "wb"))  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+
+
+class OutputWriter:
+    """
+    Buffers output and writes it to each of ``targets`` from a background thread.
+    Buffered output is written once ``flush_bytes`` are buffered or ``flush_ms``
+    after the first of them arrived, and when the writer is closed, at the latest at
+    interpreter exit. Targets are closed with the writer.
+
+    Files keep their own buffers, and compressed files are only flushed when closed,
+    so that frequent small writes do not hurt compression.
+    """
+
+    targets: list[Target]
+    flush_bytes: int
+    flush_ms: float
+    __buffer: bytearray
+    __changed: threading.Condition
+    __closed: bool = False
+    __thread: threading.Thread
+
+    def __init__(
+        self, targets: list[Target], flush_bytes: int = 64 * 1024, flush_ms: float = 50
+    ):
+        self.targets = targets
+        self.flush_bytes = flush_bytes
+        self.flush_ms = flush_ms
+        self.__buffer = bytearray()
+        self.__changed = threading.Condition()
+        self.__thread = threading.Thread(target=self.__work, name="output", daemon=True)
+        self.__thread.start()
+        _ = atexit.register(self.close)
+
+    def write(self, data: bytes):
+        """Buffer output. Only waits if the writer thread is far behind."""
+        with self.__changed:
+            while len(self.__buffer) >= _MAX_BUFFER and self.__thread.is_alive():
+                _ = self.__changed.wait()
+            self.__buffer += data
+            self.__changed.notify()
+
+    def close(self):
+        """Write out everything buffered, then close the targets."""
+        with self.__changed:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__changed.notify()
+        self.__thread.join()
+        atexit.unregister(self.close)
+
+    def __work(self):
+        while True:
+            with self.__changed:
+                _ = self.__changed.wait_for(lambda: self.__buffer or self.__closed)
+                if not self.__closed and len(self.__buffer) < self.flush_bytes:
+                    _ = self.__changed.wait_for(
+                        lambda: self.__closed or len(self.__buffer) >= self.flush_bytes,
+                        self.flush_ms / 1000,
+                    )
+                data = bytes(self.__buffer)
+                self.__buffer.clear()
+                closed = self.__closed
+                self.__changed.notify_all()
+            for target in self.targets:
+                try:
+                    _ = target.write(data)
+                except OSError as e:
+                    print(f"Failed to write output: {e}", file=sys.stderr)
+            if closed:
+                break
+        for target in self.targets:
+            try:
+                _ = target.close()
+            except OSError as e:
+                print(f"Failed to close output: {e}", file=sys.stderr)
+
+
+def open_output(args: Args, stderr: bool = False, prefix: str = "") -> OutputWriter:
+    """
+    Writer for the executable's output: the log file if there is one, else stdout,
+    or both with ``tee``. With ``stderr``, the writer for the executable's stderr,
+    when it is split from stdout: the stderr log file if there is one, else stderr,
+    or both with ``tee``. Lines written to stdout or stderr are prefixed with
+    ``prefix``, if given.
+    """
+    logfile = args.stderr_file if stderr else args.logfile
+    targets: list[Target] = []
+    if isinstance(logfile, Path):
+        targets.append(open_log(logfile, args.log_compression))
+    elif logfile is not None:
+        targets.append(_Text(logfile))
+    if logfile is None or args.tee:
+        console: Target = _Stream(sys.stderr.buffer if stderr else sys.stdout.buffer)
+        targets.append(_Prefixed(console, prefix) if prefix else console)
+    return OutputWriter(targets, args.output_flush_bytes, args.output_flush_ms)
@@ -0,0 +1,181 @@
+"""
+Parallel rsync transfers. The project's files are split into size-balanced
+partitions, each transferred by its own rsync process.
+"""
+
+import asyncio
+import heapq
+import logging
+import re
+import shlex
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from client.args import Args
+from client.ssh import ssh_command
+from common.sync import walk
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Partition:
+    """Files transferred by one worker, grouped by the directory they are relative to."""
+
+    size: int = 0
+    files: dict[Path, list[str]] = field(default_factory=dict)
+
+
+def partition(args: Args, jobs: int) -> list[Partition]:
+    """
+    Split the project's files into at most ``jobs`` partitions of roughly equal
+    total size, assigning the largest files first to the smallest partition.
+    """
+    files: list[tuple[int, Path, str]] = []
+    for source in [args.target_path, *args.assets]:
+        src = Path(source)
+        base = src if source.endswith("/") and src.is_dir() else src.parent
+        for rel, path in walk([source]):
+            files.append((path.stat().st_size, base, rel))
+    files.sort(key=lambda f: f[0], reverse=True)
+
+    partitions = [Partition() for _ in range(max(1, min(jobs, len(files))))]
+    heap = [(0, i) for i in range(len(partitions))]
+    for size, base, rel in files:
+        total, i = heapq.heappop(heap)
+        partitions[i].size += size
+        partitions[i].files.setdefault(base, []).append(rel)
+        heapq.heappush(heap, (total + size, i))
+    return partitions
+
+
+_PROGRESS = re.compile(rb"^\s*([\d,]+)\s+\d+%")
+
+
+class Progress:
+    """Aggregates the progress reported by every worker into a single status line."""
+
+    total: int
+    __done: list[int]
+    __current: list[int]
+
+    def __init__(self, workers: int, total: int):
+        self.total = total
+        self.__done = [0] * workers
+        self.__current = [0] * workers
+
+    def update(self, worker: int, transferred: int):
+        self.__current[worker] = transferred
+        self.__show()
+
+    def finish(self, worker: int):
+        self.__done[worker] += self.__current[worker]
+        self.__current[worker] = 0
+
+    def close(self):
+        print(file=sys.stderr)
+
+    def __show(self):
+        done = sum(self.__done) + sum(self.__current)
+        pct = 100 * done // self.total if self.total else 100
+        print(
+            f"\r{done / 2**20:10.1f} / {self.total / 2**20:.1f} MiB ({pct:3d}%)"
+            + f" over {len(self.__done)} streams",
+            end="",
+            file=sys.stderr,
+        )
+
+
+async def __worker(args: Args, index: int, part: Partition, progress: Progress):
+    for base, rels in part.files.items():
+        cmd = [
+            "rsync",
+            "-az",
+            "-e",
+            shlex.join(ssh_command(args)),
+            "--mkpath",
+            "--delay-updates",
+            "--info=progress2",
+            "--no-inc-recursive",
+            "--files-from=-",
+            f"{base}/",
+            args.rsync_url(),
+        ]
+        logger.debug(shlex.join(cmd))
+        p = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        try:
+            assert p.stdin is not None and p.stdout is not None
+            p.stdin.write("\n".join(rels).encode())
+            p.stdin.close()
+            buf = b""
+            while chunk := await p.stdout.read(4096):
+                *lines, buf = re.split(rb"[\r\n]", buf + chunk)
+                for line in lines:
+                    match = _PROGRESS.match(line)
+                    if match is not None:
+                        progress.update(index, int(match.group(1).replace(b",", b"")))
+            code = await p.wait()
+        except BaseException:
+            if p.returncode is None:
+                p.terminate()
+                _ = await p.wait()
+            raise
+        if code != 0:
+            raise subprocess.CalledProcessError(code, cmd)
+        progress.finish(index)
+
+
+async def __delete_extraneous(args: Args):
+    # Transfers nothing, but deletes files the project no longer has.
+    cmd = [
+        "rsync",
+        "-r",
+        "-e",
+        shlex.join(ssh_command(args)),
+        "--existing",
+        "--ignore-existing",
+        "--delete",
+        args.target_path,
+        *args.assets,
+        args.rsync_url(),
+    ]
+    logger.debug(shlex.join(cmd))
+    p = await asyncio.create_subprocess_exec(*cmd)
+    code = await p.wait()
+    if code != 0:
+        raise subprocess.CalledProcessError(code, cmd)
+
+
+async def rsync_parallel(args: Args):
+    """
+    Sync the project with ``args.jobs`` concurrent rsync processes. If any worker
+    fails, the others are stopped and the sync fails with the first worker's error
+    (``subprocess.CalledProcessError`` if rsync failed), before extraneous files
+    are deleted.
+
+    Failure is per partition, not atomic: each worker moves its files into place
+    once its own partition is transferred, so partitions which finished before the
+    failure are left updated on the server. The next successful sync completes the
+    tree.
+    """
+    partitions = partition(args, args.jobs)
+    total = sum(p.size for p in partitions)
+    logger.info(
+        f"Syncing {total / 2**20:.1f} MiB over {len(partitions)} rsync streams"
+    )
+    progress = Progress(len(partitions), total)
+    try:
+        async with asyncio.TaskGroup() as group:
+            for i, part in enumerate(partitions):
+                _ = group.create_task(__worker(args, i, part, progress))
+    except ExceptionGroup as e:
+        progress.close()
+        raise e.exceptions[0] from e
+    progress.close()
+    await __delete_extraneous(args)
@@ -0,0 +1,68 @@
+"""
+SSH transport for rsync. Connections are multiplexed over a persistent SSH master
+so that only the first sync to a server pays for the SSH handshake.
+"""
+
+import logging
+import os
+import shlex
+import subprocess
+import tempfile
+from pathlib import Path
+
+from client.args import Args
+
+logger = logging.getLogger(__name__)
+
+
+def runtime_dir() -> Path:
+    """Directory holding the SSH control sockets. Created if needed."""
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base:
+        path = Path(base) / "psync"
+    else:
+        path = Path(tempfile.gettempdir()) / f"psync-{os.getuid()}"
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return path
+
+
+def control_options(args: Args) -> list[str]:
+    """
+    SSH options sharing one master connection per server address, port and user.
+    Empty if multiplexing is disabled.
+    """
+    if args.ssh_persist <= 0:
+        return []
+    return [
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        # %C hashes the local host, remote host, port and user.
+        f"ControlPath={runtime_dir() / '%C'}",
+        "-o",
+        f"ControlPersist={args.ssh_persist}",
+    ]
+
+
+def ssh_command(args: Args) -> list[str]:
+    """The SSH command used as rsync's remote shell."""
+    return [
+        "/usr/bin/ssh",
+        *shlex.split(args.ssh_args),
+        "-p",
+        str(args.server_ssh_port),
+        *control_options(args),
+    ]
+
+
+def control(args: Args, command: str) -> int:
+    """
+    Send a control command (``check`` or ``exit``) to the SSH master for the
+    configured server. Returns SSH's exit code.
+    """
+    if args.ssh_persist <= 0:
+        logger.error("SSH multiplexing is disabled (PSYNC_SSH_PERSIST=0)")
+        return 1
+    cmd = [*ssh_command(args), "-O", command, args.server_ip]
+    logger.debug(shlex.join(cmd))
+    return subprocess.run(cmd, check=False).returncode
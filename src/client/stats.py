@@ -0,0 +1,55 @@
+"""
+Reporting the resources used by runs: a one-line summary in the log, and
+optionally a JSON record per run in ``--stats-file``.
+"""
+
+import json
+from dataclasses import asdict
+from pathlib import Path
+
+from common.data import Usage
+
+
+def _size(size: float) -> str:
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KiB", "MiB"):
+        size /= 1024
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GiB"
+
+
+def summary(usage: Usage) -> str:
+    """One-line summary of a run's usage."""
+    cpu = usage.user_seconds + usage.sys_seconds
+    return (
+        f"{usage.wall_seconds:.2f}s wall, {cpu:.2f}s CPU "
+        + f"({usage.user_seconds:.2f}s user, {usage.sys_seconds:.2f}s sys), "
+        + f"{_size(usage.max_rss)} max RSS, "
+        + f"{usage.voluntary_switches}/{usage.involuntary_switches} "
+        + "voluntary/involuntary context switches, "
+        + f"{_size(usage.read_bytes)} read, {_size(usage.write_bytes)} written"
+    )
+
+
+def write_stats(
+    path: Path,
+    run_id: str,
+    exit_code: str,
+    usage: Usage | None,
+    samples: list[Usage],
+    append: bool = False,
+):
+    """
+    Write a run's usage and the samples taken while it ran to ``path``, as one
+    line of JSON. With ``append``, add it to the runs already in the file.
+    """
+    record = {
+        "run_id": run_id,
+        "exit_code": exit_code,
+        "usage": None if usage is None else asdict(usage),
+        "samples": [asdict(sample) for sample in samples],
+    }
+    with open(path, "a" if append else "w") as f:
+        _ = f.write(json.dumps(record) + "\n")
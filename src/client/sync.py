@@ -0,0 +1,196 @@
+"""
+Client-side project sync: rsync over SSH, or the native sync engine over the psync
+websocket connection.
+"""
+
+import asyncio
+import logging
+import shlex
+import subprocess
+import time
+import zlib
+from collections.abc import Awaitable, Callable, Iterator
+from pathlib import Path
+
+import websockets
+
+from client.args import Args
+from client.cache import Scan, StatCache
+from client.parallel import rsync_parallel
+from client.ssh import ssh_command
+from common.data import (
+    BlockReq,
+    CommitReq,
+    ErrorResp,
+    OkayResp,
+    Protocol,
+    Req,
+    Resp,
+    SyncReq,
+    SyncResp,
+    TreeReq,
+    TreeResp,
+    decode,
+    encode,
+)
+from common.sync import BLOCK_SIZE, block_digest
+
+logger = logging.getLogger(__name__)
+
+
+class SyncError(Exception):
+    """The project could not be synced to the server."""
+
+
+def rsync(args: Args):
+    """Runs rsync."""
+    rsync_args = [
+        "rsync",
+        "-avzr",
+        "-e",
+        shlex.join(ssh_command(args)),
+        "--progress",
+        "--mkpath",
+        "--delete",
+        args.target_path,
+        *args.assets,
+        args.rsync_url(),
+    ]
+    logger.info(" ".join(rsync_args))
+    p = subprocess.run(rsync_args, check=False)
+    if p.returncode != 0:
+        msg = f"Rsync failed with exit code {p.returncode}"
+        logger.error(msg)
+        raise SyncError(msg)
+
+
+def delta(rel: str, path: Path, remote: list[bytes]) -> Iterator[BlockReq]:
+    """Blocks of ``path`` which differ from the server's copy, compressed."""
+    with open(path, "rb") as f:
+        index = 0
+        while block := f.read(BLOCK_SIZE):
+            if index >= len(remote) or block_digest(block) != remote[index]:
+                data = zlib.compress(block, 1)
+                compressed = len(data) < len(block)
+                yield BlockReq(
+                    path=rel,
+                    index=index,
+                    data=data if compressed else block,
+                    compressed=compressed,
+                )
+            index += 1
+
+
+Recv = Callable[[], Awaitable[Req | Resp]]
+"""Receives the next sync reply from the server."""
+
+
+def receiver(ws: websockets.ClientConnection) -> Recv:
+    """A :data:`Recv` reading directly from ``ws``."""
+
+    async def recv() -> Req | Resp:
+        data = await ws.recv()
+        if not isinstance(data, bytes):
+            raise SyncError("Sync requires the binary protocol")
+        return decode(data)
+
+    return recv
+
+
+async def __reply(recv: Recv) -> Req | Resp:
+    resp = await recv()
+    if isinstance(resp, ErrorResp):
+        raise SyncError(resp.msg)
+    return resp
+
+
+async def tree_token(ws: websockets.ClientConnection, recv: Recv, root: Path) -> str:
+    """The server's token for the tree at ``root``."""
+    await ws.send(encode(TreeReq(root=root)))
+    resp = await __reply(recv)
+    if not isinstance(resp, TreeResp):
+        raise SyncError(f"Unexpected response during sync: {resp}")
+    return resp.token
+
+
+async def push(ws: websockets.ClientConnection, recv: Recv, args: Args, files: Scan):
+    """
+    Sync ``files`` to the server with the native sync engine. ``files`` MUST carry
+    content digests.
+    """
+    start = time.perf_counter()
+    root = args.sync_root()
+    await ws.send(
+        encode(SyncReq(root=root, files={rel: f.entry for rel, f in files.items()}))
+    )
+    plan = await __reply(recv)
+    if not isinstance(plan, SyncResp):
+        raise SyncError(f"Unexpected response during sync: {plan}")
+
+    sent = 0
+    streams = asyncio.Semaphore(max(1, args.jobs))
+
+    async def send(rel: str, remote: list[bytes]):
+        nonlocal sent
+        async with streams:
+            blocks = delta(rel, files[rel].path, remote)
+            while (block := await asyncio.to_thread(next, blocks, None)) is not None:
+                sent += len(block.data)
+                await ws.send(encode(block))
+
+    async with asyncio.TaskGroup() as group:
+        for rel, remote in plan.blocks.items():
+            _ = group.create_task(send(rel, remote))
+
+    await ws.send(encode(CommitReq()))
+    resp = await __reply(recv)
+    if not isinstance(resp, OkayResp):
+        raise SyncError(f"Unexpected response during sync: {resp}")
+    logger.info(
+        f"Synced {len(plan.blocks)}/{len(files)} changed files to {root}"
+        + f" ({sent} bytes sent in {time.perf_counter() - start:.3f}s)"
+    )
+
+
+async def __rsync(args: Args):
+    if args.jobs <= 1:
+        await asyncio.to_thread(rsync, args)
+        return
+    try:
+        await rsync_parallel(args)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise SyncError(f"Parallel sync failed: {e}") from e
+
+
+async def sync(
+    ws: websockets.ClientConnection,
+    protocol: Protocol,
+    args: Args,
+    recv: Recv | None = None,
+):
+    """
+    Sync the project to the server before it is run. Skips the transfer when the
+    stat cache shows no local changes and the server's tree is unchanged since the
+    last push. Replies are read with ``recv``; by default they are read directly
+    from ``ws``, in which case nothing else may be reading from it.
+    """
+    native = args.sync_mode == "native"
+    if protocol is not Protocol.Binary:
+        if native:
+            raise SyncError("Native sync requires the binary protocol")
+        await __rsync(args)
+        return
+
+    recv = receiver(ws) if recv is None else recv
+    root = args.sync_root()
+    cache = StatCache(args)
+    files = await asyncio.to_thread(cache.scan, args, native)
+    if cache.unchanged(files) and await tree_token(ws, recv, root) == cache.token:
+        logger.info("Project unchanged since the last sync, skipping")
+        return
+
+    if native:
+        await push(ws, recv, args, files)
+    else:
+        await __rsync(args)
+    cache.save(files, await tree_token(ws, recv, root))
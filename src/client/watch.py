@@ -0,0 +1,191 @@
+"""
+File watching for ``psync --watch``. Uses inotify on Linux, and falls back to
+polling the files' stats elsewhere.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+from pathlib import Path
+
+from common.sync import walk
+
+logger = logging.getLogger(__name__)
+
+_IN_MODIFY = 0x002
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+POLL_INTERVAL = 0.25
+"""Seconds between scans when inotify is unavailable."""
+
+
+class Watcher:
+    """
+    Watches the given sources (files or directories, as passed to the client) and
+    reports debounced batches of changes.
+    """
+
+    sources: list[str]
+    debounce: float
+    __changed: set[Path]
+    __event: asyncio.Event
+    __fd: int | None = None
+    __watches: dict[int, tuple[Path, set[str] | None]]
+    """{[wd]: (directory, names of interest or None for the whole directory)}"""
+    __libc: ctypes.CDLL | None = None
+    __poller: asyncio.Task[None] | None = None
+
+    def __init__(self, sources: list[str], debounce: float):
+        self.sources = sources
+        self.debounce = debounce
+        self.__changed = set()
+        self.__event = asyncio.Event()
+        self.__watches = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_args: object):
+        self.close()
+
+    def start(self):
+        """Start watching. Must be called from a running event loop."""
+        libc: ctypes.CDLL | None = None
+        fd = -1
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            pass
+        if libc is None or fd < 0:
+            logger.info("inotify is not available, polling for changes")
+            self.__poller = asyncio.create_task(self.__poll())
+            return
+
+        self.__libc = libc
+        self.__fd = fd
+        for source in self.sources:
+            path = Path(source).resolve()
+            if path.is_dir():
+                self.__add_tree(path)
+            else:
+                self.__add(path.parent, {path.name})
+        asyncio.get_running_loop().add_reader(fd, self.__read)
+
+    def close(self):
+        """Stop watching."""
+        if self.__fd is not None:
+            _ = asyncio.get_running_loop().remove_reader(self.__fd)
+            os.close(self.__fd)
+            self.__fd = None
+        if self.__poller is not None:
+            _ = self.__poller.cancel()
+            self.__poller = None
+
+    async def changes(self) -> set[Path]:
+        """
+        Wait for changes. Returns once no further change has been seen for
+        ``debounce`` seconds.
+        """
+        _ = await self.__event.wait()
+        while True:
+            self.__event.clear()
+            try:
+                _ = await asyncio.wait_for(self.__event.wait(), self.debounce)
+            except TimeoutError:
+                break
+        changed = self.__changed
+        self.__changed = set()
+        return changed
+
+    def __notify(self, path: Path):
+        self.__changed.add(path)
+        self.__event.set()
+
+    def __add(self, directory: Path, names: set[str] | None):
+        assert self.__libc is not None
+        wd: int = self.__libc.inotify_add_watch(
+            self.__fd, bytes(directory), _MASK | _IN_ONLYDIR
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            logger.warning(f"Could not watch {directory}: {os.strerror(err)}")
+            return
+        existing = self.__watches.get(wd)
+        if existing is not None and existing[1] is not None and names is not None:
+            existing[1].update(names)
+        else:
+            self.__watches[wd] = (directory, names)
+
+    def __add_tree(self, root: Path):
+        for dirpath, _dirnames, _filenames in os.walk(root):
+            self.__add(Path(dirpath), None)
+
+    def __read(self):
+        assert self.__fd is not None
+        try:
+            data = os.read(self.__fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos < len(data):
+            wd, mask, _cookie, size = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos : pos + size].rstrip(b"\0").decode(errors="replace")
+            pos += size
+
+            watch = self.__watches.get(wd)
+            if watch is None:
+                continue
+            directory, names = watch
+            if names is not None and name not in names:
+                continue
+            path = directory / name
+            if names is None and mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self.__add_tree(path)
+            self.__notify(path)
+
+    def __snapshot(self) -> dict[Path, tuple[int, int, int]]:
+        snapshot: dict[Path, tuple[int, int, int]] = {}
+        for _rel, path in walk(self.sources):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns, st.st_mode)
+        return snapshot
+
+    async def __poll(self):
+        previous = await asyncio.to_thread(self.__snapshot)
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            current = await asyncio.to_thread(self.__snapshot)
+            for path in previous.keys() | current.keys():
+                if previous.get(path) != current.get(path):
+                    self.__notify(path)
+            previous = current
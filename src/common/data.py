@@ -1,9 +1,18 @@
-from dataclasses import dataclass
 import logging
-from pathlib import Path
 import re
 import shlex
+import struct
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field, fields
 from enum import Enum
+from operator import attrgetter
+from pathlib import Path
+from types import UnionType
+from typing import Any, cast, get_args, get_origin, get_type_hints
+
+from websockets.typing import Subprotocol
+
+logger = logging.getLogger(__name__)
 
 
 class Mode(Enum):
@@ -11,10 +20,28 @@ class Mode(Enum):
     Client = "client"
 
 
+class Protocol(Enum):
+    """
+    Wire formats understood by psync, negotiated as a websocket subprotocol when
+    the connection is opened. Connections which do not negotiate a subprotocol
+    (e.g. the websocat health check) fall back to :attr:`Text`.
+    """
+
+    Text = Subprotocol("psync.text")
+    Binary = Subprotocol("psync.bin.2")
+    """Must name :data:`BINARY_VERSION`."""
+
+
 class ReqKind(Enum):
     Open = "open"
     Kill = "kill"
     HealthCheck = "hc"
+    Sync = "sync"
+    Block = "block"
+    Commit = "commit"
+    Tree = "tree"
+    Attach = "attach"
+    Resize = "resize"
 
 
 class RespKind(Enum):
@@ -23,6 +50,70 @@ class RespKind(Enum):
     Exit = "exit"
     Okay = "ok"
     SetPid = "set_pid"
+    Sync = "sync"
+    Tree = "tree"
+    Queued = "queued"
+    Data = "data"
+    Health = "health"
+    Stats = "stats"
+    Artifact = "artifact"
+
+
+@dataclass
+class LogFilter:
+    """
+    Which lines of a run's output the server sends. A line is kept if it matches one
+    of the ``include`` patterns, if there are any, and none of the ``exclude``
+    patterns. Of the kept lines which match ``sample_pattern``, or of all of them if
+    it is empty, only one in every ``sample`` is kept. Finally, only the first
+    ``head`` lines are kept, and of those, the last ``tail``, as with
+    ``head | tail``; lines kept by ``tail`` are only sent once the run exits. Zero
+    means no limit.
+    """
+
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+    sample: int = 0
+    sample_pattern: str = ""
+    head: int = 0
+    tail: int = 0
+
+
+@dataclass
+class Limits:
+    """
+    Resources a run may use. Zero means no limit beyond the server's own; the
+    server lowers each limit to its ceiling, if it has one.
+    """
+
+    memory: int = 0
+    """Bytes of address space."""
+    cpu_seconds: int = 0
+    """Seconds of CPU time, after which the process is sent ``SIGXCPU``."""
+    open_files: int = 0
+    nice: int = 0
+    """Niceness added to the process, from 0 to 19."""
+    cpus: int = 0
+    """Number of CPUs to pin the process to."""
+
+
+@dataclass
+class Usage:
+    """Resources used by a run's process, from when it was spawned."""
+
+    user_seconds: float = 0.0
+    sys_seconds: float = 0.0
+    max_rss: int = 0
+    """Peak resident memory, in bytes."""
+    voluntary_switches: int = 0
+    """Context switches while waiting, e.g. for I/O."""
+    involuntary_switches: int = 0
+    """Context switches when the process was preempted."""
+    read_bytes: int = 0
+    """Bytes read from block devices."""
+    write_bytes: int = 0
+    """Bytes written to block devices."""
+    wall_seconds: float = 0.0
 
 
 @dataclass
@@ -30,30 +121,106 @@ class OpenReq:
     path: Path
     args: list[str]
     env: dict[str,str]
+    run_id: str = ""
+    """
+    Client-chosen ID of the run, echoed in every response about it so that several
+    runs can share one connection. Not carried by the text protocol.
+    """
+    priority: int = 0
+    """
+    Scheduling priority. When the server is busy, runs with a higher priority are
+    started first. Not carried by the text protocol.
+    """
+    raw: bool = False
+    """
+    Send the run's output as :class:`DataResp` bytes instead of decoded
+    :class:`LogResp` text. Not carried by the text protocol.
+    """
+    filter: LogFilter | None = None
+    """Only send the lines of output it keeps. Not carried by the text protocol."""
+    split_stderr: bool = False
+    """
+    Send the process' stderr separately from its stdout, with ``fd`` set to 2. Not
+    carried by the text protocol.
+    """
+    pty: bool = False
+    """
+    Run the process under a pseudo-terminal of ``rows`` by ``cols``, so that it
+    writes its output line by line. Not carried by the text protocol.
+    """
+    rows: int = 0
+    cols: int = 0
+    limits: Limits | None = None
+    """Resources the process may use. Not carried by the text protocol."""
+    stats_interval: float = 0
+    """
+    Send the process' resource usage as a :class:`StatsResp` every this many
+    seconds while it runs. Not carried by the text protocol.
+    """
+    artifacts: list[str] = field(default_factory=list)
+    """
+    Glob patterns, relative to the synced project directory the process runs in, of
+    files to send back as :class:`ArtifactResp` once the process exits, before its
+    :class:`ExitResp`.
+    Not carried by the text protocol.
+    """
+    artifact_digests: dict[str, str] = field(default_factory=dict)
+    """Digests of the client's copies of the artifacts, which are not sent again."""
+    cache: bool = True
+    """
+    Replay the result of an identical earlier run if the server caches results,
+    and cache this run's result. Not carried by the text protocol.
+    """
     kind: ReqKind = ReqKind.Open
 
 
 @dataclass
 class KillReq:
     pid: int
+    run_id: str = ""
+    """Kill the run with this ID. If empty, the run is looked up by ``pid``."""
     kind: ReqKind = ReqKind.Kill
 
 
 @dataclass
 class LogResp:
     msg: str
+    run_id: str = ""
+    offset: int = 0
+    """
+    Byte offset in the run's output just past this message, used to resume the run
+    with :class:`AttachReq`. Not carried by the text protocol.
+    """
+    fd: int = 1
+    """
+    Which output this is: 1 for stdout, 2 for stderr. Each has its own offsets.
+    Output is only split for runs opened with ``split_stderr``. Not carried by the
+    text protocol.
+    """
     kind: RespKind = RespKind.Log
 
 
 @dataclass
 class ExitResp:
     exit_code: str
+    run_id: str = ""
+    filtered: int = 0
+    """Lines of output left out by the run's :class:`LogFilter`."""
+    usage: Usage | None = None
+    """Resources used by the process. Not carried by the text protocol."""
+    cached: bool = False
+    """
+    The run's output and exit code were replayed from the server's result cache
+    rather than run again. Not carried by the text protocol.
+    """
     kind: RespKind = RespKind.Exit
 
 
 @dataclass
 class ErrorResp:
     msg: str
+    run_id: str = ""
+    """The run this error is about, if any."""
     kind: RespKind = RespKind.Error
 
 
@@ -64,17 +231,228 @@ class OkayResp:
 
 @dataclass
 class HealthCheckReq:
+    """
+    Check that the server is up. Over the binary protocol, the server replies with
+    its load as a :class:`HealthResp`, else with :class:`OkayResp`.
+    """
+
+    path: str = ""
+    """Report the free disk space under this path. Not carried by the text protocol."""
     kind: ReqKind = ReqKind.HealthCheck
 
 
+@dataclass
+class HealthResp:
+    """
+    The server's load, for clients choosing the least loaded of several servers.
+    Not supported by the text protocol.
+    """
+
+    running: int
+    """Runs holding one of the server's ``slots``."""
+    queued: int
+    """Runs waiting for a slot."""
+    slots: int
+    cpus: int
+    load: float
+    """One-minute load average."""
+    mem_free: int
+    """Bytes of memory available to new processes."""
+    disk_free: int
+    """Bytes free on the disk of the path asked about."""
+    cache_hits: int = 0
+    """Runs replayed from the server's result cache since it started."""
+    cache_misses: int = 0
+    """Runs looked up in the result cache but not found."""
+    kind: RespKind = RespKind.Health
+
+
+@dataclass
+class StatsResp:
+    """
+    A sample of the resources used so far by a run opened with ``stats_interval``
+    set. Not supported by the text protocol.
+    """
+
+    run_id: str
+    usage: Usage
+    kind: RespKind = RespKind.Stats
+
+
 @dataclass
 class SetPidResp:
     pid: int
+    run_id: str = ""
     kind: RespKind = RespKind.SetPid
 
 
-Req = OpenReq | KillReq | HealthCheckReq
-Resp = LogResp | ExitResp | ErrorResp | OkayResp | SetPidResp
+@dataclass
+class FileEntry:
+    """A file in a sync manifest."""
+
+    size: int
+    mtime_ns: int
+    mode: int
+    digest: str
+
+
+@dataclass
+class SyncReq:
+    """
+    Start a native sync of ``root``. ``files`` maps paths relative to ``root`` to
+    the client's view of each file. Files under ``root`` which are not in the
+    manifest are deleted.
+    """
+
+    root: Path
+    files: dict[str, FileEntry]
+    kind: ReqKind = ReqKind.Sync
+
+
+@dataclass
+class SyncResp:
+    """
+    The files which must be transferred, mapped to the block digests of the copy
+    currently on the server (empty when the server has no copy).
+    """
+
+    blocks: dict[str, list[bytes]]
+    kind: RespKind = RespKind.Sync
+
+
+@dataclass
+class BlockReq:
+    """One block of a file being transferred."""
+
+    path: str
+    index: int
+    data: bytes
+    compressed: bool
+    kind: ReqKind = ReqKind.Block
+
+
+@dataclass
+class CommitReq:
+    """Finish the current sync, moving all transferred files into place."""
+
+    kind: ReqKind = ReqKind.Commit
+
+
+@dataclass
+class TreeReq:
+    """Ask for the server's token for the tree at ``root``."""
+
+    root: Path
+    kind: ReqKind = ReqKind.Tree
+
+
+@dataclass
+class TreeResp:
+    """
+    A digest of the paths, sizes, modification times and modes of every file in a
+    tree. Empty if the tree does not exist.
+    """
+
+    token: str
+    kind: RespKind = RespKind.Tree
+
+
+@dataclass
+class ArtifactResp:
+    """
+    A chunk of a file sent back after a run exits, as asked for with ``artifacts``.
+    ``path`` is relative to the run's project directory. Chunks of a file are sent
+    in order, starting at offset 0; the file is complete once ``offset`` plus the
+    chunk's uncompressed length reaches ``entry.size``. Not supported by the text
+    protocol.
+    """
+
+    run_id: str
+    path: str
+    entry: FileEntry
+    offset: int
+    data: bytes
+    compressed: bool
+    kind: RespKind = RespKind.Artifact
+
+
+@dataclass
+class QueuedResp:
+    """
+    The server is busy and the run is waiting for a slot. ``position`` is its
+    one-based place in the queue and ``eta`` the estimated wait in seconds, if the
+    server has an estimate.
+    """
+
+    position: int
+    eta: float | None
+    run_id: str = ""
+    kind: RespKind = RespKind.Queued
+
+
+@dataclass
+class DataResp:
+    """
+    Raw output of a run opened with ``raw`` set. Like :class:`LogResp`, but the
+    output is passed through undecoded. Not supported by the text protocol.
+    """
+
+    data: bytes
+    run_id: str = ""
+    offset: int = 0
+    fd: int = 1
+    kind: RespKind = RespKind.Data
+
+
+@dataclass
+class AttachReq:
+    """
+    Resume streaming the output of a run, e.g. after reconnecting, starting at byte
+    ``offset`` of its output. The server then reports the run's exit as usual.
+    """
+
+    run_id: str
+    offset: int
+    stderr_offset: int = 0
+    """Where to resume stderr, for runs opened with ``split_stderr``."""
+    kind: ReqKind = ReqKind.Attach
+
+
+@dataclass
+class ResizeReq:
+    """Resize the pseudo-terminal of a run opened with ``pty`` set."""
+
+    run_id: str
+    rows: int
+    cols: int
+    kind: ReqKind = ReqKind.Resize
+
+
+Req = (
+    OpenReq
+    | KillReq
+    | HealthCheckReq
+    | SyncReq
+    | BlockReq
+    | CommitReq
+    | TreeReq
+    | AttachReq
+    | ResizeReq
+)
+Resp = (
+    LogResp
+    | ExitResp
+    | ErrorResp
+    | OkayResp
+    | SetPidResp
+    | SyncResp
+    | TreeResp
+    | QueuedResp
+    | DataResp
+    | HealthResp
+    | StatsResp
+    | ArtifactResp
+)
 
 
 def serialize(msg: Req | Resp) -> str:
@@ -100,6 +478,8 @@ def serialize(msg: Req | Resp) -> str:
             return f"{value}"
         case HealthCheckReq():
             return f"{value}"
+        case _:
+            raise ValueError(f"{type(msg).__name__} is not supported by the text protocol")
 
 
 path_expr = re.compile(r"path='([^']+)'")
@@ -121,7 +501,7 @@ def deserialize_env(input: str) -> dict[str, str]:
 
 
 def deserialize(msg: str) -> Req | Resp:
-    logging.debug(f"Got message {msg}")
+    logger.debug("Got message %s", msg)
     try:
         [kind, rest] = msg.split(" ", 1)
     except Exception:
@@ -165,3 +545,378 @@ def deserialize(msg: str) -> Req | Resp:
 
         case _:
             raise ValueError("Could not match kind for message", msg)
+
+
+BINARY_VERSION = 2
+"""
+Version byte written in the header of every binary message. MUST be bumped, along
+with the :attr:`Protocol.Binary` subprotocol, whenever the layout of a message or
+record changes (e.g. a field is added), so that mismatched clients and servers fail
+to negotiate the binary protocol instead of misreading each other.
+"""
+
+MAX_MESSAGE_SIZE = 64 * 2**20
+"""
+Largest websocket message accepted by the client and server. Sync manifests for
+large trees can exceed the websockets default of 1 MiB.
+"""
+
+_HEADER = struct.Struct("!BBI")
+"""Binary message header: version, message code, payload length."""
+
+_MESSAGES: tuple[type[Req | Resp], ...] = (
+    OpenReq,
+    KillReq,
+    HealthCheckReq,
+    LogResp,
+    ExitResp,
+    ErrorResp,
+    OkayResp,
+    SetPidResp,
+    SyncReq,
+    SyncResp,
+    BlockReq,
+    CommitReq,
+    TreeReq,
+    TreeResp,
+    QueuedResp,
+    AttachReq,
+    DataResp,
+    ResizeReq,
+    HealthResp,
+    StatsResp,
+    ArtifactResp,
+)
+"""
+Message types indexed by their binary message code. New messages MUST be appended
+so existing codes remain stable.
+"""
+_RECORDS: tuple[type[object], ...] = (FileEntry, LogFilter, Limits, Usage)
+"""
+Dataclasses which may be nested inside messages, indexed by their record code.
+New records MUST be appended.
+"""
+_CODES: dict[type, int] = {cls: code for code, cls in enumerate(_MESSAGES)}
+_FIELDS: dict[type, tuple[str, ...]] = {
+    cls: tuple(f.name for f in fields(cls) if f.name != "kind")
+    for cls in (*_MESSAGES, *_RECORDS)
+}
+
+
+def _getter(names: tuple[str, ...]) -> Callable[[object], tuple[object, ...]]:
+    """Reads the fields ``names`` of an object at once."""
+    if len(names) > 1:
+        return attrgetter(*names)
+    if names:
+        get = attrgetter(names[0])
+        return lambda obj: (get(obj),)
+    return lambda _obj: ()
+
+
+_GETTERS: dict[type, Callable[[object], tuple[object, ...]]] = {
+    cls: _getter(names) for cls, names in _FIELDS.items()
+}
+
+
+def _checker(hint: object) -> Callable[[object], bool]:
+    """Whether a decoded value is of the annotated type ``hint``."""
+    if hint is Any or hint is object:
+        return lambda _value: True
+    origin = get_origin(hint)
+    args = get_args(hint)
+    if origin is list:
+        item = _checker(args[0])
+        return lambda value: isinstance(value, list) and all(
+            map(item, cast("list[object]", value))
+        )
+    if origin is dict:
+        key, val = _checker(args[0]), _checker(args[1])
+        return lambda value: isinstance(value, dict) and all(
+            key(k) and val(v) for k, v in cast("dict[object, object]", value).items()
+        )
+    hints = args if origin is UnionType else (hint,)
+    classes = [h for h in hints if isinstance(h, type)]
+    if len(classes) == len(hints):
+        if float in classes:
+            # Whole numbers may have been encoded as ints.
+            classes.append(int)
+        types = tuple(classes)
+        return lambda value: isinstance(value, types)
+    if len(hints) == 1:
+        return lambda _value: True
+    checks = [_checker(h) for h in hints]
+    return lambda value: any(check(value) for check in checks)
+
+
+_CHECKS: dict[type, tuple[Callable[[object], bool], ...]] = {
+    cls: tuple(_checker(get_type_hints(cls)[name]) for name in names)
+    for cls, names in _FIELDS.items()
+}
+"""Type checks of the fields of each message and record, in :data:`_FIELDS` order."""
+
+
+def _build[T](cls: type[T], values: list[object]) -> T:
+    """Construct a decoded message or record, checking the types of its fields."""
+    for name, value, check in zip(_FIELDS[cls], values, _CHECKS[cls]):
+        if not check(value):
+            kind = type(value).__name__
+            raise ValueError(f"Malformed {cls.__name__} message: {name} is a {kind}")
+    return cls(*values)
+
+
+_U32 = struct.Struct("!I")
+_U64 = struct.Struct("!Q")
+_I64 = struct.Struct("!q")
+_F64 = struct.Struct("!d")
+_SIZED = struct.Struct("!cI")
+"""Tag and length of a sized value."""
+
+
+def _pack_none(_value: None, out: bytearray) -> None:
+    out += b"N"
+
+
+def _pack_bool(value: bool, out: bytearray) -> None:
+    out += b"T" if value else b"F"
+
+
+def _pack_int(value: int, out: bytearray) -> None:
+    out += b"i"
+    out += _I64.pack(value)
+
+
+def _pack_float(value: float, out: bytearray) -> None:
+    out += b"f"
+    out += _F64.pack(value)
+
+
+def _pack_str(value: str, out: bytearray) -> None:
+    raw = value.encode()
+    out += _SIZED.pack(b"s", len(raw))
+    out += raw
+
+
+def _pack_bytes(value: bytes, out: bytearray) -> None:
+    out += _SIZED.pack(b"b", len(value))
+    out += value
+
+
+def _pack_path(value: Path, out: bytearray) -> None:
+    raw = str(value).encode()
+    out += _SIZED.pack(b"p", len(raw))
+    out += raw
+
+
+def _pack_list(value: list[object], out: bytearray) -> None:
+    out += _SIZED.pack(b"l", len(value))
+    for item in value:
+        _PACKERS[type(item)](item, out)
+
+
+def _pack_dict(value: dict[object, object], out: bytearray) -> None:
+    out += _SIZED.pack(b"d", len(value))
+    for k, v in value.items():
+        _PACKERS[type(k)](k, out)
+        _PACKERS[type(v)](v, out)
+
+
+def _pack_record(value: object, out: bytearray) -> None:
+    cls = type(value)
+    out += b"r"
+    out.append(_RECORDS.index(cls))
+    for item in _GETTERS[cls](value):
+        _PACKERS[type(item)](item, out)
+
+
+_PACKERS: dict[type, Callable[[Any, bytearray], None]] = {  # pyright: ignore[reportExplicitAny]
+    type(None): _pack_none,
+    bool: _pack_bool,
+    int: _pack_int,
+    float: _pack_float,
+    str: _pack_str,
+    bytes: _pack_bytes,
+    bytearray: _pack_bytes,
+    list: _pack_list,
+    tuple: _pack_list,
+    dict: _pack_dict,
+    type(Path()): _pack_path,
+    **{cls: _pack_record for cls in _RECORDS},
+}
+"""
+Value encoders, dispatched on the exact type of the value. Packers look each other
+up directly rather than through a generic dispatcher, which roughly halves the cost
+of encoding messages with many fields.
+"""
+
+
+def _unpack_sized(data: memoryview, pos: int) -> tuple[memoryview, int]:
+    (size,) = _U32.unpack_from(data, pos)
+    pos += _U32.size
+    end = pos + size
+    if end > len(data):
+        raise ValueError("Truncated message")
+    return data[pos:end], end
+
+
+def _unpack_value(data: memoryview, pos: int) -> tuple[object, int]:
+    tag = data[pos]
+    pos += 1
+    match tag:
+        case 0x4E:  # N
+            return None, pos
+        case 0x54:  # T
+            return True, pos
+        case 0x46:  # F
+            return False, pos
+        case 0x69:  # i
+            return _I64.unpack_from(data, pos)[0], pos + _I64.size
+        case 0x66:  # f
+            return _F64.unpack_from(data, pos)[0], pos + _F64.size
+        case 0x73:  # s
+            raw, pos = _unpack_sized(data, pos)
+            return str(raw, "utf-8"), pos
+        case 0x62:  # b
+            raw, pos = _unpack_sized(data, pos)
+            return bytes(raw), pos
+        case 0x70:  # p
+            raw, pos = _unpack_sized(data, pos)
+            return Path(str(raw, "utf-8")), pos
+        case 0x6C:  # l
+            (count,) = _U32.unpack_from(data, pos)
+            pos += _U32.size
+            items: list[object] = []
+            for _ in range(count):
+                item, pos = _unpack_value(data, pos)
+                items.append(item)
+            return items, pos
+        case 0x64:  # d
+            (count,) = _U32.unpack_from(data, pos)
+            pos += _U32.size
+            mapping: dict[object, object] = {}
+            for _ in range(count):
+                k, pos = _unpack_value(data, pos)
+                v, pos = _unpack_value(data, pos)
+                mapping[k] = v
+            return mapping, pos
+        case 0x72:  # r
+            cls = _RECORDS[data[pos]]
+            pos += 1
+            values: list[object] = []
+            for _ in _FIELDS[cls]:
+                value, pos = _unpack_value(data, pos)
+                values.append(value)
+            return _build(cls, values), pos
+        case _:
+            raise ValueError(f"Unknown value tag {tag:#x}")
+
+
+def encode(msg: Req | Resp) -> bytes:
+    """
+    Encode a message with the binary protocol. Messages are framed with a fixed
+    header (version, message code, payload length) followed by the payload. Output
+    messages (log and data) carry the file descriptor they were written to and the
+    length of their run ID as single bytes, then the run ID and their offset,
+    followed by the output itself as the raw payload; all other messages carry their
+    fields as a sequence of tagged values.
+    """
+    code = _CODES[type(msg)]
+    if isinstance(msg, (LogResp, DataResp)):
+        run_id = msg.run_id.encode()
+        if len(run_id) > 0xFF:
+            raise ValueError(f"Run ID {msg.run_id!r} is too long")
+        payload = msg.msg.encode() if isinstance(msg, LogResp) else msg.data
+        size = 2 + len(run_id) + _U64.size + len(payload)
+        return b"".join(
+            (
+                _HEADER.pack(BINARY_VERSION, code, size),
+                bytes((msg.fd, len(run_id))),
+                run_id,
+                _U64.pack(msg.offset),
+                payload,
+            )
+        )
+
+    out = bytearray(_HEADER.size)
+    try:
+        for value in _GETTERS[type(msg)](msg):
+            _PACKERS[type(value)](value, out)
+    except KeyError as e:
+        raise ValueError(f"Cannot encode value of type {e}") from None
+    _HEADER.pack_into(out, 0, BINARY_VERSION, code, len(out) - _HEADER.size)
+    return bytes(out)
+
+
+def decode(data: bytes) -> Req | Resp:
+    """Decode a message encoded with :func:`encode`."""
+    if len(data) < _HEADER.size:
+        raise ValueError("Message is shorter than the header")
+    version, code, size = _HEADER.unpack_from(data)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    if code >= len(_MESSAGES):
+        raise ValueError(f"Unknown message code {code}")
+    if _HEADER.size + size != len(data):
+        raise ValueError("Message length does not match header")
+
+    cls: type[Req | Resp] = _MESSAGES[code]
+    view = memoryview(data)
+    if cls is LogResp or cls is DataResp:
+        if size < 2:
+            raise ValueError(f"Malformed {cls.__name__} message: missing run ID")
+        fd = view[_HEADER.size]
+        start = _HEADER.size + 2 + view[_HEADER.size + 1]
+        if start + _U64.size > len(data):
+            raise ValueError(f"Malformed {cls.__name__} message: truncated header")
+        run_id = str(view[_HEADER.size + 2 : start], "utf-8")
+        (offset,) = _U64.unpack_from(view, start)
+        payload = view[start + _U64.size :]
+        if cls is DataResp:
+            return DataResp(bytes(payload), run_id, offset, fd)
+        return LogResp(str(payload, "utf-8"), run_id, offset, fd)
+
+    pos = _HEADER.size
+    values: list[object] = []
+    try:
+        for _ in _FIELDS[cls]:
+            value, pos = _unpack_value(view, pos)
+            values.append(value)
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"Malformed {cls.__name__} message: {e}")
+    return _build(cls, values)
+
+
+def pack(msg: Req | Resp, protocol: Protocol) -> str | bytes:
+    """Encode a message for the given protocol."""
+    if protocol is Protocol.Binary:
+        return encode(msg)
+    return serialize(msg)
+
+
+def unpack(data: str | bytes, protocol: Protocol) -> Req | Resp:
+    """Decode a message received over a connection using the given protocol."""
+    if protocol is Protocol.Binary and isinstance(data, bytes):
+        return decode(data)
+    if isinstance(data, bytes):
+        data = data.decode()
+    return deserialize(data)
+
+
+def negotiated(subprotocol: str | None) -> Protocol:
+    """The protocol matching a connection's negotiated subprotocol."""
+    if subprotocol == Protocol.Binary.value:
+        return Protocol.Binary
+    return Protocol.Text
+
+
+def select_subprotocol(
+    _connection: object, subprotocols: Sequence[Subprotocol]
+) -> Subprotocol | None:
+    """
+    Server-side subprotocol selection. Prefers the binary protocol and falls back to
+    the text protocol, including when the client offers no subprotocol at all.
+    """
+    if Protocol.Binary.value in subprotocols:
+        return Protocol.Binary.value
+    if Protocol.Text.value in subprotocols:
+        return Protocol.Text.value
+    return None
@@ -0,0 +1,82 @@
+"""
+Helpers shared by the client and server halves of the native sync engine.
+
+Files are compared by size and modification time first, then by a whole-file
+digest. Files which differ are transferred as fixed-size blocks; blocks whose
+digest matches the server's copy are not sent.
+"""
+
+import hashlib
+import os
+from collections.abc import Iterator
+from os.path import basename
+from pathlib import Path, PurePosixPath
+
+from common.data import FileEntry
+
+BLOCK_SIZE = 128 * 1024
+"""Size of the blocks files are compared and transferred in."""
+
+_BLOCK_DIGEST_SIZE = 16
+
+
+def file_digest(path: Path | str) -> str:
+    """Whole-file content digest."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, hashlib.blake2b).hexdigest()
+
+
+def block_digests(path: Path | str) -> list[bytes]:
+    """Digests of each :data:`BLOCK_SIZE` block of a file."""
+    digests: list[bytes] = []
+    with open(path, "rb") as f:
+        while block := f.read(BLOCK_SIZE):
+            digests.append(block_digest(block))
+    return digests
+
+
+def block_digest(block: bytes) -> bytes:
+    """Digest of a single block, comparable with :func:`block_digests`."""
+    return hashlib.blake2b(block, digest_size=_BLOCK_DIGEST_SIZE).digest()
+
+
+def entry(path: Path | str, digest: str | None = None) -> FileEntry:
+    """Build a manifest entry for a local file."""
+    st = os.stat(path)
+    return FileEntry(
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        mode=st.st_mode & 0o7777,
+        digest=file_digest(path) if digest is None else digest,
+    )
+
+
+def walk(sources: list[str]) -> Iterator[tuple[str, Path]]:
+    """
+    Yield ``(relative destination path, local path)`` for every file in
+    ``sources``, laid out the way ``rsync -r`` would lay them out: files and
+    directories are placed under their basename, while directories with a
+    trailing slash have their contents placed directly in the destination. Empty
+    directories are not synced.
+    """
+    for source in sources:
+        src = Path(source)
+        if not src.is_dir():
+            yield basename(source), src
+            continue
+        prefix = PurePosixPath() if source.endswith("/") else PurePosixPath(src.name)
+        for dirpath, _dirnames, filenames in os.walk(src):
+            rel = PurePosixPath(Path(dirpath).relative_to(src).as_posix())
+            for name in filenames:
+                yield str(prefix / rel / name), Path(dirpath) / name
+
+
+def resolve(root: Path, rel: str) -> Path:
+    """
+    Resolve a manifest path against the sync root, refusing paths which would
+    escape it.
+    """
+    path = PurePosixPath(rel)
+    if path.is_absolute() or ".." in path.parts or rel in ("", "."):
+        raise ValueError(f"Invalid sync path {rel!r}")
+    return root / path
@@ -1,6 +1,6 @@
 import argparse
 from dataclasses import dataclass, field
-from os import environ
+from os import cpu_count, environ
 from pathlib import Path
 
 
@@ -44,6 +44,13 @@ class Args:
 
     Host port on which to listen for incoming connections.
     """
+    server_dest: str = environ.get("PSYNC_SERVER_DEST", "/home/psync")
+    """
+    environ: ``PSYNC_SERVER_DEST``
+
+    Base directory synced projects are placed under, matching the clients'
+    ``PSYNC_SERVER_DEST``. Native syncs into any other directory are refused.
+    """
     origins: list[str] = field(
         default_factory=lambda: environ.get(
             "PSYNC_ORIGINS", "localhost 127.0.0.1"
@@ -66,6 +73,234 @@ class Args:
 
     User used to execute the requested binaries.
     """
+    log_batch_ms: float = float(environ.get("PSYNC_LOG_BATCH_MS", "5"))
+    """
+    environ: ``PSYNC_LOG_BATCH_MS``
+
+    Time window, in milliseconds, over which process output is coalesced into a
+    single log message. Set to 0 to send output as soon as it is read.
+    """
+    log_batch_bytes: int = int(environ.get("PSYNC_LOG_BATCH_BYTES", str(64 * 1024)))
+    """
+    environ: ``PSYNC_LOG_BATCH_BYTES``
+
+    Maximum size of a single log message. A batch is sent early once it reaches
+    this size. Set to 0 to disable batching and send one message per line.
+    """
+    store_path: Path | None = (
+        Path(environ["PSYNC_STORE_PATH"]).expanduser()
+        if environ.get("PSYNC_STORE_PATH")
+        else None
+    )
+    """
+    environ: ``PSYNC_STORE_PATH``
+
+    Directory of the content-addressed blob store. When set, files synced with the
+    native sync engine are stored once per content digest and shared between
+    projects, and files whose content is already stored are never transferred.
+    """
+    store_link: str = environ.get("PSYNC_STORE_LINK", "reflink")
+    """
+    environ: ``PSYNC_STORE_LINK``
+
+    How stored files are placed in project directories: ``reflink``, ``hardlink``
+    or ``copy``. See :class:`server.store.BlobStore`.
+    """
+    store_retention_days: float = float(environ.get("PSYNC_STORE_RETENTION_DAYS", "7"))
+    """
+    environ: ``PSYNC_STORE_RETENTION_DAYS``
+
+    Days an unreferenced blob is kept before it is garbage collected.
+    """
+    store_gc_interval: float = float(environ.get("PSYNC_STORE_GC_INTERVAL", "3600"))
+    """
+    environ: ``PSYNC_STORE_GC_INTERVAL``
+
+    Seconds between garbage collections of the blob store.
+    """
+    slots: int = int(environ.get("PSYNC_SLOTS", str(cpu_count() or 1)))
+    """
+    environ: ``PSYNC_SLOTS``
+
+    Maximum number of processes run at once. Further runs are queued, and slots are
+    shared fairly between client hosts. Defaults to the number of CPUs.
+    """
+    zygote_pool: int = int(environ.get("PSYNC_ZYGOTE_POOL", "0"))
+    """
+    environ: ``PSYNC_ZYGOTE_POOL``
+
+    Number of pre-started Python interpreters kept ready to run Python targets,
+    which saves interpreter startup on every run. Set to 0 to disable. See
+    :class:`server.zygote.ZygotePool`.
+    """
+    zygote_modules: list[str] = field(
+        default_factory=lambda: environ.get("PSYNC_ZYGOTE_MODULES", "").split()
+    )
+    """
+    environ: ``PSYNC_ZYGOTE_MODULES``
+
+    Space-separated list of modules imported by each pre-started interpreter.
+    """
+    run_log_memory: int = int(environ.get("PSYNC_RUN_LOG_MEMORY", str(2**20)))
+    """
+    environ: ``PSYNC_RUN_LOG_MEMORY``
+
+    Bytes of each run's most recent output kept in memory, between the process and
+    a client which may be slower. What happens to older output is set by
+    ``PSYNC_LOG_OVERFLOW``.
+    """
+    log_overflow: str = environ.get("PSYNC_LOG_OVERFLOW", "spill")
+    """
+    environ: ``PSYNC_LOG_OVERFLOW``
+
+    What happens when a run's output does not fit in ``PSYNC_RUN_LOG_MEMORY``:
+
+    - ``spill``: older output is spilled to a temporary file. The process never
+      waits for the client, and a client which re-attaches can resume from any
+      point.
+    - ``drop-oldest``: older output is discarded. A client which falls behind skips
+      ahead, and is told how much output it missed.
+    - ``block``: the process' output is not read while the client is behind, so
+      the process blocks once its pipe is full.
+
+    See :class:`server.runlog.RunLog`.
+    """
+    run_log_dir: Path | None = (
+        Path(environ["PSYNC_RUN_LOG_DIR"]).expanduser()
+        if environ.get("PSYNC_RUN_LOG_DIR")
+        else None
+    )
+    """
+    environ: ``PSYNC_RUN_LOG_DIR``
+
+    Directory where spilled run output is written. Defaults to the system's
+    temporary directory.
+    """
+    run_log_spill_bytes: int = int(environ.get("PSYNC_RUN_LOG_SPILL_BYTES", str(2**30)))
+    """
+    environ: ``PSYNC_RUN_LOG_SPILL_BYTES``
+
+    Bytes of each run's output spilled to disk. Past it, older output is dropped as
+    with ``drop-oldest``. Set to 0 to spill without limit.
+    """
+    run_retention: float = float(environ.get("PSYNC_RUN_RETENTION", "600"))
+    """
+    environ: ``PSYNC_RUN_RETENTION``
+
+    Seconds the output of an exited run is kept when its client is not attached, so
+    that the client can re-attach and receive the rest of the output.
+    """
+    mirror: str = environ.get("PSYNC_MIRROR", "stdout")
+    """
+    environ: ``PSYNC_MIRROR``
+
+    Where the server keeps its own copy of run output:
+
+    - ``off``: nowhere.
+    - ``file``: in a file per run in ``PSYNC_MIRROR_DIR``, rotated once it grows
+      past ``PSYNC_MIRROR_FILE_BYTES``.
+    - ``stdout``: on the server's stdout, each line prefixed with its run ID, at
+      most ``PSYNC_MIRROR_RATE`` bytes per second.
+
+    Output is written by a background thread. Output the mirror cannot keep up
+    with is left out of the mirror, never held back from the client. See
+    :mod:`server.mirror`.
+    """
+    mirror_dir: Path = field(
+        default_factory=lambda: Path(
+            environ.get("PSYNC_MIRROR_DIR", "~/.local/share/psync/runs")
+        ).expanduser()
+    )
+    """
+    environ: ``PSYNC_MIRROR_DIR``
+
+    Directory of the per-run files written by the ``file`` mirror.
+    """
+    mirror_file_bytes: int = int(environ.get("PSYNC_MIRROR_FILE_BYTES", str(10 * 2**20)))
+    """
+    environ: ``PSYNC_MIRROR_FILE_BYTES``
+
+    Size after which a run's mirror file is rotated. Set to 0 to never rotate.
+    """
+    mirror_backups: int = int(environ.get("PSYNC_MIRROR_BACKUPS", "3"))
+    """
+    environ: ``PSYNC_MIRROR_BACKUPS``
+
+    Number of rotated mirror files kept per run.
+    """
+    mirror_rate: int = int(environ.get("PSYNC_MIRROR_RATE", str(2**20)))
+    """
+    environ: ``PSYNC_MIRROR_RATE``
+
+    Bytes per second mirrored to stdout, over all runs. Set to 0 for no limit.
+    """
+    max_memory: int = int(environ.get("PSYNC_MAX_MEMORY", "0"))
+    """
+    environ: ``PSYNC_MAX_MEMORY``
+
+    Bytes of address space each run may use, at most. Clients may ask for less. Set
+    to 0 for no limit. See :mod:`server.limits`.
+    """
+    max_cpu_seconds: int = int(environ.get("PSYNC_MAX_CPU_SECONDS", "0"))
+    """
+    environ: ``PSYNC_MAX_CPU_SECONDS``
+
+    Seconds of CPU time each run may use, at most. Clients may ask for less. Set to
+    0 for no limit.
+    """
+    max_open_files: int = int(environ.get("PSYNC_MAX_OPEN_FILES", "0"))
+    """
+    environ: ``PSYNC_MAX_OPEN_FILES``
+
+    Files each run may have open at once, at most. Clients may ask for fewer. Set
+    to 0 for the server's own limit.
+    """
+    run_nice: int = int(environ.get("PSYNC_RUN_NICE", "0"))
+    """
+    environ: ``PSYNC_RUN_NICE``
+
+    Niceness added to every run, so that runs yield to the server itself. Clients
+    may ask for more, never for less.
+    """
+    cpus_per_run: int = int(environ.get("PSYNC_CPUS_PER_RUN", "0"))
+    """
+    environ: ``PSYNC_CPUS_PER_RUN``
+
+    Number of CPUs each run is pinned to, at most. CPUs are handed out so that
+    concurrent runs share as few of them as possible. Clients may ask for fewer.
+
+    Defaults to 0: runs are only pinned when the client asks for it (``--cpus``),
+    and are otherwise left to the kernel's scheduler, which also spreads them out
+    but lets a run use idle CPUs.
+    """
+    result_cache: Path | None = (
+        Path(environ["PSYNC_RESULT_CACHE"]).expanduser()
+        if environ.get("PSYNC_RESULT_CACHE")
+        else None
+    )
+    """
+    environ: ``PSYNC_RESULT_CACHE``
+
+    Directory of the run result cache. When set, the exit code and output of each
+    run are cached, keyed by the project tree, the executable, its arguments and
+    environment, and an identical run replays them instead of running again. Only
+    enable this for deterministic runs. See :class:`server.results.ResultCache`.
+    """
+    result_cache_bytes: int = int(environ.get("PSYNC_RESULT_CACHE_BYTES", str(1 << 30)))
+    """
+    environ: ``PSYNC_RESULT_CACHE_BYTES``
+
+    Size of the result cache. The least recently used results are evicted to stay
+    under it.
+    """
+    result_cache_entry_bytes: int = int(
+        environ.get("PSYNC_RESULT_CACHE_ENTRY_BYTES", str(16 << 20))
+    )
+    """
+    environ: ``PSYNC_RESULT_CACHE_ENTRY_BYTES``
+
+    Output of a single run cached at most. Runs with more output are not cached.
+    """
 
 
 parser = argparse.ArgumentParser(
@@ -84,12 +319,68 @@ PSYNC_SERVER_IP - IP address on which to listen
     Default: 0.0.0.0
 PSYNC_SERVER_PORT - Port on which to listen
     Default: 5000
+PSYNC_SERVER_DEST - Directory synced projects are placed under
+    Default: /home/psync
 PSYNC_ORIGINS - Space-separated list of accepted incoming IP addresses
     Default: "127.0.0.1 localhost"
 PSYNC_LOG - Log level
     Default: "INFO"
 PSYNC_USER - User to run the synced executables. Try not to use root.
     Default: None (current user)
+PSYNC_LOG_BATCH_MS - Window over which process output is batched
+    Default: 5
+PSYNC_LOG_BATCH_BYTES - Maximum batch size in bytes, 0 to send line by line
+    Default: 65536
+PSYNC_STORE_PATH - Directory of the content-addressed blob store
+    Default: None (disabled)
+PSYNC_STORE_LINK - How stored files are placed: reflink, hardlink or copy
+    Default: reflink
+PSYNC_STORE_RETENTION_DAYS - Days unreferenced blobs are kept
+    Default: 7
+PSYNC_STORE_GC_INTERVAL - Seconds between blob store garbage collections
+    Default: 3600
+PSYNC_SLOTS - Maximum number of processes run at once
+    Default: number of CPUs
+PSYNC_ZYGOTE_POOL - Number of pre-started Python interpreters, 0 to disable
+    Default: 0
+PSYNC_ZYGOTE_MODULES - Space-separated modules imported by each interpreter
+    Default: None
+PSYNC_RUN_LOG_MEMORY - Bytes of each run's output kept in memory
+    Default: 1048576
+PSYNC_LOG_OVERFLOW - Output overflow policy: spill, drop-oldest or block
+    Default: spill
+PSYNC_RUN_LOG_DIR - Directory where older run output is spilled
+    Default: system temporary directory
+PSYNC_RUN_LOG_SPILL_BYTES - Bytes of each run's output spilled, 0 for no limit
+    Default: 1073741824
+PSYNC_RUN_RETENTION - Seconds the output of an exited, detached run is kept
+    Default: 600
+PSYNC_MIRROR - Where run output is mirrored on the server: off, file or stdout
+    Default: stdout
+PSYNC_MIRROR_DIR - Directory of the file mirror's per-run files
+    Default: ~/.local/share/psync/runs
+PSYNC_MIRROR_FILE_BYTES - Size after which a mirror file is rotated, 0 to never
+    Default: 10485760
+PSYNC_MIRROR_BACKUPS - Rotated mirror files kept per run
+    Default: 3
+PSYNC_MIRROR_RATE - Bytes per second mirrored to stdout, 0 for no limit
+    Default: 1048576
+PSYNC_MAX_MEMORY - Bytes of address space per run, 0 for no limit
+    Default: 0
+PSYNC_MAX_CPU_SECONDS - Seconds of CPU time per run, 0 for no limit
+    Default: 0
+PSYNC_MAX_OPEN_FILES - Open files per run, 0 for the server's own limit
+    Default: 0
+PSYNC_RUN_NICE - Niceness added to every run
+    Default: 0
+PSYNC_CPUS_PER_RUN - CPUs each run is pinned to, 0 to only pin on request
+    Default: 0
+PSYNC_RESULT_CACHE - Directory of the run result cache
+    Default: None (disabled)
+PSYNC_RESULT_CACHE_BYTES - Size of the run result cache
+    Default: 1073741824
+PSYNC_RESULT_CACHE_ENTRY_BYTES - Output of a single run cached at most
+    Default: 16777216
 """,
 )
 _action = parser.add_argument(
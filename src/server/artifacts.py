@@ -0,0 +1,68 @@
+"""
+Artifacts: files a run leaves in its project directory, such as profiles or
+checkpoints, which are sent back to the client once the run exits.
+
+Files are read through ``mmap`` and sent in :data:`common.sync.BLOCK_SIZE` chunks,
+compressed when that makes them smaller. Files whose digest matches the client's
+copy are not sent. The methods do blocking file I/O and are meant to be run off the
+event loop.
+"""
+
+import logging
+import mmap
+import zlib
+from collections.abc import Iterator
+from pathlib import Path, PurePosixPath
+
+from common.data import ArtifactResp, FileEntry
+from common.sync import BLOCK_SIZE, entry
+
+logger = logging.getLogger(__name__)
+
+
+def check(patterns: list[str]):
+    """Raises ``ValueError`` for patterns which could match files outside the root."""
+    for pattern in patterns:
+        parts = PurePosixPath(pattern)
+        if not pattern or parts.is_absolute() or ".." in parts.parts:
+            raise ValueError(f"Invalid artifact pattern {pattern!r}")
+
+
+def find(root: Path, patterns: list[str], known: dict[str, str]) -> dict[str, FileEntry]:
+    """
+    Regular files under ``root`` matching any of ``patterns``, relative to it, which
+    are not already known by the digests in ``known``. See :func:`check`.
+    """
+    check(patterns)
+    root = root.resolve()
+    found: dict[str, FileEntry] = {}
+    for pattern in patterns:
+        for path in root.glob(pattern):
+            rel = path.relative_to(root).as_posix()
+            if rel in found or not path.is_file():
+                continue
+            if not path.resolve().is_relative_to(root):
+                logger.warning(f"Not sending artifact {rel}, which links outside {root}")
+                continue
+            file = entry(path)
+            if known.get(rel) == file.digest:
+                continue
+            found[rel] = file
+    return found
+
+
+def chunks(run_id: str, root: Path, rel: str, file: FileEntry) -> Iterator[ArtifactResp]:
+    """The chunks of an artifact found by :func:`find`."""
+    if file.size == 0:
+        yield ArtifactResp(run_id, rel, file, 0, b"", False)
+        return
+    with open(root / rel, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        # The file may have changed since it was found; only what was found is sent.
+        size = min(file.size, len(m))
+        for offset in range(0, size, BLOCK_SIZE):
+            block = m[offset : offset + BLOCK_SIZE]
+            data = zlib.compress(block, 1)
+            compressed = len(data) < len(block)
+            yield ArtifactResp(
+                run_id, rel, file, offset, data if compressed else block, compressed
+            )
@@ -0,0 +1,141 @@
+"""
+Subprocesses which the server reaps itself, with ``wait4``, so that their final
+resource usage is known. The event loop reaps its own subprocesses as soon as they
+exit and discards their usage, while ``/proc`` holds little of it for a process
+which has already exited.
+
+Exits are watched through a pidfd, so this needs Linux 5.3 or later.
+"""
+
+import asyncio
+import os
+import resource
+import signal
+import subprocess
+from asyncio import StreamReader, StreamReaderProtocol, StreamWriter
+from pathlib import Path
+from typing import IO
+
+PIPE = subprocess.PIPE
+STDOUT = subprocess.STDOUT
+
+
+class Child:
+    """
+    A subprocess, with the parts of :class:`asyncio.subprocess.Process` the server
+    uses. Start one with :func:`spawn`.
+    """
+
+    pid: int
+    stdin: StreamWriter | None = None
+    stdout: StreamReader | None = None
+    stderr: StreamReader | None = None
+    returncode: int | None = None
+    rusage: resource.struct_rusage | None = None
+    """Usage of the process and the children it waited for, once it has exited."""
+    __popen: subprocess.Popen[bytes]
+    __exited: asyncio.Future[int]
+
+    def __init__(self, popen: subprocess.Popen[bytes]):
+        self.pid = popen.pid
+        self.__popen = popen
+        loop = asyncio.get_running_loop()
+        self.__exited = loop.create_future()
+        pidfd = os.pidfd_open(self.pid)
+        loop.add_reader(pidfd, self.__reap, pidfd)
+
+    async def wait(self) -> int:
+        """Wait for the process to exit, and return its exit code."""
+        return await asyncio.shield(self.__exited)
+
+    def send_signal(self, sig: int):
+        # Once reaped, the PID may already belong to another process.
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def __reap(self, pidfd: int):
+        _ = asyncio.get_running_loop().remove_reader(pidfd)
+        os.close(pidfd)
+        _pid, status, self.rusage = os.wait4(self.pid, 0)
+        self.returncode = os.waitstatus_to_exitcode(status)
+        # Keep subprocess from reaping the PID again, once it is someone else's.
+        self.__popen.returncode = self.returncode
+        self.__exited.set_result(self.returncode)
+
+
+async def spawn(
+    program: str | os.PathLike[str],
+    *args: str,
+    stdin: int | None = None,
+    stdout: int | None = None,
+    stderr: int | None = None,
+    cwd: Path | None = None,
+    env: dict[str, str] | None = None,
+    start_new_session: bool = False,
+    user: str | None = None,
+) -> Child:
+    """Start ``program``, like :func:`asyncio.create_subprocess_exec`."""
+    popen = _popen(
+        [program, *args],
+        stdin=stdin,
+        stdout=stdout,
+        stderr=stderr,
+        cwd=cwd,
+        env=env,
+        start_new_session=start_new_session,
+        user=user,
+    )
+    child = Child(popen)
+    try:
+        if popen.stdin is not None:
+            child.stdin = await _writer(popen.stdin)
+        if popen.stdout is not None:
+            child.stdout = await _reader(popen.stdout)
+        if popen.stderr is not None:
+            child.stderr = await _reader(popen.stderr)
+    except BaseException:
+        child.kill()
+        raise
+    return child
+
+
+def _popen(
+    argv: list[str | os.PathLike[str]],
+    stdin: int | None,
+    stdout: int | None,
+    stderr: int | None,
+    cwd: Path | None,
+    env: dict[str, str] | None,
+    start_new_session: bool,
+    user: str | None,
+) -> subprocess.Popen[bytes]:
+    # Starting the process does not wait for it, as in asyncio's own subprocesses.
+    return subprocess.Popen(
+        argv,
+        stdin=stdin,
+        stdout=stdout,
+        stderr=stderr,
+        cwd=cwd,
+        env=env,
+        start_new_session=start_new_session,
+        user=user,
+        bufsize=0,
+    )
+
+
+async def _reader(pipe: IO[bytes]) -> StreamReader:
+    reader = StreamReader()
+    loop = asyncio.get_running_loop()
+    _ = await loop.connect_read_pipe(lambda: StreamReaderProtocol(reader), pipe)
+    return reader
+
+
+async def _writer(pipe: IO[bytes]) -> StreamWriter:
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: StreamReaderProtocol(StreamReader()), pipe
+    )
+    return StreamWriter(transport, protocol, None, loop)
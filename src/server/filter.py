@@ -0,0 +1,92 @@
+"""
+Filtering of run output requested by the client with a
+:class:`common.data.LogFilter`, so that lines the client does not want are never
+sent.
+"""
+
+import re
+from collections import deque
+
+from common.data import LogFilter
+
+_MAX_LINE = 64 * 1024
+"""
+Length after which an incomplete line is filtered without waiting for its end, and
+after which patterns are not matched, to bound the work per line.
+"""
+
+
+class LineFilter:
+    """
+    Applies a :class:`common.data.LogFilter` to a run's output, line by line. Output
+    is fed in chunks of any size; an incomplete last line is held back until the
+    rest of it arrives or the output ends. Patterns are matched against lines
+    decoded as UTF-8, without their line ending, and only against their first
+    64 KiB. Filtering runs the client's patterns, so the server does it off the
+    event loop.
+    """
+
+    spec: LogFilter
+    filtered: int = 0
+    """Lines left out so far."""
+    __include: list[re.Pattern[str]]
+    __exclude: list[re.Pattern[str]]
+    __sample: re.Pattern[str] | None
+    __partial: bytes = b""
+    __sampled: int = 0
+    """Lines which matched the sample pattern so far."""
+    __kept: int = 0
+    __tail: deque[bytes]
+
+    def __init__(self, spec: LogFilter):
+        """Raises ``ValueError`` if a pattern is invalid."""
+        self.spec = spec
+        try:
+            self.__include = [re.compile(p) for p in spec.include]
+            self.__exclude = [re.compile(p) for p in spec.exclude]
+            self.__sample = re.compile(spec.sample_pattern) if spec.sample_pattern else None
+        except re.error as e:
+            raise ValueError(f"Invalid filter pattern {e.pattern!r}: {e}")
+        self.__tail = deque(maxlen=spec.tail if spec.tail > 0 else None)
+
+    def feed(self, data: bytes) -> bytes:
+        """Filter a chunk of output. Returns the complete lines which are kept."""
+        lines = (self.__partial + data).splitlines(keepends=True)
+        self.__partial = b""
+        if lines and not lines[-1].endswith(b"\n") and len(lines[-1]) < _MAX_LINE:
+            self.__partial = lines.pop()
+        return b"".join(line for line in lines if self.__keep(line))
+
+    def finish(self) -> bytes:
+        """Filter the rest of the output, once it has ended."""
+        partial, self.__partial = self.__partial, b""
+        out = partial if partial and self.__keep(partial) else b""
+        if self.spec.tail > 0:
+            return b"".join(self.__tail)
+        return out
+
+    def __keep(self, line: bytes) -> bool:
+        """Whether to send ``line`` now. Lines kept for the tail are sent at the end."""
+        if not self.__passes(line[:_MAX_LINE].decode(errors="replace").rstrip("\r\n")):
+            self.filtered += 1
+            return False
+        if self.spec.head > 0 and self.__kept >= self.spec.head:
+            self.filtered += 1
+            return False
+        self.__kept += 1
+        if self.spec.tail > 0:
+            if len(self.__tail) == self.__tail.maxlen:
+                self.filtered += 1
+            self.__tail.append(line)
+            return False
+        return True
+
+    def __passes(self, text: str) -> bool:
+        if self.__include and not any(p.search(text) for p in self.__include):
+            return False
+        if any(p.search(text) for p in self.__exclude):
+            return False
+        if self.spec.sample > 1 and (self.__sample is None or self.__sample.search(text)):
+            self.__sampled += 1
+            return (self.__sampled - 1) % self.spec.sample == 0
+        return True
@@ -0,0 +1,66 @@
+"""
+Load of the server's host, reported in health checks so that clients can pick the
+least loaded of several servers. Every figure is cheap to read: no process
+accounting, just what the kernel already keeps.
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+from common.data import HealthResp
+from server.results import ResultCache
+from server.scheduler import Scheduler
+
+
+def mem_free() -> int:
+    """
+    Bytes of memory available to new processes. On Linux, ``MemAvailable``, which
+    counts reclaimable caches; elsewhere, free pages.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def disk_free(path: Path) -> int:
+    """Bytes free on the disk of ``path``, or of its closest existing parent."""
+    path = path.expanduser().absolute()
+    for candidate in (path, *path.parents):
+        try:
+            return shutil.disk_usage(candidate).free
+        except OSError:
+            continue
+    return 0
+
+
+def health(
+    scheduler: Scheduler, path: Path, cache: ResultCache | None = None
+) -> HealthResp:
+    """
+    The server's current load, with the free disk space under ``path`` and the hits
+    and misses of its result ``cache``, if it has one.
+    """
+    try:
+        load = os.getloadavg()[0]
+    except OSError:
+        load = 0.0
+    return HealthResp(
+        running=scheduler.running(),
+        queued=scheduler.queued(),
+        slots=scheduler.slots,
+        cpus=os.process_cpu_count() or 1,
+        load=load,
+        mem_free=mem_free(),
+        disk_free=disk_free(path),
+        cache_hits=0 if cache is None else cache.hits,
+        cache_misses=0 if cache is None else cache.misses,
+    )
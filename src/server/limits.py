@@ -0,0 +1,150 @@
+"""
+Resource limits, niceness and CPU affinity of runs, so that one runaway run cannot
+starve the others. Clients ask for limits with a :class:`common.data.Limits`; the
+server lowers them to its own ceilings, and hands out CPUs so that concurrent runs
+share as few of them as possible.
+
+Limits are applied in the run's process before it runs the target, so they hold
+for every thread the target starts: by a shim the target is started through,
+which execs it once they are in place (see :meth:`Plan.command`), or by the
+zygote the target runs in. They are not applied in a ``preexec_fn``, which is not
+safe in a process with threads.
+"""
+
+import dataclasses
+import json
+import os
+import resource
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from common.data import Limits
+    from server.args import Args
+
+MAX_NICE = 19
+
+_SHIM = f"""\
+import json, os, sys
+sys.path.insert(0, {str(Path(__file__).parents[1])!r})
+from server.limits import Plan
+Plan(**json.loads(sys.argv[1])).apply()
+try:
+    os.execv(sys.argv[2], sys.argv[2:])
+except OSError as e:
+    sys.exit(f"psync: cannot run {{sys.argv[2]}}: {{e}}")
+"""
+"""Applies the plan in its first argument, then execs the rest."""
+
+
+def _lowest(requested: int, ceiling: int) -> int:
+    """The lower of two limits, where 0 means no limit."""
+    if requested > 0 and ceiling > 0:
+        return min(requested, ceiling)
+    return requested or ceiling
+
+
+@dataclass
+class Plan:
+    """What is applied to one run's process."""
+
+    rlimits: list[tuple[int, int]] = field(default_factory=list)
+    """``(resource, limit)`` pairs, set as both the soft and hard limit."""
+    nice: int = 0
+    """Niceness added to the process."""
+    cpu_count: int = 0
+    """Number of CPUs the process should be pinned to, 0 for any."""
+    cpus: list[int] = field(default_factory=list)
+    """The CPUs the process is pinned to, once they are allocated."""
+
+    def needed(self) -> bool:
+        """Whether there is anything to apply."""
+        return bool(self.rlimits or self.nice or self.cpus)
+
+    def apply(self):
+        """
+        Apply the plan to the current process. Only its calling thread is reniced
+        and pinned, and threads started later inherit both, so this should be done
+        before there are others.
+        """
+        for res, limit in self.rlimits:
+            _soft, hard = resource.getrlimit(res)
+            if hard != resource.RLIM_INFINITY:
+                limit = min(limit, hard)
+            resource.setrlimit(res, (limit, limit))
+        if self.nice > 0:
+            _ = os.nice(self.nice)
+        if self.cpus:
+            os.sched_setaffinity(0, self.cpus)
+
+    def command(self, argv: list[str]) -> list[str]:
+        """
+        ``argv`` run under the plan, if it is needed: through a shim which applies
+        it, then execs ``argv``. The shim is a Python process started in isolated
+        mode, so the run's environment does not change what it imports.
+        """
+        if not self.needed():
+            return argv
+        plan = json.dumps(dataclasses.asdict(self))
+        return [sys.executable, "-I", "-c", _SHIM, plan, *argv]
+
+
+def plan(requested: "Limits | None", args: "Args") -> Plan:
+    """
+    The limits of a run which asked for ``requested``, lowered to the server's
+    ceilings. Raises ``ValueError`` if a limit is negative.
+    """
+    memory = cpu_seconds = open_files = nice = cpus = 0
+    if requested is not None:
+        memory = requested.memory
+        cpu_seconds = requested.cpu_seconds
+        open_files = requested.open_files
+        nice = requested.nice
+        cpus = requested.cpus
+    if min(memory, cpu_seconds, open_files, nice, cpus) < 0:
+        raise ValueError("Resource limits must not be negative")
+    rlimits = [
+        (res, limit)
+        for res, limit in (
+            (resource.RLIMIT_AS, _lowest(memory, args.max_memory)),
+            (resource.RLIMIT_CPU, _lowest(cpu_seconds, args.max_cpu_seconds)),
+            (resource.RLIMIT_NOFILE, _lowest(open_files, args.max_open_files)),
+        )
+        if limit > 0
+    ]
+    return Plan(
+        rlimits=rlimits,
+        nice=min(max(nice, args.run_nice), MAX_NICE),
+        cpu_count=_lowest(cpus, args.cpus_per_run),
+    )
+
+
+class CpuAllocator:
+    """
+    Hands out CPUs to runs, each time the ones fewest runs are pinned to, so that
+    concurrent runs get disjoint CPUs while there are enough of them.
+    """
+
+    cpus: list[int]
+    __users: dict[int, int]
+    """{[cpu: int]: number of runs pinned to it}"""
+
+    def __init__(self, cpus: list[int] | None = None):
+        self.cpus = sorted(os.sched_getaffinity(0)) if cpus is None else cpus
+        self.__users = {cpu: 0 for cpu in self.cpus}
+
+    def allocate(self, count: int) -> list[int]:
+        """Pin a run to ``count`` CPUs. Returns no CPUs if ``count`` is 0."""
+        if count <= 0:
+            return []
+        chosen = sorted(self.cpus, key=lambda cpu: (self.__users[cpu], cpu))[:count]
+        for cpu in chosen:
+            self.__users[cpu] += 1
+        return sorted(chosen)
+
+    def release(self, cpus: list[int]):
+        """Unpin a run from its CPUs."""
+        for cpu in cpus:
+            self.__users[cpu] -= 1
@@ -2,17 +2,20 @@
 psync server
 """
 
-from pprint import PrettyPrinter
-from dataclasses import dataclass
-from os import environ
 import asyncio
-from asyncio.tasks import Task
-from asyncio.subprocess import Process
-from collections.abc import Awaitable
+import logging
+import os
 import pathlib
 import signal
 import ssl
-from typing import Callable
+import uuid
+import zlib
+from asyncio.tasks import Task
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from os import environ
+from pprint import PrettyPrinter
+
 from websockets import (
     ConnectionClosedError,
     ConnectionClosedOK,
@@ -20,26 +23,109 @@ from websockets import (
 )
 from websockets.asyncio.server import serve
 from websockets.typing import Origin
+
 from common.data import (
+    MAX_MESSAGE_SIZE,
+    AttachReq,
+    BlockReq,
+    CommitReq,
+    DataResp,
     ErrorResp,
     ExitResp,
+    HealthCheckReq,
     KillReq,
+    LogFilter,
     LogResp,
     OkayResp,
     OpenReq,
+    Protocol,
+    QueuedResp,
+    Req,
+    ResizeReq,
+    Resp,
     SetPidResp,
-    HealthCheckReq,
-    serialize,
-    deserialize,
+    StatsResp,
+    SyncReq,
+    TreeReq,
+    TreeResp,
+    negotiated,
+    pack,
+    select_subprotocol,
+    unpack,
 )
-import logging
 from common.log import InterceptHandler
+from server import artifacts
 from server.args import (
     Args,
     parse_args,
 )
+from server.child import PIPE, STDOUT, Child, spawn
+from server.filter import LineFilter
+from server.health import health
+from server.limits import CpuAllocator, Plan, plan
+from server.mirror import MIRROR_MODES, FileMirror, Mirror, StdoutMirror
+from server.results import Recording, Result, ResultCache, result_key
+from server.runlog import OVERFLOW_POLICIES, RunLog, utf8_boundary
+from server.scheduler import Job, JobState, Scheduler
+from server.store import BlobStore
+from server.sync import SyncSession, confine, project_root, tree_token
+from server.terminal import open_pty, read_pty, set_size
+from server.usage import UsageSampler
+from server.zygote import ZygotePool, is_python
 
 pprint = PrettyPrinter().pformat
+logger = logging.getLogger(__name__)
+
+_READ_SIZE = 64 * 1024
+"""Bytes read or sent at once when output is not batched."""
+
+_SAMPLE_INTERVAL = 1.0
+"""Seconds between samples of a run's resource usage, unless the client asks for more."""
+
+
+async def read_batch(stdout: asyncio.StreamReader, limit: int, window: float) -> bytes:
+    """
+    Read the next batch of process output. Output is coalesced until either
+    ``limit`` bytes have been read or ``window`` seconds have passed since the first
+    byte of the batch arrived. With a ``limit`` of 0, output is read as it comes.
+    Returns an empty bytestring at EOF.
+    """
+    if limit <= 0:
+        # Lines are split when streamed; reading by line would fail on long lines.
+        return await stdout.read(_READ_SIZE)
+
+    chunk = await stdout.read(limit)
+    if not chunk or window <= 0:
+        return chunk
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + window
+    batch = bytearray(chunk)
+    while len(batch) < limit:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            chunk = await asyncio.wait_for(stdout.read(limit - len(batch)), timeout)
+        except TimeoutError:
+            break
+        if not chunk:
+            # EOF; the next read will report it.
+            break
+        batch += chunk
+    return bytes(batch)
+
+
+@dataclass
+class Output:
+    """One of a process' outputs, stdout or stderr, and its log."""
+
+    fd: int
+    log: RunLog
+    filter: LineFilter | None = None
+    """Leaves out the lines of output the client does not want."""
+    stream: Task[None] | None = None
+    """Sends the output to the client which opened or last attached to the run."""
 
 
 @dataclass
@@ -49,7 +135,41 @@ class PTask:
     """
 
     task: Task[None]
-    process: Process
+    run_id: str
+    host: str
+    job: Job
+    process: Child | None = None
+    """The process, once the run has been given a slot and started."""
+    outputs: list[Output] = field(default_factory=list)
+    """The process' stdout, and its stderr if it is split, once it has started."""
+    killed: bool = False
+    raw: bool = False
+    """Send output as undecoded bytes rather than text."""
+    filter: LogFilter | None = None
+    """Which lines of output the client wants."""
+    terminal: int | None = None
+    """Controller of the process' pseudo-terminal, while it runs under one."""
+    limits: Plan = field(default_factory=Plan)
+    """Resource limits and CPUs of the process."""
+    usage: UsageSampler | None = None
+    """Resources used by the process, once it has started."""
+    stats_interval: float = 0
+    """Seconds between the usage samples sent to the client, 0 for none."""
+    client: ServerConnection | None = None
+    """The connection of the client which opened or last attached to the run."""
+    root: pathlib.Path | None = None
+    """
+    The synced project the executable is in. It is the process' working directory,
+    and artifacts are relative to it.
+    """
+    artifacts: list[str] = field(default_factory=list)
+    """Glob patterns of the files to send back once the process exits."""
+    artifact_digests: dict[str, str] = field(default_factory=dict)
+    """Digests of the client's copies of the artifacts."""
+    recording: Recording | None = None
+    """The process' output, recorded to cache its result once it exits."""
+    cached: bool = False
+    """The run's result was replayed from the result cache."""
 
 
 class PsyncServer:
@@ -59,16 +179,42 @@ class PsyncServer:
 
     args: Args
 
-    __tasks: dict[str, dict[int, PTask]] = {}
-    """{[host: str]: {[pid: str]: PTask} }"""
+    __runs: dict[str, PTask]
+    """{[run_id: str]: PTask}"""
     __coroutine: Task[None] | None = None
     """The main coroutine for this server."""
 
     __force_shutdown: bool = False
+    __store: BlobStore | None = None
+    __gc_task: Task[None] | None = None
+    __scheduler: Scheduler
+    __zygotes: ZygotePool | None = None
+    __mirror: Mirror | None = None
+    __cpus: CpuAllocator
+    __results: ResultCache | None = None
 
     def __init__(self, args: Args):
-        logging.debug(pprint(args))
+        logger.debug(pprint(args))
         self.args = args
+        self.__runs = {}
+        self.__scheduler = Scheduler(args.slots)
+        self.__cpus = CpuAllocator()
+        if args.log_overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown log overflow policy {args.log_overflow!r}")
+        if args.mirror not in MIRROR_MODES:
+            raise ValueError(f"Unknown mirror {args.mirror!r}")
+        if args.store_path is not None:
+            self.__store = BlobStore(
+                args.store_path,
+                args.store_link,
+                args.store_retention_days * 24 * 60 * 60,
+            )
+        if args.result_cache is not None:
+            self.__results = ResultCache(
+                args.result_cache,
+                args.result_cache_bytes,
+                args.result_cache_entry_bytes,
+            )
 
     def __get_host(self, ws: ServerConnection) -> str:
         addrs: tuple[str, str] = ws.remote_address  # pyright: ignore[reportAny]
@@ -84,41 +230,76 @@ class PsyncServer:
             pathlib.Path(self.args.cert_path).expanduser(),
             pathlib.Path(self.args.key_path).expanduser(),
         )
-        logging.debug(pprint(ssl_ctx.get_ca_certs()))
+        logger.debug(pprint(ssl_ctx.get_ca_certs()))
         server = await serve(
             (self.__handle()),
             self.args.host,
             int(self.args.port),
             ssl=ssl_ctx,
+            select_subprotocol=select_subprotocol,
+            max_size=MAX_MESSAGE_SIZE,
             origins=list(map(lambda x: Origin(f"wss://{x}"), self.args.origins)),
         )
+        if self.__store is not None:
+            self.__gc_task = asyncio.create_task(self.__collect_garbage(self.__store))
+        if self.args.zygote_pool > 0:
+            self.__zygotes = ZygotePool(
+                self.args.zygote_pool, self.args.zygote_modules, self.args.user
+            )
+            self.__zygotes.start()
+        if self.args.mirror == "file":
+            self.__mirror = FileMirror(
+                self.args.mirror_dir,
+                self.args.mirror_file_bytes,
+                self.args.mirror_backups,
+            )
+        elif self.args.mirror == "stdout":
+            self.__mirror = StdoutMirror(self.args.mirror_rate)
         self.__coroutine = asyncio.create_task(server.serve_forever())
         try:
             await self.__coroutine
         except RuntimeError as e:
             # 'event loop stopped before Future completed'
-            logging.info(f"Got error {e}")
+            logger.info(f"Got error {e}")
             pass
+        finally:
+            if self.__zygotes is not None:
+                await self.__zygotes.close()
+            if self.__mirror is not None:
+                await asyncio.to_thread(self.__mirror.close)
 
-    async def __end_session(self, ws: ServerConnection):
+    async def __send(self, ws: ServerConnection, msg: Req | Resp):
+        await ws.send(pack(msg, negotiated(ws.subprotocol)))
+
+    async def __collect_garbage(self, store: BlobStore):
+        while True:
+            try:
+                _ = await asyncio.to_thread(store.gc)
+            except OSError as e:
+                logger.error(f"Store GC failed: {e}")
+            await asyncio.sleep(self.args.store_gc_interval)
+
+    def __find(self, req: KillReq, ws: ServerConnection) -> PTask | None:
+        if req.run_id:
+            return self.__runs.get(req.run_id)
+        # Text protocol clients only know the PID.
         host = self.__get_host(ws)
-        try:
-            _ = self.__tasks.pop(host)
-        except Exception:
-            pass
-        await ws.close()
+        for task in self.__runs.values():
+            if task.host == host and task.process and task.process.pid == req.pid:
+                return task
+        return None
 
     def __mk_handle_signal(self, ws: ServerConnection):
         async def inner():
             if not self.__force_shutdown:
-                logging.info("Gracefully shutting down...")
+                logger.info("Gracefully shutting down...")
                 self.__force_shutdown = True
                 await ws.close()
                 _ = self.__coroutine.cancel()  # pyright: ignore[reportOptionalMemberAccess]
                 asyncio.get_event_loop().stop()
                 raise SystemExit(130)
             else:
-                logging.warning("Second Ctrl-C detected, forcing shutdown.")
+                logger.warning("Second Ctrl-C detected, forcing shutdown.")
                 raise SystemExit(1)
 
         return lambda: asyncio.create_task(inner())
@@ -128,18 +309,16 @@ class PsyncServer:
             asyncio.get_event_loop().add_signal_handler(
                 signal.SIGINT, self.__mk_handle_signal(ws)
             )
+            protocol = negotiated(ws.subprotocol)
+            logger.debug(f"Negotiated {protocol.name} protocol")
+            sync: SyncSession | None = None
             try:
                 async for data in ws:
-                    if isinstance(data, bytes):
-                        msg = data.decode()
-                    else:
-                        msg = data
-
                     try:
-                        req = deserialize(msg)
+                        req = unpack(data, protocol)
                     except ValueError as e:
-                        logging.error(e)
-                        await ws.send(serialize(ErrorResp(f"{e}")))
+                        logger.error(e)
+                        await self.__send(ws, ErrorResp(f"{e}"))
                         continue
 
                     match req:
@@ -147,24 +326,280 @@ class PsyncServer:
                             await self.__open(req, ws)
                         case KillReq():
                             await self.__kill(req, ws)
+                        case AttachReq():
+                            await self.__reattach(req, ws)
+                        case ResizeReq():
+                            self.__resize(req)
                         case HealthCheckReq():
-                            logging.info("Health check OK")
-                            await ws.send(serialize(OkayResp()))
+                            logger.info("Health check OK")
+                            if protocol is Protocol.Binary:
+                                path = pathlib.Path(req.path or os.getcwd())
+                                await self.__send(ws, health(self.__scheduler, path, self.__results))
+                            else:
+                                await self.__send(ws, OkayResp())
                             await ws.close()
+                        case SyncReq() | BlockReq() | CommitReq():
+                            sync = await self.__sync(req, ws, sync)
+                        case TreeReq():
+                            await self.__tree(req, ws)
                         case _:
-                            logging.warning(f"Got unknown request {req}")
+                            logger.warning(f"Got unknown request {req}")
             except ConnectionClosedOK:
-                logging.info("connection closed")
+                logger.info("connection closed")
                 pass
             except Exception as e:
-                logging.error(e)
-                await self.__end_session(ws)
+                logger.error(e)
+                await ws.close()
+            finally:
+                if sync is not None:
+                    sync.abort()
 
         return inner
 
+    async def __sync(
+        self,
+        req: SyncReq | BlockReq | CommitReq,
+        ws: ServerConnection,
+        session: SyncSession | None,
+    ) -> SyncSession | None:
+        """
+        Handle a native sync message. Returns the connection's sync session, which
+        is kept between messages until the sync is committed or fails.
+        """
+        try:
+            match req:
+                case SyncReq():
+                    if session is not None:
+                        session.abort()
+                    session = SyncSession(
+                        req, pathlib.Path(self.args.server_dest), self.__store
+                    )
+                    await self.__send(ws, await asyncio.to_thread(session.plan))
+                case BlockReq():
+                    if session is None:
+                        raise ValueError("Got a block outside of a sync")
+                    await asyncio.to_thread(session.write, req)
+                case CommitReq():
+                    if session is None:
+                        raise ValueError("Got a commit outside of a sync")
+                    await asyncio.to_thread(session.commit)
+                    await self.__send(ws, OkayResp())
+                    session = None
+            return session
+        except (OSError, ValueError, zlib.error) as e:
+            msg = f"Sync failed: {e}"
+            logger.error(msg)
+            if session is not None:
+                session.abort()
+            await self.__send(ws, ErrorResp(msg))
+            return None
+
+    async def __tree(self, req: TreeReq, ws: ServerConnection):
+        """Send the token of a synced tree, which must be under ``server_dest``."""
+        try:
+            root = confine(pathlib.Path(self.args.server_dest), req.root)
+            token = await asyncio.to_thread(tree_token, root)
+        except (OSError, ValueError) as e:
+            msg = f"Tree query failed: {e}"
+            logger.error(msg)
+            await self.__send(ws, ErrorResp(msg))
+            return
+        await self.__send(ws, TreeResp(token))
+
     async def __open(self, req: OpenReq, ws: ServerConnection):
-        host = self.__get_host(ws)
-        path = pathlib.Path.expanduser(req.path).resolve()
+        run_id = req.run_id or uuid.uuid4().hex
+        if run_id in self.__runs:
+            msg = f"Run {run_id} is already running."
+            logger.error(msg)
+            await self.__send(ws, ErrorResp(msg, run_id))
+            return
+
+        try:
+            if req.filter is not None:
+                _ = LineFilter(req.filter)
+            limits = plan(req.limits, self.args)
+            artifacts.check(req.artifacts)
+        except ValueError as e:
+            logger.error(str(e))
+            await self.__send(ws, ErrorResp(str(e), run_id))
+            return
+
+        job = self.__scheduler.submit(run_id, self.__get_host(ws), req.priority)
+        task = asyncio.create_task(self.__run(req, ws, run_id, job))
+        self.__runs[run_id] = PTask(
+            task,
+            run_id,
+            self.__get_host(ws),
+            job,
+            raw=req.raw,
+            filter=req.filter,
+            limits=limits,
+            stats_interval=req.stats_interval,
+            root=project_root(pathlib.Path(self.args.server_dest), req.path),
+            artifacts=req.artifacts,
+            artifact_digests=req.artifact_digests,
+        )
+
+    async def __run(self, req: OpenReq, ws: ServerConnection, run_id: str, job: Job):
+        """
+        Wait for a slot, then start the process and collect its output. Once the
+        process exits, its output is kept for ``run_retention`` seconds in case the
+        client re-attaches.
+        """
+        ptask = self.__runs[run_id]
+        try:
+            result = await self.__lookup(req, ptask)
+            if result is not None:
+                await self.__replay(ptask, ws, result)
+            else:
+                await self.__execute(req, ws, ptask, job)
+        except (ConnectionClosedError, ConnectionClosedOK):
+            pass
+        finally:
+            self.__scheduler.done(job)
+            self.__cpus.release(ptask.limits.cpus)
+            ptask.limits.cpus = []
+            if not ptask.outputs or not ptask.outputs[0].log.finished:
+                self.__forget(ptask)
+        if self.__runs.get(run_id) is ptask:
+            await asyncio.sleep(self.args.run_retention)
+            self.__forget(ptask)
+
+    async def __execute(self, req: OpenReq, ws: ServerConnection, ptask: PTask, job: Job):
+        """Wait for a slot, then run the process until it exits."""
+        if not job.granted.done():
+            position = self.__scheduler.position(job)
+            logger.info(f"Queued run {ptask.run_id} at position {position}")
+            if negotiated(ws.subprotocol) is Protocol.Binary:
+                eta = self.__scheduler.eta(job)
+                await self.__send(ws, QueuedResp(position, eta, ptask.run_id))
+            await job.granted
+
+        ptask.limits.cpus = self.__cpus.allocate(ptask.limits.cpu_count)
+        process = await self.__spawn(req, ws, ptask)
+        if process is None:
+            return
+        ptask.process = process
+        fds = [1] if process.stderr is None else [1, 2]
+        ptask.outputs = self.__outputs(ptask, fds)
+        if ptask.recording is not None:
+            ptask.recording.outputs = {fd: bytearray() for fd in fds}
+        if ptask.killed:
+            process.kill()
+        self.__attach(ptask, ws, [0] * len(fds))
+        await self.__pump(ptask, process)
+        if ptask.recording is not None:
+            await self.__record(ptask, ptask.recording, process)
+
+    def __outputs(self, ptask: PTask, fds: list[int]) -> list[Output]:
+        return [
+            Output(
+                fd,
+                RunLog(
+                    self.args.run_log_memory,
+                    self.args.run_log_dir,
+                    self.args.log_overflow,
+                    self.args.run_log_spill_bytes,
+                ),
+                None if ptask.filter is None else LineFilter(ptask.filter),
+            )
+            for fd in fds
+        ]
+
+    async def __lookup(self, req: OpenReq, ptask: PTask) -> Result | None:
+        """
+        Look the run up in the result cache, if the server has one and the run may be
+        cached. Runs which send artifacts back are not cached, since their files
+        would not be. On a miss, the run is recorded.
+        """
+        cache = self.__results
+        if cache is None or not req.cache or req.artifacts:
+            return None
+        try:
+            key = await asyncio.to_thread(
+                result_key,
+                req,
+                pathlib.Path(self.args.server_dest),
+                self.__environ(req),
+                ptask.limits,
+                self.args.user,
+            )
+        except OSError as e:
+            logger.warning(f"Not caching run {ptask.run_id}: {e}")
+            return None
+        result = await asyncio.to_thread(cache.get, key)
+        if result is None:
+            ptask.recording = cache.recording(key)
+        return result
+
+    async def __replay(self, ptask: PTask, ws: ServerConnection, result: Result):
+        """
+        Send a cached result as though the process had run, through the same
+        filters, logs and mirror.
+        """
+        logger.info(f"Replaying cached result of run {ptask.run_id}")
+        ptask.cached = True
+        fds = sorted(result.outputs)
+        ptask.outputs = self.__outputs(ptask, fds)
+        readers: list[asyncio.StreamReader] = []
+        for fd in fds:
+            reader = asyncio.StreamReader()
+            reader.feed_data(result.outputs[fd])
+            reader.feed_eof()
+            readers.append(reader)
+        self.__attach(ptask, ws, [0] * len(fds))
+        _ = await asyncio.gather(
+            *(
+                self.__pump_output(ptask, output, reader)
+                for output, reader in zip(ptask.outputs, readers)
+            )
+        )
+        if self.__mirror is not None:
+            self.__mirror.end(ptask.run_id)
+        for output in ptask.outputs:
+            output.log.finish(result.exit_code)
+
+    async def __record(self, ptask: PTask, recording: Recording, process: Child):
+        """Cache the result of a run which exited on its own."""
+        cache = self.__results
+        returncode = process.returncode
+        if cache is None or returncode is None or returncode < 0 or ptask.killed:
+            return
+        if recording.overflowed:
+            logger.info(f"Not caching run {ptask.run_id}, whose output is too large")
+            return
+        try:
+            await asyncio.to_thread(cache.put, recording.key, recording.result(returncode))
+        except OSError as e:
+            logger.error(f"Failed to cache the result of run {ptask.run_id}: {e}")
+
+    def __attach(self, ptask: PTask, ws: ServerConnection, offsets: list[int]):
+        """
+        Stream the run's outputs, each from its offset in ``offsets``, to ``ws``
+        instead of any previous client.
+        """
+        ptask.client = ws
+        for output, offset in zip(ptask.outputs, offsets):
+            if output.stream is not None:
+                _ = output.stream.cancel()
+            output.stream = asyncio.create_task(
+                self.__stream(ptask, output, ws, offset)
+            )
+
+    def __forget(self, ptask: PTask):
+        if self.__runs.get(ptask.run_id) is ptask:
+            _ = self.__runs.pop(ptask.run_id)
+        if ptask.terminal is not None:
+            os.close(ptask.terminal)
+            ptask.terminal = None
+        for output in ptask.outputs:
+            output.log.close()
+        if ptask.task is not asyncio.current_task():
+            # Stop waiting out the retention period.
+            _ = ptask.task.cancel()
+
+    def __environ(self, req: OpenReq) -> dict[str, str]:
+        """The environment the run's process is spawned with."""
         base_env = environ.copy() if self.args.use_base_env else {}
         if not self.args.use_base_env:
             # still get path and etc
@@ -174,83 +609,297 @@ class PsyncServer:
             if 'VIRTUAL_ENV' in environ:
                 base_env['VIRUTAL_ENV'] = environ['VIRTUAL_ENV']
                 base_env["PATH"] = f"{environ['VIRTUAL_ENV']}/bin:{base_env["PATH"]}"
-        env = base_env | req.env
+        return base_env | req.env
+
+    async def __spawn(
+        self, req: OpenReq, ws: ServerConnection, ptask: PTask
+    ) -> Child | None:
+        path = pathlib.Path.expanduser(req.path).resolve()
+        env = self.__environ(req)
 
         info_log = f"Running `{path} {' '.join(req.args)}`"
         if env != {}:
             info_log += f"\n... with env {pprint(env)}"
         if self.args.user is not None:
             info_log += f"... as user {self.args.user}"
+        limits = ptask.limits
+        if limits.needed():
+            info_log += f"\n... with limits {pprint(limits)}"
 
-        logging.info(info_log)
+        logger.info(info_log)
 
         try:
-            p = await asyncio.create_subprocess_exec(
-                path,
-                *req.args,
-                env=env,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.STDOUT,
-                user=self.args.user,
-            )
-            task = PTask(asyncio.create_task(self.__log(ws, p)), p)
-
-            if self.__tasks.get(host) is None:
-                self.__tasks[host] = {p.pid: task}
-            else:
-                self.__tasks[host][p.pid] = task
-
-            resp = SetPidResp(pid=p.pid)
-            await ws.send(serialize(resp))
-
+            p = None
+            split = req.split_stderr
+            # Zygotes' stderr is merged into their stdout when they start.
+            if self.__zygotes is not None and not (req.pty or split) and is_python(path):
+                p = await self.__zygotes.spawn(path, req.args, env, limits, ptask.root)
+                if p is not None:
+                    logger.debug(f"Started in zygote {p.pid}")
+            in_zygote = p is not None
+            if p is None and req.pty:
+                controller, terminal = open_pty(req.rows, req.cols)
+                try:
+                    p = await spawn(
+                        *limits.command([str(path), *req.args]),
+                        env=env,
+                        stdin=terminal,
+                        stdout=terminal,
+                        stderr=PIPE if split else terminal,
+                        cwd=ptask.root,
+                        start_new_session=True,
+                        user=self.args.user,
+                    )
+                except BaseException:
+                    os.close(controller)
+                    raise
+                finally:
+                    os.close(terminal)
+                ptask.terminal = controller
+            if p is None:
+                p = await spawn(
+                    *limits.command([str(path), *req.args]),
+                    env=env,
+                    stdout=PIPE,
+                    stderr=PIPE if split else STDOUT,
+                    cwd=ptask.root,
+                    user=self.args.user,
+                )
+            ptask.usage = UsageSampler(p.pid, since_now=in_zygote)
         except Exception as e:
-            logging.error(f"Failed to start process `{path}` with error {e}")
-            resp = ErrorResp(f"Server error: {e}")
-            await ws.send(serialize(resp))
-
-    async def __log(self, ws: ServerConnection, process: asyncio.subprocess.Process):
+            logger.error(f"Failed to start process `{path}` with error {e}")
+            resp = ErrorResp(f"Server error: {e}", ptask.run_id)
+            await self.__send(ws, resp)
+            return None
+
+        await self.__send(ws, SetPidResp(pid=p.pid, run_id=ptask.run_id))
+        return p
+
+    async def __pump(self, ptask: PTask, process: Child):
+        """Append the process' outputs to their logs until it exits."""
+        logger.info(f"Running process with PID {process.pid} (run {ptask.run_id})")
+        stdout = process.stdout
+        if ptask.terminal is not None:
+            stdout = await read_pty(ptask.terminal)
+        readers = [stdout, process.stderr]
+        sampler = asyncio.create_task(self.__sample(ptask))
         try:
-            logging.info(f"Running process with PID {process.pid}")
-            if process.stdout is not None:
-                while True:
-                    line = await process.stdout.readline()
-                    if not line:
-                        break
-                    msg = line.decode("utf-8")
-                    print(msg, end="")
-                    await ws.send(serialize(LogResp(msg)))
+            _ = await asyncio.gather(
+                *(
+                    self.__pump_output(ptask, output, reader)
+                    for output, reader in zip(ptask.outputs, readers)
+                )
+            )
+            if self.__mirror is not None:
+                self.__mirror.end(ptask.run_id)
 
             returncode = await process.wait()
-            logging.info(f"process exited with code {returncode}")
-            await ws.send(serialize(ExitResp(exit_code=str(returncode))))
-            await self.__end_session(ws)
-
-        except (KeyError, ConnectionClosedError, ConnectionClosedOK):
-            pass
+        finally:
+            _ = sampler.cancel()
+        if ptask.usage is not None:
+            _ = ptask.usage.finish(process.rusage)
+        logger.info(f"process exited with code {returncode}")
+        if ptask.terminal is not None:
+            os.close(ptask.terminal)
+            ptask.terminal = None
+        for output in ptask.outputs:
+            output.log.finish(returncode)
+
+    async def __sample(self, ptask: PTask):
+        """
+        Sample the process' resource usage until it exits, sending each sample to
+        the client if it asked for them.
+        """
+        usage = ptask.usage
+        if usage is None:
+            return
+        interval = ptask.stats_interval if ptask.stats_interval > 0 else _SAMPLE_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            sample = usage.sample()
+            ws = ptask.client
+            if ptask.stats_interval <= 0 or ws is None:
+                continue
+            if negotiated(ws.subprotocol) is not Protocol.Binary:
+                continue
+            try:
+                await self.__send(ws, StatsResp(ptask.run_id, sample))
+            except (ConnectionClosedError, ConnectionClosedOK):
+                pass
 
-    async def __kill(self, req: KillReq, ws: ServerConnection):
-        host = self.__get_host(ws)
-        tasks = self.__tasks.get(host)
-        if tasks is None:
-            msg = f"Tried to kill process for host {host}, but no process was running."
-            logging.error(msg)
-            await ws.send(serialize(ErrorResp(msg)))
+    async def __pump_output(
+        self, ptask: PTask, output: Output, reader: asyncio.StreamReader | None
+    ):
+        """Append one of the process' outputs to its log until it is closed."""
+        if reader is None:
             return
+        log = output.log
+        while True:
+            await log.writable()
+            chunk = await read_batch(
+                reader, self.args.log_batch_bytes, self.args.log_batch_ms / 1000
+            )
+            if not chunk:
+                break
+            if self.__mirror is not None:
+                self.__mirror.write(ptask.run_id, chunk)
+            if ptask.recording is not None:
+                ptask.recording.add(output.fd, chunk)
+            if output.filter is not None:
+                # Client patterns may be slow; keep them from stalling other runs.
+                chunk = await asyncio.to_thread(output.filter.feed, chunk)
+            if chunk:
+                await log.append(chunk)
+        if output.filter is not None:
+            await log.append(await asyncio.to_thread(output.filter.finish))
+
+    async def __stream(
+        self, ptask: PTask, output: Output, ws: ServerConnection, offset: int
+    ):
+        """
+        Send one of the run's outputs from ``offset`` until the run exits. Once all
+        of them were sent, the stdout stream sends the exit code and forgets the
+        run. Stops early if the connection closes; the run keeps going and its
+        output is kept, so that the client can re-attach.
+        """
+        log = output.log
+        fd = output.fd
+        limit = self.args.log_batch_bytes
+        try:
+            while True:
+                if offset < log.start:
+                    dropped = log.start - offset
+                    offset = log.start
+                    marker = f"\n[psync: dropped {dropped} bytes of output]\n"
+                    logger.warning(f"Run {ptask.run_id}: dropped {dropped} bytes of output")
+                    if ptask.raw:
+                        resp = DataResp(marker.encode(), ptask.run_id, offset, fd)
+                    else:
+                        resp = LogResp(marker, ptask.run_id, offset, fd)
+                    await self.__send(ws, resp)
+                data = await log.read(offset, limit if limit > 0 else _READ_SIZE)
+                if ptask.raw:
+                    size = len(data)
+                else:
+                    if limit <= 0 and b"\n" in data:
+                        data = data[: data.index(b"\n") + 1]
+                    final = log.finished and offset + len(data) == log.end
+                    size = len(data) if final else utf8_boundary(data)
+                if size:
+                    offset += size
+                    if ptask.raw:
+                        resp = DataResp(data, ptask.run_id, offset, fd)
+                    else:
+                        msg = data[:size].decode(errors="replace")
+                        resp = LogResp(msg, ptask.run_id, offset, fd)
+                    await self.__send(ws, resp)
+                    log.sent(offset)
+                    # Sends which do not block never yield; let the pump keep up.
+                    await asyncio.sleep(0)
+                elif log.finished and offset == log.end:
+                    if output is not ptask.outputs[0]:
+                        return
+                    others = [o.stream for o in ptask.outputs[1:] if o.stream is not None]
+                    if others:
+                        _ = await asyncio.wait(others)
+                    exit_code = str(log.exit_code)
+                    filtered = sum(
+                        o.filter.filtered for o in ptask.outputs if o.filter is not None
+                    )
+                    if ptask.artifacts:
+                        await self.__send_artifacts(ptask, ws)
+                    usage = None if ptask.usage is None else ptask.usage.usage
+                    await self.__send(
+                        ws,
+                        ExitResp(exit_code, ptask.run_id, filtered, usage, ptask.cached),
+                    )
+                    self.__forget(ptask)
+                    return
+                else:
+                    await log.wait(offset + len(data))
+        except (ConnectionClosedError, ConnectionClosedOK):
+            logger.info(f"Client of run {ptask.run_id} went away at offset {offset}")
+
+    async def __send_artifacts(self, ptask: PTask, ws: ServerConnection):
+        """Send the files matching the run's artifact patterns, if they changed."""
+        root = ptask.root
+        if root is None:
+            return
+        try:
+            files = await asyncio.to_thread(
+                artifacts.find, root, ptask.artifacts, ptask.artifact_digests
+            )
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to find artifacts of run {ptask.run_id}: {e}")
+            return
+        logger.info(f"Sending {len(files)} artifacts of run {ptask.run_id}")
+        for rel, file in files.items():
+            chunks = artifacts.chunks(ptask.run_id, root, rel, file)
+            try:
+                while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                    await self.__send(ws, chunk)
+            except OSError as e:
+                logger.error(f"Failed to send artifact {rel} of run {ptask.run_id}: {e}")
 
-        task = tasks.get(req.pid)
+    async def __kill(self, req: KillReq, ws: ServerConnection):
+        task = self.__find(req, ws)
         if task is None:
-            msg = f"Tried to kill process {req.pid}, but it was not found."
-            logging.error(msg)
-            await ws.send(serialize(ErrorResp(msg)))
+            target = f"run {req.run_id}" if req.run_id else f"process {req.pid}"
+            msg = f"Tried to kill {target}, but it was not found."
+            logger.error(msg)
+            await self.__send(ws, ErrorResp(msg, req.run_id))
             return
 
         process = task.process
-        logging.info(f"Killing PID {process.pid}")
+        if process is None:
+            if task.job.state is JobState.Waiting:
+                logger.info(f"Removing run {task.run_id} from the queue")
+                _ = task.task.cancel()
+                exit_code = str(-signal.SIGKILL)
+                await self.__send(ws, ExitResp(exit_code=exit_code, run_id=task.run_id))
+            else:
+                # The process is being started, and is killed once it is.
+                task.killed = True
+            return
+
+        if process.returncode is not None:
+            logger.info(f"Run {task.run_id} already exited")
+            return
+
+        logger.info(f"Killing PID {process.pid}")
+        # The run's stream reports the exit.
         process.kill()
-        code = await process.wait()
-        resp = ExitResp(str(code))
-        await ws.send(serialize(resp))
-        await ws.close()
+
+    def __resize(self, req: ResizeReq):
+        task = self.__runs.get(req.run_id)
+        if task is None or task.terminal is None or task.process is None:
+            logger.debug(f"Run {req.run_id} has no terminal to resize")
+            return
+        set_size(task.terminal, req.rows, req.cols)
+        # The terminal is not the process' controlling terminal, so the kernel does
+        # not signal the resize.
+        try:
+            os.killpg(task.process.pid, signal.SIGWINCH)
+        except ProcessLookupError:
+            pass
+
+    async def __reattach(self, req: AttachReq, ws: ServerConnection):
+        task = self.__runs.get(req.run_id)
+        if task is None or not task.outputs:
+            msg = f"Tried to attach to run {req.run_id}, but it was not found."
+            logger.error(msg)
+            await self.__send(ws, ErrorResp(msg, req.run_id))
+            return
+        offsets = [req.offset, req.stderr_offset]
+        for output, offset in zip(task.outputs, offsets):
+            if not 0 <= offset <= output.log.end:
+                msg = f"Cannot attach to run {req.run_id} at offset {offset}."
+                logger.error(msg)
+                await self.__send(ws, ErrorResp(msg, req.run_id))
+                return
+
+        logger.info(f"Attaching to run {req.run_id} at offset {req.offset}")
+        self.__attach(task, ws, offsets)
 
 
 def main(args: Args | None = None):
@@ -0,0 +1,266 @@
+"""
+Copies of run output kept on the server itself, in addition to what is streamed to
+the client: either in per-run files or on the server's stdout.
+
+Mirrors never block the event loop. Output is handed to a writer thread, which does
+all of the disk and terminal I/O. Output which the writer cannot keep up with, or
+which exceeds the mirror's rate limit, is dropped, and the mirror notes how much.
+"""
+
+import hashlib
+import logging
+import queue
+import re
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from pathlib import Path
+from typing import BinaryIO, override
+
+logger = logging.getLogger(__name__)
+
+MIRROR_MODES = ["off", "file", "stdout"]
+"""Where run output is mirrored on the server."""
+
+_MAX_PENDING = 8 * 2**20
+"""Bytes of output waiting for the writer thread before further output is dropped."""
+
+_MAX_LINE = 64 * 1024
+"""Length after which an incomplete line is mirrored without waiting for its end."""
+
+_SAFE_RUN_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+"""Run IDs which are used as file names as they are."""
+
+
+class Mirror(ABC):
+    """
+    Base class of the mirrors. :meth:`write` and :meth:`end` are called from the
+    event loop; subclasses implement :meth:`_emit`, :meth:`_skip` and
+    :meth:`_finish`, and may override :meth:`_flush` and :meth:`_close`, all of
+    which are called on the writer thread.
+
+    ``rate`` limits the output mirrored, in bytes per second, with bursts of up to
+    one second's worth. Set to 0 for no limit.
+    """
+
+    rate: int
+    __queue: queue.SimpleQueue[tuple[str, bytes | None, int] | None]
+    __thread: threading.Thread
+    __lock: threading.Lock
+    __pending: int = 0
+    __dropped: defaultdict[str, int]
+    """Bytes dropped per run since its last queued output."""
+    __tokens: float
+    __refilled: float
+
+    def __init__(self, rate: int = 0):
+        self.rate = rate
+        self.__queue = queue.SimpleQueue()
+        self.__lock = threading.Lock()
+        self.__dropped = defaultdict(int)
+        self.__tokens = rate
+        self.__refilled = time.monotonic()
+        self.__thread = threading.Thread(
+            target=self.__work, name=type(self).__name__, daemon=True
+        )
+        self.__thread.start()
+
+    def write(self, run_id: str, data: bytes):
+        """Mirror output of a run. Never blocks."""
+        if not self.__admit(len(data)):
+            self.__dropped[run_id] += len(data)
+            return
+        with self.__lock:
+            self.__pending += len(data)
+        self.__queue.put((run_id, data, self.__dropped.pop(run_id, 0)))
+
+    def end(self, run_id: str):
+        """Record that a run exited. Never blocks."""
+        self.__queue.put((run_id, None, self.__dropped.pop(run_id, 0)))
+
+    def close(self):
+        """Write out everything queued and stop the writer thread. Blocks."""
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def __admit(self, size: int) -> bool:
+        with self.__lock:
+            if self.__pending + size > _MAX_PENDING:
+                return False
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.__tokens = min(self.rate, self.__tokens + (now - self.__refilled) * self.rate)
+        self.__refilled = now
+        if size > self.__tokens:
+            return False
+        self.__tokens -= size
+        return True
+
+    def __work(self):
+        while (item := self.__queue.get()) is not None:
+            run_id, data, dropped = item
+            try:
+                if dropped:
+                    self._skip(run_id, dropped)
+                if data is None:
+                    self._finish(run_id)
+                else:
+                    self._emit(run_id, data)
+            except OSError as e:
+                logger.error(f"Failed to mirror output of run {run_id}: {e}")
+            if data is not None:
+                with self.__lock:
+                    self.__pending -= len(data)
+            if self.__queue.empty():
+                self._flush()
+        self._close()
+
+    @abstractmethod
+    def _emit(self, run_id: str, data: bytes):
+        """Write output of a run."""
+
+    @abstractmethod
+    def _skip(self, run_id: str, dropped: int):
+        """Note that ``dropped`` bytes of a run's output were not mirrored."""
+
+    @abstractmethod
+    def _finish(self, run_id: str):
+        """Write out what is left of a run, which has exited."""
+
+    def _flush(self):
+        """Called whenever the writer has caught up."""
+
+    def _close(self):
+        """Release everything still open."""
+
+
+class FileMirror(Mirror):
+    """
+    Writes each run's output to ``<directory>/<run_id>.log``. Once a file would grow
+    past ``max_bytes``, it is rotated to ``<run_id>.log.1``, and so on, keeping
+    ``backups`` old files. Set ``max_bytes`` to 0 to never rotate.
+
+    Run IDs are chosen by clients, so IDs which are not made of letters, digits,
+    ``-`` and ``_`` are replaced by their hash in file names.
+    """
+
+    directory: Path
+    max_bytes: int
+    backups: int
+    __files: dict[str, BinaryIO]
+    __sizes: dict[str, int]
+
+    def __init__(
+        self, directory: Path, max_bytes: int = 0, backups: int = 0, rate: int = 0
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.__files = {}
+        self.__sizes = {}
+        super().__init__(rate)
+
+    def path(self, run_id: str, backup: int = 0) -> Path:
+        """Path of a run's file, or of one of its old files."""
+        if not _SAFE_RUN_ID.fullmatch(run_id):
+            run_id = hashlib.blake2b(run_id.encode(), digest_size=16).hexdigest()
+        name = f"{run_id}.log" if backup == 0 else f"{run_id}.log.{backup}"
+        return self.directory / name
+
+    @override
+    def _emit(self, run_id: str, data: bytes):
+        file = self.__files.get(run_id)
+        size = self.__sizes.get(run_id, 0)
+        if file is not None and 0 < self.max_bytes < size + len(data):
+            file.close()
+            self.__rotate(run_id)
+            file = None
+            size = 0
+        if file is None:
+            file = self.__open(run_id)
+            self.__files[run_id] = file
+            size = file.tell()
+        _ = file.write(data)
+        self.__sizes[run_id] = size + len(data)
+
+    @override
+    def _skip(self, run_id: str, dropped: int):
+        self._emit(run_id, f"\n[psync: {dropped} bytes not mirrored]\n".encode())
+
+    @override
+    def _finish(self, run_id: str):
+        file = self.__files.pop(run_id, None)
+        _ = self.__sizes.pop(run_id, None)
+        if file is not None:
+            file.close()
+
+    @override
+    def _flush(self):
+        for file in self.__files.values():
+            file.flush()
+
+    @override
+    def _close(self):
+        for file in self.__files.values():
+            file.close()
+        self.__files.clear()
+
+    def __open(self, run_id: str) -> BinaryIO:
+        """Open a run's file for appending, creating the directory if needed."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return self.path(run_id).open("ab")
+
+    def __rotate(self, run_id: str):
+        if self.backups <= 0:
+            self.path(run_id).unlink()
+            return
+        for i in range(self.backups - 1, -1, -1):
+            source = self.path(run_id, i)
+            if source.exists():
+                _ = source.replace(self.path(run_id, i + 1))
+
+
+class StdoutMirror(Mirror):
+    """
+    Writes output to ``stream``, the server's stdout by default, one line at a time
+    with each line prefixed by its run ID, so that concurrent runs do not interleave
+    within a line.
+    """
+
+    stream: BinaryIO
+    __partial: dict[str, bytes]
+    """Incomplete last line of each run."""
+
+    def __init__(self, rate: int = 0, stream: BinaryIO | None = None):
+        self.stream = sys.stdout.buffer if stream is None else stream
+        self.__partial = {}
+        super().__init__(rate)
+
+    @override
+    def _emit(self, run_id: str, data: bytes):
+        *lines, rest = (self.__partial.pop(run_id, b"") + data).split(b"\n")
+        if len(rest) >= _MAX_LINE:
+            lines.append(rest)
+        elif rest:
+            self.__partial[run_id] = rest
+        if lines:
+            self.__write(run_id, lines)
+
+    @override
+    def _skip(self, run_id: str, dropped: int):
+        self._finish(run_id)
+        self.__write(run_id, [f"[psync: {dropped} bytes not mirrored]".encode()])
+
+    @override
+    def _finish(self, run_id: str):
+        rest = self.__partial.pop(run_id, None)
+        if rest is not None:
+            self.__write(run_id, [rest])
+
+    def __write(self, run_id: str, lines: list[bytes]):
+        prefix = f"[{run_id[:8]}] ".encode()
+        _ = self.stream.write(b"".join(prefix + line + b"\n" for line in lines))
+        self.stream.flush()
@@ -0,0 +1,178 @@
+"""
+Cache of run results, for deterministic runs which are repeated with the same
+inputs, e.g. from CI. A run's result is its exit code and its output, keyed by the
+synced project tree, the executable and its arguments and environment. When an
+identical run is opened again, its output is replayed instead of running it.
+
+Results are kept on disk, one file per result, and the least recently used ones are
+evicted once the cache grows past its size.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from common.data import OpenReq
+from server.limits import Plan
+from server.sync import project_root, tree_token
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Result:
+    """Exit code and output of a run."""
+
+    exit_code: int
+    outputs: dict[int, bytes] = field(default_factory=dict)
+    """{[fd: int]: everything the run wrote to it}"""
+
+
+def result_key(
+    req: OpenReq, base: Path, env: dict[str, str], limits: Plan, user: str | None
+) -> str:
+    """
+    Key of a run's result: a digest of the synced project the executable is in (see
+    :func:`server.sync.project_root`), the executable, its arguments, the whole
+    environment ``env`` it is spawned with, the ``user`` it runs as, its planned
+    ``limits`` and how its output is captured, including the terminal's size. Walks
+    the project; meant to be run off the event loop.
+    """
+    path = Path(req.path).expanduser().resolve()
+    root = project_root(base, path)
+    inputs = [
+        tree_token(root),
+        path.relative_to(root).as_posix(),
+        req.args,
+        sorted(env.items()),
+        user,
+        # Which CPUs a run is pinned to is not known yet, and does not matter.
+        [limits.rlimits, limits.nice, limits.cpu_count],
+        req.split_stderr,
+        [req.rows, req.cols] if req.pty else None,
+    ]
+    return hashlib.blake2b(json.dumps(inputs).encode(), digest_size=16).hexdigest()
+
+
+class Recording:
+    """
+    Output of a run being recorded for the cache. Gives up once the output grows
+    past ``max_bytes``.
+    """
+
+    key: str
+    max_bytes: int
+    outputs: dict[int, bytearray]
+    overflowed: bool = False
+    __size: int = 0
+
+    def __init__(self, key: str, max_bytes: int):
+        self.key = key
+        self.max_bytes = max_bytes
+        self.outputs = {}
+
+    def add(self, fd: int, data: bytes):
+        if self.overflowed:
+            return
+        self.__size += len(data)
+        if self.__size > self.max_bytes:
+            self.overflowed = True
+            self.outputs.clear()
+            return
+        self.outputs.setdefault(fd, bytearray()).extend(data)
+
+    def result(self, exit_code: int) -> Result:
+        return Result(exit_code, {fd: bytes(data) for fd, data in self.outputs.items()})
+
+
+class ResultCache:
+    """
+    Results in ``directory``, at most ``max_bytes`` of them. Results larger than
+    ``max_entry_bytes`` are not cached. :meth:`get` and :meth:`put` do blocking file
+    I/O and are meant to be run off the event loop; they may run concurrently.
+    """
+
+    directory: Path
+    max_bytes: int
+    max_entry_bytes: int
+    hits: int = 0
+    misses: int = 0
+    __index: OrderedDict[str, int]
+    """{[key: str]: size of the result's file}, least recently used first"""
+    __lock: threading.Lock
+
+    def __init__(self, directory: Path, max_bytes: int, max_entry_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.__index = OrderedDict()
+        self.__lock = threading.Lock()
+        directory.mkdir(parents=True, exist_ok=True)
+        files = [(p.stat().st_mtime_ns, p) for p in directory.glob("*.result")]
+        for _mtime, path in sorted(files):
+            self.__index[path.stem] = path.stat().st_size
+
+    def recording(self, key: str) -> Recording:
+        """Start recording a run's result, to :meth:`put` once it exits."""
+        return Recording(key, self.max_entry_bytes)
+
+    def get(self, key: str) -> Result | None:
+        """The cached result for ``key``, if there is one. Counts hits and misses."""
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                exit_code = int(header["exit_code"])
+                outputs = {int(fd): f.read(size) for fd, size in header["sizes"]}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Discarding unreadable cached result {key}: {e}")
+                path.unlink(missing_ok=True)
+            with self.__lock:
+                _ = self.__index.pop(key, None)
+                self.misses += 1
+            return None
+        # It may have been evicted since it was read; the result is still good.
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        with self.__lock:
+            if key in self.__index:
+                self.__index.move_to_end(key)
+            self.hits += 1
+        return Result(exit_code, outputs)
+
+    def put(self, key: str, result: Result):
+        """Cache a result, evicting the least recently used ones to make room."""
+        header = {
+            "exit_code": result.exit_code,
+            "sizes": [[fd, len(data)] for fd, data in result.outputs.items()],
+        }
+        path = self.__path(key)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            _ = f.write(json.dumps(header).encode() + b"\n")
+            for data in result.outputs.values():
+                _ = f.write(data)
+            size = f.tell()
+        os.replace(tmp, path)
+        with self.__lock:
+            self.__index[key] = size
+            self.__index.move_to_end(key)
+            total = sum(self.__index.values())
+            evicted: list[str] = []
+            while total > self.max_bytes and len(self.__index) > 1:
+                old, old_size = self.__index.popitem(last=False)
+                total -= old_size
+                evicted.append(old)
+        for old in evicted:
+            logger.debug(f"Evicting cached result {old}")
+            self.__path(old).unlink(missing_ok=True)
+
+    def __path(self, key: str) -> Path:
+        return self.directory / f"{key}.result"
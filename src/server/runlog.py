@@ -0,0 +1,190 @@
+"""
+Output of a run, kept by byte offset so that clients can re-attach to a run and
+resume streaming where they left off.
+"""
+
+import asyncio
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ["spill", "drop-oldest", "block"]
+"""What a :class:`RunLog` does with output which no longer fits in memory."""
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def utf8_boundary(data: bytes) -> int:
+    """
+    Length of the longest prefix of ``data`` which does not end in the middle of a
+    UTF-8 sequence.
+    """
+    for i in range(1, min(4, len(data)) + 1):
+        byte = data[-i]
+        if byte < 0x80 or byte >= 0xF8:
+            return len(data)
+        if byte >= 0xC0:
+            need = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return len(data) if i >= need else len(data) - i
+    return len(data)
+
+
+class RunLog:
+    """
+    Everything a run has written. The most recent ``memory`` bytes are kept in
+    memory. What happens to older output depends on ``overflow``:
+
+    ``spill``
+        Older output is spilled to a temporary file in ``spill_dir``. Once
+        ``spill_limit`` bytes were spilled (if it is positive), the file is
+        discarded and older output is dropped as with ``drop-oldest``.
+    ``drop-oldest``
+        Older output is discarded. Readers which fall behind skip ahead to
+        :attr:`start`.
+    ``block``
+        Like ``spill``, but :meth:`writable` holds the writer back while more than
+        ``memory`` bytes have not been sent to the client yet.
+
+    The spill file is written and read in a worker thread, never on the event loop.
+    """
+
+    memory: int
+    spill_dir: Path | None
+    overflow: str
+    spill_limit: int
+    exit_code: int | None = None
+    """The run's exit code, once it has exited and all of its output was appended."""
+    __buffer: bytearray
+    __base: int
+    """Offset of the first byte of ``__buffer``."""
+    __sent: int = 0
+    """Offset up to which output was sent to a client."""
+    __spill: int | None = None
+    """File descriptor of the spill file, which holds the output before ``__base``."""
+    __dropping: bool = False
+    """Whether older output is dropped, by policy or because the spill file is full."""
+    __readers: int = 0
+    """Number of reads of the spill file in progress."""
+    __closed: bool = False
+    __changed: asyncio.Event
+
+    def __init__(
+        self,
+        memory: int,
+        spill_dir: Path | None = None,
+        overflow: str = "spill",
+        spill_limit: int = 0,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}")
+        self.memory = memory
+        self.spill_dir = spill_dir
+        self.overflow = overflow
+        self.spill_limit = spill_limit
+        self.__dropping = overflow == "drop-oldest"
+        self.__buffer = bytearray()
+        self.__base = 0
+        self.__changed = asyncio.Event()
+
+    @property
+    def end(self) -> int:
+        """Offset just past the last byte written."""
+        return self.__base + len(self.__buffer)
+
+    @property
+    def start(self) -> int:
+        """Offset of the oldest byte which can still be read."""
+        return self.__base if self.__dropping else 0
+
+    @property
+    def finished(self) -> bool:
+        return self.exit_code is not None
+
+    async def append(self, data: bytes):
+        self.__buffer += data
+        excess = len(self.__buffer) - self.memory
+        if excess > 0 and not self.__dropping:
+            if self.spill_limit > 0 and self.__base + excess > self.spill_limit:
+                # The spill file stays at its limit until the log is closed, in case
+                # it is being read.
+                logger.warning("Run output spilled past its limit, dropping older output")
+                self.__dropping = True
+            else:
+                data = bytes(self.__buffer[:excess])
+                await asyncio.to_thread(self.__write_spill, data, self.__base)
+        if excess > 0:
+            del self.__buffer[:excess]
+            self.__base += excess
+        self.__notify()
+
+    def finish(self, exit_code: int):
+        """Record that the run exited. No more output is appended."""
+        self.exit_code = exit_code
+        self.__notify()
+
+    def sent(self, offset: int):
+        """Record that output up to ``offset`` was sent to a client."""
+        if offset > self.__sent:
+            self.__sent = offset
+            self.__notify()
+
+    async def writable(self):
+        """
+        With the ``block`` policy, wait until less than ``memory`` bytes are waiting
+        to be sent. Returns immediately with the other policies.
+        """
+        while self.overflow == "block" and self.end - self.__sent >= self.memory:
+            _ = await self.__changed.wait()
+
+    async def read(self, offset: int, limit: int) -> bytes:
+        """Read up to ``limit`` bytes starting at ``offset``."""
+        if offset < self.start or offset > self.end:
+            raise ValueError(f"Offset {offset} is out of range ({self.start}-{self.end})")
+        if offset < self.__base and self.__spill is not None:
+            size = min(limit, self.__base - offset)
+            self.__readers += 1
+            try:
+                return await asyncio.to_thread(os.pread, self.__spill, size, offset)
+            finally:
+                self.__readers -= 1
+                if self.__closed:
+                    self.__close_spill()
+        start = offset - self.__base
+        return bytes(self.__buffer[start : start + limit])
+
+    async def wait(self, offset: int):
+        """Wait until there is output past ``offset``, or the run has finished."""
+        while self.end <= offset and not self.finished:
+            _ = await self.__changed.wait()
+
+    def close(self):
+        """Discard the run's output."""
+        self.__closed = True
+        self.__close_spill()
+        self.__buffer.clear()
+
+    def __write_spill(self, data: bytes, offset: int):
+        if self.__spill is None:
+            fd, name = tempfile.mkstemp(prefix="psync-run-", dir=self.spill_dir)
+            os.unlink(name)
+            self.__spill = fd
+        _pwrite_all(self.__spill, data, offset)
+
+    def __close_spill(self):
+        # Reads in progress hold the descriptor open, so that it cannot be reused.
+        if self.__spill is not None and not self.__readers:
+            os.close(self.__spill)
+            self.__spill = None
+
+    def __notify(self):
+        self.__changed.set()
+        self.__changed = asyncio.Event()
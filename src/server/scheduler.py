@@ -0,0 +1,156 @@
+"""
+Admission control for runs. Bounds the number of processes the server runs at once
+and shares the slots fairly between client hosts.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+
+class JobState(Enum):
+    Waiting = "waiting"
+    Running = "running"
+    Done = "done"
+
+
+@dataclass
+class Job:
+    """A run waiting for, or holding, a slot."""
+
+    run_id: str
+    host: str
+    """Address of the client which submitted the job."""
+    priority: int
+    seq: int
+    granted: asyncio.Future[None]
+    """Resolved when the job is given a slot."""
+    state: JobState = JobState.Waiting
+    started: float = 0.0
+
+
+class Scheduler:
+    """
+    Runs at most ``slots`` jobs at once. Waiting jobs are granted slots by priority
+    (highest first). Among jobs of equal priority, the host with the fewest running
+    jobs goes first, then the host which was granted a slot least recently, then the
+    job which was submitted first.
+    """
+
+    HISTORY: int = 32
+    """Number of finished jobs the wait estimate is based on."""
+
+    slots: int
+    __waiting: list[Job]
+    __running: dict[str, int]
+    """{[host: str]: number of running jobs}"""
+    __granted: dict[str, int]
+    """{[host: str]: sequence number of the host's last granted slot}"""
+    __started: dict[int, float]
+    """{[seq: int]: when each running job was granted its slot}"""
+    __durations: list[float]
+    """Durations of recently finished jobs, in seconds."""
+    __seq: "itertools.count[int]"
+
+    def __init__(self, slots: int):
+        self.slots = max(slots, 1)
+        self.__waiting = []
+        self.__running = {}
+        self.__granted = {}
+        self.__started = {}
+        self.__durations = []
+        self.__seq = itertools.count()
+
+    def submit(self, run_id: str, host: str, priority: int = 0) -> Job:
+        """
+        Queue a job. The job's ``granted`` future is resolved once it gets a slot,
+        which may be immediately.
+        """
+        job = Job(
+            run_id=run_id,
+            host=host,
+            priority=priority,
+            seq=next(self.__seq),
+            granted=asyncio.get_running_loop().create_future(),
+        )
+        self.__waiting.append(job)
+        self.__dispatch()
+        return job
+
+    def done(self, job: Job):
+        """Release the job's slot, or remove it from the queue if it is waiting."""
+        match job.state:
+            case JobState.Waiting:
+                self.__waiting.remove(job)
+                _ = job.granted.cancel()
+            case JobState.Running:
+                self.__running[job.host] -= 1
+                if not self.__running[job.host]:
+                    del self.__running[job.host]
+                del self.__started[job.seq]
+                self.__durations.append(time.monotonic() - job.started)
+                del self.__durations[: -self.HISTORY]
+            case JobState.Done:
+                return
+        job.state = JobState.Done
+        self.__dispatch()
+
+    def running(self) -> int:
+        """Number of jobs holding a slot."""
+        return sum(self.__running.values())
+
+    def queued(self) -> int:
+        """Number of jobs waiting for a slot."""
+        return len(self.__waiting)
+
+    def position(self, job: Job) -> int:
+        """One-based position of a waiting job in the queue."""
+        return sorted(self.__waiting, key=self.__key).index(job) + 1
+
+    def eta(self, job: Job) -> float | None:
+        """
+        Estimated seconds until a waiting job gets a slot, or ``None`` if no job has
+        finished yet. Jobs ahead of it in the queue are expected to take as long as
+        recent jobs did on average, and running jobs to take the rest of what recent
+        jobs which ran at least as long took.
+        """
+        if not self.__durations:
+            return None
+        mean = sum(self.__durations) / len(self.__durations)
+        now = time.monotonic()
+        free = [self.__remaining(now - started) for started in self.__started.values()]
+        free += [0.0] * (self.slots - len(free))
+        heapq.heapify(free)
+        for _ in range(self.position(job) - 1):
+            _ = heapq.heapreplace(free, free[0] + mean)
+        return free[0]
+
+    def __remaining(self, elapsed: float) -> float:
+        """Expected seconds left of a job which has been running for ``elapsed``."""
+        longer = [d for d in self.__durations if d > elapsed]
+        if not longer:
+            # Longer than any recent job; assume it runs as long again.
+            return elapsed
+        return sum(longer) / len(longer) - elapsed
+
+    def __key(self, job: Job) -> tuple[int, int, int, int]:
+        return (
+            -job.priority,
+            self.__running.get(job.host, 0),
+            self.__granted.get(job.host, -1),
+            job.seq,
+        )
+
+    def __dispatch(self):
+        while self.__waiting and self.running() < self.slots:
+            job = min(self.__waiting, key=self.__key)
+            self.__waiting.remove(job)
+            self.__running[job.host] = self.__running.get(job.host, 0) + 1
+            self.__granted[job.host] = next(self.__seq)
+            job.state = JobState.Running
+            job.started = time.monotonic()
+            self.__started[job.seq] = job.started
+            job.granted.set_result(None)
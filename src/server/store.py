@@ -0,0 +1,143 @@
+"""
+Content-addressed blob store for synced projects. Files are stored once per content
+digest and materialized into project trees as reflinks, hardlinks or copies, so
+identical content is neither stored nor transferred twice.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+from common.data import FileEntry
+from common.sync import file_digest
+
+logger = logging.getLogger(__name__)
+
+LINK_MODES = ["reflink", "hardlink", "copy"]
+
+_FICLONE = 0x40049409
+_NO_CLONE = (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS)
+
+
+class BlobStore:
+    """
+    Blobs live at ``{root}/objects/{digest[:2]}/{digest[2:]}``.
+
+    With ``reflink`` (the default) project files are copy-on-write clones of their
+    blob, falling back to a plain copy on filesystems without reflink support. With
+    ``hardlink`` they share the blob's inode, which saves the most space but means
+    every project holding the blob shares its mode and modification time, and a
+    process writing to the file in place also changes the blob.
+    """
+
+    root: Path
+    link: str
+    retention: float
+    """Seconds an unreferenced blob is kept before garbage collection removes it."""
+
+    def __init__(self, root: Path, link: str, retention: float):
+        if link not in LINK_MODES:
+            raise ValueError(f"Unknown store link mode {link!r}")
+        self.root = root.expanduser()
+        self.link = link
+        self.retention = retention
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+
+    def blob(self, digest: str) -> Path:
+        if len(digest) < 3 or not digest.isalnum():
+            raise ValueError(f"Invalid digest {digest!r}")
+        return self.root / "objects" / digest[:2] / digest[2:]
+
+    def has(self, digest: str) -> bool:
+        return self.blob(digest).is_file()
+
+    def materialize(self, entry: FileEntry, dest: Path):
+        """Place the blob for ``entry`` at ``dest``, with the entry's metadata."""
+        blob = self.blob(entry.digest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.psync-tmp")
+        tmp.unlink(missing_ok=True)
+        try:
+            self.__link(blob, tmp)
+            tmp.chmod(entry.mode)
+            os.utime(tmp, ns=(entry.mtime_ns, entry.mtime_ns))
+            os.replace(tmp, dest)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self.__touch(blob)
+
+    def add(self, path: Path, digest: str):
+        """
+        Store the file at ``path`` under ``digest``. The file's contents are checked
+        against the digest first, so a bad transfer can never enter the store.
+        """
+        actual = file_digest(path)
+        if actual != digest:
+            raise ValueError(f"Digest mismatch for {path}: expected {digest}, got {actual}")
+        blob = self.blob(digest)
+        if blob.is_file():
+            self.__touch(blob)
+            return
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = blob.with_name(f".{blob.name}.{os.getpid()}.tmp")
+        try:
+            self.__link(path, tmp)
+            os.replace(tmp, blob)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def gc(self) -> int:
+        """
+        Remove blobs which have gone unreferenced for longer than the retention
+        period. Hardlinked blobs are unreferenced once no project links to them;
+        otherwise a blob is unreferenced once it has not been used by a sync for the
+        retention period. Returns the number of bytes freed.
+        """
+        cutoff = time.time() - self.retention
+        freed = 0
+        removed = 0
+        for dirpath, _dirnames, filenames in os.walk(self.root / "objects"):
+            for name in filenames:
+                path = Path(dirpath) / name
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                if self.link == "hardlink":
+                    stale = st.st_nlink <= 1 and st.st_ctime < cutoff
+                else:
+                    stale = st.st_mtime < cutoff
+                if stale:
+                    path.unlink(missing_ok=True)
+                    freed += st.st_size
+                    removed += 1
+        logger.info(f"Store GC removed {removed} blobs, freeing {freed} bytes")
+        return freed
+
+    def __link(self, src: Path, dest: Path):
+        if self.link == "hardlink":
+            try:
+                os.link(src, dest)
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        elif self.link == "reflink":
+            with open(src, "rb") as s, open(dest, "wb") as d:
+                try:
+                    _ = fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+                    return
+                except OSError as e:
+                    if e.errno not in _NO_CLONE:
+                        raise
+        _ = shutil.copyfile(src, dest)
+
+    def __touch(self, blob: Path):
+        # Hardlinked blobs share their mtime with project files; their last use is
+        # tracked by the link count instead.
+        if self.link != "hardlink":
+            os.utime(blob)
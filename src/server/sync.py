@@ -0,0 +1,215 @@
+"""
+Server half of the native sync engine.
+"""
+
+import hashlib
+import logging
+import os
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from common.data import BlockReq, FileEntry, SyncReq, SyncResp
+from common.sync import BLOCK_SIZE, block_digests, file_digest, resolve
+from server.store import BlobStore
+
+logger = logging.getLogger(__name__)
+
+
+def confine(base: Path, root: Path) -> Path:
+    """
+    ``root`` with symlinks resolved, which must be a directory under ``base``, the
+    server's ``server_dest``. Raises ``ValueError`` otherwise, including for
+    ``base`` itself, which holds every project.
+    """
+    base = base.expanduser().resolve()
+    path = root.expanduser().resolve()
+    if path == base or not path.is_relative_to(base):
+        raise ValueError(f"{root} is not a directory under {base}")
+    return path
+
+
+def project_root(base: Path, path: Path) -> Path:
+    """
+    The synced project ``path`` is in: the directory directly under ``base``, the
+    server's ``server_dest``, which holds it. Paths which are not in a project under
+    ``base`` are taken to be in their parent directory's.
+    """
+    base = base.expanduser().resolve()
+    path = path.expanduser().resolve()
+    parts = path.relative_to(base).parts if path.is_relative_to(base) else ()
+    if len(parts) < 2:
+        return path.parent
+    return base / parts[0]
+
+
+def tree_token(root: Path) -> str:
+    """
+    Digest of the relative path, size, modification time and mode of every file
+    under ``root``. Cheap to compute, since no file contents are read. Returns an
+    empty string if ``root`` does not exist.
+    """
+    root = root.expanduser()
+    if not root.is_dir():
+        return ""
+    entries: list[str] = []
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = Path(dirpath) / name
+            st = path.lstat()
+            rel = path.relative_to(root).as_posix()
+            entries.append(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_mode & 0o7777}")
+    entries.sort()
+    return hashlib.blake2b("\n".join(entries).encode(), digest_size=16).hexdigest()
+
+
+@dataclass
+class StagedFile:
+    """A file being transferred, written to a temporary file next to its target."""
+
+    path: Path
+    tmp: Path
+    entry: FileEntry
+    fd: int
+    received: set[int] = field(default_factory=set)
+
+
+class SyncSession:
+    """
+    State for one native sync. Created from a :class:`SyncReq`, fed with
+    :class:`BlockReq` messages and finished with :meth:`commit`. The methods do
+    blocking file I/O and are meant to be run off the event loop.
+    """
+
+    root: Path
+    files: dict[str, FileEntry]
+    store: BlobStore | None
+    __pending: set[str]
+    __staged: dict[str, StagedFile]
+
+    def __init__(self, req: SyncReq, base: Path, store: BlobStore | None = None):
+        """Raises ``ValueError`` if ``req.root`` is not under ``base``; see :func:`confine`."""
+        self.root = confine(base, Path(req.root))
+        self.files = req.files
+        self.store = store
+        self.__pending = set()
+        self.__staged = {}
+
+    def plan(self) -> SyncResp:
+        """
+        Compare the manifest with the tree on disk. Deletes files which are not in
+        the manifest, fixes metadata of files whose content already matches, places
+        files whose content is in the blob store and returns the files which need to
+        be transferred. Raises ``ValueError`` before touching the tree if any path in
+        the manifest would escape it.
+        """
+        paths = {rel: resolve(self.root, rel) for rel in self.files}
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.__delete_extraneous()
+
+        blocks: dict[str, list[bytes]] = {}
+        for rel, entry in self.files.items():
+            path = paths[rel]
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                st = None
+            if st is not None and st.st_size == entry.size:
+                if st.st_mtime_ns == entry.mtime_ns:
+                    if st.st_mode & 0o7777 != entry.mode:
+                        path.chmod(entry.mode)
+                    continue
+                if file_digest(path) == entry.digest:
+                    self.__set_metadata(path, entry)
+                    continue
+            if self.store is not None and self.store.has(entry.digest):
+                self.store.materialize(entry, path)
+                continue
+            blocks[rel] = [] if st is None else block_digests(path)
+
+        logger.info(f"Sync {self.root}: {len(blocks)}/{len(self.files)} files changed")
+        self.__pending = set(blocks)
+        return SyncResp(blocks=blocks)
+
+    def write(self, req: BlockReq):
+        """Write a transferred block to the file's staging copy."""
+        if req.path not in self.__pending:
+            raise ValueError(f"Got block for {req.path!r}, which is not being synced")
+        staged = self.__stage(req.path)
+        if req.index < 0 or req.index * BLOCK_SIZE >= staged.entry.size:
+            raise ValueError(f"Block {req.index} is out of range for {req.path!r}")
+
+        data = zlib.decompress(req.data) if req.compressed else req.data
+        _ = os.pwrite(staged.fd, data, req.index * BLOCK_SIZE)
+        staged.received.add(req.index)
+
+    def commit(self):
+        """
+        Complete every staged file with the unchanged blocks of the current copy,
+        then move it into place.
+        """
+        try:
+            # Files with no blocks sent are empty, or a prefix of the current copy.
+            for rel in self.__pending:
+                staged = self.__stage(rel)
+                self.__fill(staged)
+                os.close(staged.fd)
+                staged.fd = -1
+                self.__set_metadata(staged.tmp, staged.entry)
+                if self.store is not None:
+                    self.store.add(staged.tmp, staged.entry.digest)
+                os.replace(staged.tmp, staged.path)
+                logger.debug(f"Synced {rel} ({len(staged.received)} blocks sent)")
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Discard every staged file."""
+        for staged in self.__staged.values():
+            if staged.fd >= 0:
+                os.close(staged.fd)
+                staged.tmp.unlink(missing_ok=True)
+        self.__staged.clear()
+        self.__pending.clear()
+
+    def __stage(self, rel: str) -> StagedFile:
+        staged = self.__staged.get(rel)
+        if staged is None:
+            path = resolve(self.root, rel)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.psync-tmp")
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            staged = StagedFile(path=path, tmp=tmp, entry=self.files[rel], fd=fd)
+            self.__staged[rel] = staged
+        return staged
+
+    def __fill(self, staged: StagedFile):
+        blocks = -(-staged.entry.size // BLOCK_SIZE)
+        missing = [i for i in range(blocks) if i not in staged.received]
+        if missing:
+            with open(staged.path, "rb") as old:
+                for index in missing:
+                    _ = old.seek(index * BLOCK_SIZE)
+                    _ = os.pwrite(staged.fd, old.read(BLOCK_SIZE), index * BLOCK_SIZE)
+        os.truncate(staged.fd, staged.entry.size)
+
+    def __set_metadata(self, path: Path, entry: FileEntry):
+        path.chmod(entry.mode)
+        os.utime(path, ns=(entry.mtime_ns, entry.mtime_ns))
+
+    def __delete_extraneous(self):
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            base = Path(dirpath)
+            for name in filenames:
+                path = base / name
+                if path.relative_to(self.root).as_posix() not in self.files:
+                    logger.debug(f"Deleting {path}")
+                    path.unlink()
+            for name in dirnames:
+                path = base / name
+                if path.is_symlink():
+                    continue
+                try:
+                    path.rmdir()
+                except OSError:
+                    pass
@@ -0,0 +1,58 @@
+"""
+Pseudo-terminals for runs opened with ``pty`` set. Programs writing to a terminal
+flush their output line by line, where they would otherwise fill a buffer first.
+"""
+
+import asyncio
+import errno
+import fcntl
+import os
+import struct
+import termios
+from typing import override
+
+_WINSIZE = struct.Struct("HHHH")
+
+
+def open_pty(rows: int = 0, cols: int = 0) -> tuple[int, int]:
+    """
+    Open a pseudo-terminal of ``rows`` by ``cols``, if both are given. Returns the
+    file descriptors of its controller and its terminal.
+
+    Newlines are not translated to carriage return and newline, so that output is
+    the same as with a pipe.
+    """
+    controller, terminal = os.openpty()
+    attrs = termios.tcgetattr(terminal)
+    attrs[1] &= ~termios.ONLCR
+    termios.tcsetattr(terminal, termios.TCSANOW, attrs)
+    if rows > 0 and cols > 0:
+        set_size(controller, rows, cols)
+    return controller, terminal
+
+
+def set_size(controller: int, rows: int, cols: int):
+    """Set the window size of the pseudo-terminal."""
+    _ = fcntl.ioctl(controller, termios.TIOCSWINSZ, _WINSIZE.pack(rows, cols, 0, 0))
+
+
+class _Protocol(asyncio.StreamReaderProtocol):
+    @override
+    def connection_lost(self, exc: Exception | None):
+        # Reading from the controller fails with EIO once the terminal is closed.
+        if isinstance(exc, OSError) and exc.errno == errno.EIO:
+            exc = None
+        super().connection_lost(exc)
+
+
+async def read_pty(controller: int) -> asyncio.StreamReader:
+    """
+    Stream of the output written to the pseudo-terminal, which ends once every
+    process has closed it. Reads from a duplicate of ``controller``, which is closed
+    at the end of the stream.
+    """
+    loop = asyncio.get_running_loop()
+    stream = asyncio.StreamReader(loop=loop)
+    pipe = os.fdopen(os.dup(controller), "rb", buffering=0)
+    _ = await loop.connect_read_pipe(lambda: _Protocol(stream, loop=loop), pipe)
+    return stream
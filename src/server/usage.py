@@ -0,0 +1,116 @@
+"""
+Resource usage of runs. Usage is sampled from ``/proc`` while the process runs,
+and the final usage is the ``rusage`` it is reaped with. CPU times include children
+which the process waited for. On systems without ``/proc``, samples only measure
+wall time.
+"""
+
+import dataclasses
+import os
+import resource
+import time
+from pathlib import Path
+
+from common.data import Usage
+
+_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+"""Clock ticks per second, the unit of CPU times in ``/proc``."""
+
+
+class UsageSampler:
+    """
+    Samples the resource usage of the process ``pid``, from when it was spawned, or
+    with ``since_now`` from when the sampler was created. The latter is for processes
+    which did other work before the run, like zygotes; their peak memory still
+    counts from when they were spawned.
+    """
+
+    pid: int
+    usage: Usage
+    """The latest sample. Values which could not be read keep their last value."""
+    __base: Usage
+    __started: float
+    __finished: float | None = None
+
+    def __init__(self, pid: int, since_now: bool = False):
+        self.pid = pid
+        self.usage = Usage()
+        self.__base = Usage()
+        self.__started = time.monotonic()
+        if since_now:
+            self.__base = dataclasses.replace(self.sample(), max_rss=0, wall_seconds=0.0)
+            self.usage = Usage()
+
+    def sample(self) -> Usage:
+        """Sample the process' usage, unless it has finished. Returns the latest sample."""
+        if self.__finished is not None:
+            return self.usage
+        proc = Path(f"/proc/{self.pid}")
+        base = self.__base
+        try:
+            stat = (proc / "stat").read_text()
+            # The command may contain spaces; fields after it are numbered from 3.
+            fields = stat[stat.rindex(")") + 2 :].split()
+            self.usage.user_seconds = (
+                (int(fields[11]) + int(fields[13])) / _TICKS - base.user_seconds
+            )
+            self.usage.sys_seconds = (
+                (int(fields[12]) + int(fields[14])) / _TICKS - base.sys_seconds
+            )
+        except (OSError, ValueError, IndexError):
+            pass
+        for key, value in self.__read_fields(proc / "status"):
+            match key:
+                case "VmHWM":
+                    self.usage.max_rss = max(self.usage.max_rss, int(value.split()[0]) * 1024)
+                case "voluntary_ctxt_switches":
+                    self.usage.voluntary_switches = int(value) - base.voluntary_switches
+                case "nonvoluntary_ctxt_switches":
+                    self.usage.involuntary_switches = int(value) - base.involuntary_switches
+                case _:
+                    pass
+        for key, value in self.__read_fields(proc / "io"):
+            match key:
+                case "read_bytes":
+                    self.usage.read_bytes = int(value) - base.read_bytes
+                case "write_bytes":
+                    self.usage.write_bytes = int(value) - base.write_bytes
+                case _:
+                    pass
+        self.usage.wall_seconds = time.monotonic() - self.__started
+        return self.usage
+
+    def finish(self, rusage: resource.struct_rusage | None = None) -> Usage:
+        """
+        Stop sampling once the process has been reaped, when its PID may already be
+        reused, and stop the wall clock. The final usage is taken from ``rusage``,
+        the process' usage when it was reaped, if given. Returns the final usage.
+        """
+        if self.__finished is not None:
+            return self.usage
+        self.__finished = time.monotonic()
+        self.usage.wall_seconds = self.__finished - self.__started
+        if rusage is not None:
+            base = self.__base
+            self.usage.user_seconds = rusage.ru_utime - base.user_seconds
+            self.usage.sys_seconds = rusage.ru_stime - base.sys_seconds
+            # In KiB on Linux.
+            self.usage.max_rss = max(self.usage.max_rss, rusage.ru_maxrss * 1024)
+            self.usage.voluntary_switches = rusage.ru_nvcsw - base.voluntary_switches
+            self.usage.involuntary_switches = rusage.ru_nivcsw - base.involuntary_switches
+            # In 512 byte blocks, as ``/proc`` counts them.
+            self.usage.read_bytes = rusage.ru_inblock * 512 - base.read_bytes
+            self.usage.write_bytes = rusage.ru_oublock * 512 - base.write_bytes
+        return self.usage
+
+    def __read_fields(self, path: Path) -> list[tuple[str, str]]:
+        """``key: value`` lines of a ``/proc`` file, or none if it cannot be read."""
+        try:
+            lines = path.read_text().splitlines()
+        except OSError:
+            return []
+        return [
+            (key, value.strip())
+            for key, sep, value in (line.partition(":") for line in lines)
+            if sep
+        ]
@@ -0,0 +1,208 @@
+"""
+Pool of pre-started Python interpreters ("zygotes") used to run Python targets
+without paying for interpreter startup and heavy imports on every run.
+
+Each zygote imports the configured modules, reports that it is ready, then waits
+for a single request on its stdin. The request names the script, its arguments and
+its environment, which the zygote then runs as ``__main__``. Zygotes are ordinary
+subprocesses, so their output is streamed, and they are killed and waited on,
+exactly like any other run.
+"""
+
+import asyncio
+import contextlib
+import dataclasses
+import gc
+import importlib
+import json
+import logging
+import os
+import runpy
+import sys
+from pathlib import Path
+
+from server.child import PIPE, STDOUT, Child, spawn
+from server.limits import Plan
+
+logger = logging.getLogger(__name__)
+
+READY = b"\0"
+"""Written to stdout by a zygote once its modules are imported."""
+
+_SOURCE = Path(__file__).parents[1]
+"""Directory psync's packages are imported from."""
+
+_BOOTSTRAP = f"""\
+import sys
+sys.path.insert(0, {str(_SOURCE)!r})
+from server.zygote import run
+del sys.path[0]
+run(sys.argv[1:])
+"""
+
+
+def is_python(path: Path) -> bool:
+    """Whether ``path`` is a Python script, by extension or shebang."""
+    if path.suffix == ".py":
+        return True
+    try:
+        with open(path, "rb") as f:
+            line = f.readline(128)
+    except OSError:
+        return False
+    return line.startswith(b"#!") and b"python" in line
+
+
+def run(modules: list[str]):
+    """
+    Zygote entry point. Import ``modules``, then run the script named by the request
+    read from stdin.
+    """
+    for name in modules:
+        # The script reports the error if it needs the module.
+        with contextlib.suppress(ImportError):
+            _ = importlib.import_module(name)
+    # Keep the collector away from everything imported so far, including at exit.
+    gc.freeze()
+    _ = sys.stdout.buffer.write(READY)
+    _ = sys.stdout.buffer.flush()
+
+    line = sys.stdin.buffer.readline()
+    if not line:
+        sys.exit(0)
+    req: dict[str, object] = json.loads(line)
+    path = str(req["path"])
+    args: list[str] = req["args"]  # pyright: ignore[reportAssignmentType]
+    env: dict[str, str] = req["env"]  # pyright: ignore[reportAssignmentType]
+    limits: dict[str, object] | None = req.get("limits")  # pyright: ignore[reportAssignmentType]
+    cwd = req.get("cwd")
+    if limits is not None:
+        Plan(**limits).apply()  # pyright: ignore[reportArgumentType]
+
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    _ = os.dup2(devnull, 0)
+    os.close(devnull)
+    if cwd is not None:
+        os.chdir(str(cwd))
+    os.environ.clear()
+    os.environ.update(env)
+    sys.argv = [path, *args]
+    sys.path[0] = str(Path(path).parent)
+    _forget_psync()
+    _ = runpy.run_path(path, run_name="__main__")
+
+
+def _forget_psync():
+    """
+    Unload the zygote's own modules, so that the script imports its own packages
+    of the same names (e.g. ``server``) instead.
+    """
+    for name, module in list(sys.modules.items()):
+        file: str | None = getattr(module, "__file__", None)
+        if file is not None and Path(file).is_relative_to(_SOURCE):
+            del sys.modules[name]
+
+
+class ZygotePool:
+    """
+    Keeps ``size`` zygotes ready. Each one is used for a single run and replaced in
+    the background.
+
+    Zygotes run the server's interpreter, whatever the script's shebang says.
+    Variables read at interpreter startup, such as ``PYTHONPATH``, are not applied
+    from the run's environment.
+    """
+
+    size: int
+    modules: list[str]
+    user: str | None
+    __ready: asyncio.Queue[Child]
+    __warming: set[asyncio.Task[None]]
+
+    def __init__(self, size: int, modules: list[str], user: str | None = None):
+        self.size = size
+        self.modules = modules
+        self.user = user
+        self.__ready = asyncio.Queue()
+        self.__warming = set()
+
+    def start(self):
+        """Start warming the pool."""
+        for _ in range(self.size):
+            self.__warm()
+
+    async def spawn(
+        self,
+        path: Path,
+        args: list[str],
+        env: dict[str, str],
+        limits: Plan | None = None,
+        cwd: Path | None = None,
+    ) -> Child | None:
+        """
+        Run ``path`` in a ready zygote, with ``limits`` applied, in the directory
+        ``cwd``. Returns ``None`` if no zygote is ready, in which case the script
+        should be started normally.
+        """
+        while not self.__ready.empty():
+            process = self.__ready.get_nowait()
+            self.__warm()
+            if process.returncode is not None or process.stdin is None:
+                continue
+            req: dict[str, object] = {"path": str(path), "args": args, "env": env}
+            if limits is not None and limits.needed():
+                req["limits"] = dataclasses.asdict(limits)
+            if cwd is not None:
+                req["cwd"] = str(cwd)
+            process.stdin.write(json.dumps(req).encode() + b"\n")
+            await process.stdin.drain()
+            process.stdin.close()
+            return process
+        return None
+
+    async def close(self):
+        """Kill every idle zygote."""
+        for task in self.__warming:
+            _ = task.cancel()
+        _ = await asyncio.gather(*self.__warming, return_exceptions=True)
+        while not self.__ready.empty():
+            process = self.__ready.get_nowait()
+            if process.returncode is None:
+                process.kill()
+            _ = await process.wait()
+
+    def __warm(self):
+        task = asyncio.create_task(self.__start_one())
+        self.__warming.add(task)
+        task.add_done_callback(self.__warming.discard)
+
+    async def __start_one(self):
+        try:
+            process = await spawn(
+                sys.executable,
+                "-c",
+                _BOOTSTRAP,
+                *self.modules,
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=STDOUT,
+                user=self.user,
+            )
+        except OSError as e:
+            logger.error(f"Failed to start zygote: {e}")
+            return
+        if process.stdout is None:
+            return
+        try:
+            ready = await process.stdout.read(len(READY))
+        except asyncio.CancelledError:
+            process.kill()
+            _ = await process.wait()
+            raise
+        if ready != READY:
+            output = ready + await process.stdout.read()
+            logger.error(f"Zygote failed to start: {output.decode(errors='replace')}")
+            _ = await process.wait()
+            return
+        logger.debug(f"Zygote {process.pid} is ready")
+        self.__ready.put_nowait(process)
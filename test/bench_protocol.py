@@ -0,0 +1,61 @@
+"""
+Microbenchmarks for the psync wire formats.
+
+Run with ``uv run python -m test.bench_protocol``. Reports the per-message cost of
+encoding and decoding with the legacy text protocol and the binary protocol. Text
+timings include the UTF-8 transcoding websockets performs on text frames, so both
+columns measure the cost of getting a message to and from the wire.
+"""
+
+import timeit
+from collections.abc import Callable
+from pathlib import Path
+
+from common.data import (
+    ExitResp,
+    LogResp,
+    OpenReq,
+    Req,
+    Resp,
+    SetPidResp,
+    decode,
+    deserialize,
+    encode,
+    serialize,
+)
+
+MESSAGES: dict[str, Req | Resp] = {
+    "LogResp (line)": LogResp("tick\n"),
+    "LogResp (64 KiB)": LogResp(("x" * 79 + "\n") * 819),
+    "OpenReq": OpenReq(
+        path=Path("/home/psync/0123456789abcdef/example.py"),
+        args=["--flag", "value", "-v"],
+        env={"PYTHONUNBUFFERED": "1", "TEST": "TEST", "RUST_LOG": "debug"},
+    ),
+    "SetPidResp": SetPidResp(12345),
+    "ExitResp": ExitResp("0"),
+}
+
+
+def bench(fn: Callable[[], object], number: int) -> float:
+    """Best-of-five time per call, in microseconds."""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"{'message':<18} {'text enc':>10} {'text dec':>10} {'bin enc':>10} {'bin dec':>10}  (us/msg)")
+    for name, msg in MESSAGES.items():
+        number = 200 if "KiB" in name else 20000
+        text = serialize(msg).encode()
+        binary = encode(msg)
+        print(
+            f"{name:<18}"
+            + f" {bench(lambda msg=msg: serialize(msg).encode(), number):>10.3f}"
+            + f" {bench(lambda text=text: deserialize(text.decode()), number):>10.3f}"
+            + f" {bench(lambda msg=msg: encode(msg), number):>10.3f}"
+            + f" {bench(lambda binary=binary: decode(binary), number):>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
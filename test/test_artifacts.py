@@ -0,0 +1,40 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from client.fetch import Fetcher, local_digests
+from common.sync import BLOCK_SIZE
+from server.artifacts import chunks, find
+
+
+def test_fetch(tmp_path: Path):
+    remote = tmp_path / "remote"
+    local = tmp_path / "local"
+    (remote / "out").mkdir(parents=True)
+    _ = (remote / "out" / "big.bin").write_bytes(os.urandom(BLOCK_SIZE) + b"\0" * BLOCK_SIZE)
+    _ = (remote / "out" / "empty.txt").write_bytes(b"")
+    _ = (remote / "run.py").write_text("print()")
+    (remote / "out" / "big.bin").chmod(0o640)
+
+    files = find(remote, ["out/*", "**/*.bin"], {})
+    assert sorted(files) == ["out/big.bin", "out/empty.txt"]
+    fetcher = Fetcher(local)
+    for rel, file in files.items():
+        for chunk in chunks("r1", remote, rel, file):
+            fetcher.write(chunk)
+    fetcher.close()
+    assert (local / "out" / "big.bin").read_bytes() == (remote / "out" / "big.bin").read_bytes()
+    assert (local / "out" / "big.bin").stat().st_mode & 0o777 == 0o640
+    assert (local / "out" / "empty.txt").read_bytes() == b""
+    assert not list(local.glob("**/.*.psync-tmp"))
+
+    known = local_digests(local, ["out/*"])
+    _ = (remote / "out" / "empty.txt").write_text("changed")
+    assert sorted(find(remote, ["out/*"], known)) == ["out/empty.txt"]
+
+
+def test_invalid_pattern(tmp_path: Path):
+    for pattern in ["../*", "/etc/*", ""]:
+        with pytest.raises(ValueError):
+            _ = find(tmp_path, [pattern], {})
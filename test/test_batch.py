@@ -0,0 +1,59 @@
+import asyncio
+
+from server.main import read_batch
+
+
+def test_coalesce():
+    async def inner():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"a\n")
+
+        async def write():
+            await asyncio.sleep(0.01)
+            reader.feed_data(b"b\n")
+            await asyncio.sleep(0.01)
+            reader.feed_data(b"c\n")
+
+        writer = asyncio.create_task(write())
+        assert await read_batch(reader, 1024, 0.2) == b"a\nb\nc\n"
+        await writer
+
+    asyncio.run(inner())
+
+
+def test_window():
+    async def inner():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"a\n")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        assert await read_batch(reader, 1024, 0.05) == b"a\n"
+        assert loop.time() - start >= 0.04
+
+        reader.feed_data(b"b\n")
+        assert await read_batch(reader, 1024, 0) == b"b\n"
+
+    asyncio.run(inner())
+
+
+def test_limit_and_eof():
+    async def inner():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"x" * 10)
+        reader.feed_eof()
+        assert await read_batch(reader, 4, 1) == b"xxxx"
+        assert await read_batch(reader, 4, 1) == b"xxxx"
+        # EOF ends the batch early, and is reported by the next read.
+        assert await read_batch(reader, 4, 1) == b"xx"
+        assert await read_batch(reader, 4, 1) == b""
+
+    asyncio.run(inner())
+
+
+def test_unbatched():
+    async def inner():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"a\nb\n")
+        assert await read_batch(reader, 0, 1) == b"a\nb\n"
+
+    asyncio.run(inner())
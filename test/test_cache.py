@@ -0,0 +1,72 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import client.cache
+from client.args import Args
+from client.cache import StatCache
+
+
+@pytest.fixture
+def args(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Args:
+    monkeypatch.setattr(client.cache, "CACHE_DIR", tmp_path / "cache")
+    project = tmp_path / "project"
+    (project / "assets").mkdir(parents=True)
+    _ = (project / "run.py").write_text("print()")
+    _ = (project / "assets" / "data.txt").write_text("data")
+    return Args(target_path=str(project / "run.py"), assets=[str(project / "assets")])
+
+
+def test_unchanged(args: Args):
+    cache = StatCache(args)
+    files = cache.scan(args, digests=True)
+    assert sorted(files) == ["assets/data.txt", "run.py"]
+    assert all(f.entry.digest for f in files.values())
+    assert not cache.unchanged(files)
+
+    cache.save(files, "token")
+    cache = StatCache(args)
+    assert cache.token == "token"
+    assert cache.unchanged(cache.scan(args, digests=False))
+
+    data = Path(args.assets[0]) / "data.txt"
+    st = data.stat()
+    os.utime(data, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert not cache.unchanged(cache.scan(args, digests=False))
+
+
+def test_digests_reused(args: Args, monkeypatch: pytest.MonkeyPatch):
+    cache = StatCache(args)
+    cache.save(cache.scan(args, digests=True), "token")
+
+    def fail(_path: Path) -> str:
+        raise AssertionError("digest recomputed")
+
+    monkeypatch.setattr(client.cache, "file_digest", fail)
+    files = StatCache(args).scan(args, digests=True)
+    assert all(f.entry.digest for f in files.values())
+
+
+def test_other_server(args: Args):
+    cache = StatCache(args)
+    cache.save(cache.scan(args, digests=True), "token")
+    args.server_ip = "10.0.0.2"
+    assert StatCache(args).token is None
+
+
+def test_unreadable(args: Args):
+    cache = StatCache(args)
+    cache.path.parent.mkdir(parents=True)
+    _ = cache.path.write_text("{not json")
+    assert StatCache(args).token is None
+
+
+def test_per_server(args: Args):
+    """Each server has its own cache file, so hosts synced at once do not share one."""
+    cache = StatCache(args)
+    cache.save(cache.scan(args, digests=False), "token")
+    other = Args(target_path=args.target_path, assets=args.assets, server_ip="other")
+    assert StatCache(other).path != cache.path
+    assert StatCache(other).token is None
+    assert StatCache(args).token == "token"
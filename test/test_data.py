@@ -0,0 +1,168 @@
+from pathlib import Path
+
+import pytest
+
+from common.data import (
+    AttachReq,
+    DataResp,
+    ErrorResp,
+    ExitResp,
+    HealthCheckReq,
+    HealthResp,
+    KillReq,
+    Limits,
+    LogFilter,
+    LogResp,
+    OkayResp,
+    OpenReq,
+    Protocol,
+    Req,
+    ResizeReq,
+    Resp,
+    SetPidResp,
+    StatsResp,
+    Usage,
+    decode,
+    encode,
+    pack,
+    unpack,
+)
+
+MESSAGES: list[Req | Resp] = [
+    OpenReq(path=Path("/home/psync/abc/example.py"), args=["a", "b"], env={"A": "1"}),
+    KillReq(pid=42),
+    HealthCheckReq(),
+    LogResp("tick\n"),
+    ExitResp("0"),
+    ErrorResp("oops"),
+    OkayResp(),
+    SetPidResp(pid=42),
+]
+
+
+@pytest.mark.parametrize("msg", MESSAGES)
+def test_roundtrip(msg: Req | Resp):
+    for protocol in Protocol:
+        assert unpack(pack(msg, protocol), protocol) == msg
+
+
+def test_binary_quoting():
+    msg = OpenReq(
+        path=Path("/home/psync/abc/it's.py"),
+        args=["it's", 'say "hi"', ""],
+        env={"QUOTED": 'a "b" c', "EMPTY": ""},
+    )
+    assert decode(encode(msg)) == msg
+
+
+def test_binary_malformed():
+    data = encode(OpenReq(path=Path("/x"), args=["a"], env={}))
+    for bad in [data[:3], data[:-1], bytes([99]) + data[1:], data[:1] + bytes([255]) + data[2:]]:
+        with pytest.raises(ValueError):
+            _ = decode(bad)
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        OpenReq(path=Path("/x"), args=[], env={}, run_id="r1"),
+        OpenReq(path=Path("/x"), args=[], env={}, run_id="r1", split_stderr=True),
+        OpenReq(path=Path("/x"), args=[], env={}, run_id="r1", raw=True),
+        OpenReq(
+            path=Path("/x"),
+            args=[],
+            env={},
+            filter=LogFilter(include=["ERROR", "WARN"], sample=10, tail=5),
+        ),
+        OpenReq(path=Path("/x"), args=[], env={}, pty=True, rows=24, cols=80),
+        OpenReq(path=Path("/x"), args=[], env={}, limits=Limits(memory=2**30, nice=5, cpus=2)),
+        OpenReq(path=Path("/x"), args=[], env={}, stats_interval=0.5),
+        OpenReq(path=Path("/x"), args=[], env={}, cache=False),
+    ],
+)
+def test_binary_open(msg: OpenReq):
+    assert decode(encode(msg)) == msg
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        LogResp("tick\n", run_id="r1"),
+        LogResp("", run_id="ü", offset=2**40),
+        LogResp("oops\n", run_id="r1", offset=5, fd=2),
+        DataResp(b"\xff\x00tick\n", run_id="r1", offset=7),
+    ],
+)
+def test_binary_output(msg: LogResp | DataResp):
+    assert decode(encode(msg)) == msg
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        ExitResp("0", run_id="r1"),
+        ExitResp("1", run_id="r1", filtered=3),
+        ExitResp("0", run_id="r1", usage=Usage(user_seconds=1.5, max_rss=2**20, wall_seconds=2.0)),
+        ExitResp("3", run_id="r1", cached=True),
+    ],
+)
+def test_binary_exit(msg: ExitResp):
+    assert decode(encode(msg)) == msg
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        KillReq(pid=0, run_id="r1"),
+        AttachReq(run_id="r1", offset=42),
+        AttachReq(run_id="r1", offset=42, stderr_offset=7),
+        ResizeReq(run_id="r1", rows=50, cols=132),
+        ErrorResp("oops", run_id="r1"),
+        SetPidResp(pid=42, run_id="r1"),
+    ],
+)
+def test_binary_run_control(msg: Req | Resp):
+    assert decode(encode(msg)) == msg
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        HealthCheckReq(path="/home/psync"),
+        HealthResp(
+            running=2, queued=1, slots=4, cpus=4, load=1.5, mem_free=2**33, disk_free=2**40
+        ),
+        HealthResp(
+            running=0, queued=0, slots=1, cpus=1, load=0, mem_free=0, disk_free=0,
+            cache_hits=5, cache_misses=2,
+        ),
+    ],
+)
+def test_binary_health(msg: HealthCheckReq | HealthResp):
+    assert decode(encode(msg)) == msg
+
+
+def test_binary_stats():
+    msg = StatsResp(run_id="r1", usage=Usage(sys_seconds=0.25, read_bytes=4096))
+    assert decode(encode(msg)) == msg
+
+
+def test_binary_log_truncated_run_id():
+    data = encode(LogResp("tick", run_id="abc"))
+    bad = data[:2] + (1).to_bytes(4) + data[6:7]
+    with pytest.raises(ValueError):
+        _ = decode(bad)
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        OpenReq(path="/x", args=[], env={}),  # pyright: ignore[reportArgumentType]
+        OpenReq(path=Path("/x"), args=[1], env={}),  # pyright: ignore[reportArgumentType]
+        OpenReq(path=Path("/x"), args=[], env={}, limits=Limits(memory="1G")),  # pyright: ignore[reportArgumentType]
+        KillReq(pid=None, run_id="r1"),  # pyright: ignore[reportArgumentType]
+    ],
+)
+def test_binary_wrong_types(msg: Req):
+    with pytest.raises(ValueError):
+        _ = decode(encode(msg))
@@ -0,0 +1,42 @@
+import pytest
+
+from common.data import LogFilter
+from server.filter import LineFilter
+
+
+def run(spec: LogFilter, *chunks: bytes) -> tuple[bytes, int]:
+    line_filter = LineFilter(spec)
+    out = b"".join(line_filter.feed(chunk) for chunk in chunks) + line_filter.finish()
+    return out, line_filter.filtered
+
+
+def test_include_exclude():
+    spec = LogFilter(include=["ERROR", "WARN"], exclude=["ignored"])
+    out, filtered = run(spec, b"INFO a\nERR", b"OR b\nWARN ignored\nWARN c")
+    assert out == b"ERROR b\nWARN c"
+    assert filtered == 2
+
+
+def test_sample_head_tail():
+    lines = b"".join(f"tick {i}\n".encode() for i in range(10)) + b"done\n"
+    out, filtered = run(LogFilter(sample=3, sample_pattern="^tick"), lines)
+    assert out == b"tick 0\ntick 3\ntick 6\ntick 9\ndone\n"
+    assert filtered == 6
+    out, filtered = run(LogFilter(head=2), lines)
+    assert out == b"tick 0\ntick 1\n"
+    assert filtered == 9
+    out, filtered = run(LogFilter(head=5, tail=2), lines)
+    assert out == b"tick 3\ntick 4\n"
+    assert filtered == 9
+
+
+def test_invalid_pattern():
+    with pytest.raises(ValueError):
+        _ = LineFilter(LogFilter(exclude=["("]))
+
+
+def test_long_lines():
+    """Patterns only see the start of very long lines, which are still sent whole."""
+    long = b"x" * 2**17 + b" ERROR\n"
+    assert run(LogFilter(include=["ERROR"]), long, b"ERROR\n") == (b"ERROR\n", 1)
+    assert run(LogFilter(include=["^x"]), long) == (long, 0)
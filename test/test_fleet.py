@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from client.args import parse_hosts
+from client.fleet import host_logfile, split_host
+from client.health import busyness
+from common.data import HealthResp
+
+
+def test_parse_hosts():
+    assert parse_hosts("a, b:5001,,c") == ["a", "b:5001", "c"]
+    assert parse_hosts("# servers\na\n\nb  # spare\n") == ["a", "b"]
+
+
+def test_split_host():
+    assert split_host("a", 5000) == ("a", 5000)
+    assert split_host("a:5001", 5000) == ("a", 5001)
+    assert split_host("::1", 5000) == ("::1", 5000)
+    assert split_host("[::1]:5001", 5000) == ("::1", 5001)
+
+
+def test_host_logfile():
+    assert host_logfile(Path("out/run.log"), "a:5001") == Path("out/a_5001-run.log")
+    assert host_logfile(Path("out/{host}.log.gz"), "a") == Path("out/a.log.gz")
+    assert host_logfile(None, "a") is None
+
+
+def test_busyness():
+    idle = HealthResp(running=0, queued=0, slots=4, cpus=4, load=0.5, mem_free=0, disk_free=0)
+    queued = HealthResp(running=4, queued=2, slots=4, cpus=4, load=0.5, mem_free=0, disk_free=0)
+    loaded = HealthResp(running=0, queued=0, slots=4, cpus=2, load=4.0, mem_free=0, disk_free=0)
+    assert busyness(idle) == 0.5 / 4
+    assert busyness(queued) == 1.5
+    assert busyness(loaded) == 2.0
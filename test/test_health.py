@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+import client.health
+from client.args import Args
+from client.fleet import split_host
+from client.health import HealthCheckError, least_loaded
+from common.data import HealthResp, OkayResp
+
+
+def health(running: int, slots: int = 4, load: float = 0.0, mem_free: int = 0) -> HealthResp:
+    return HealthResp(
+        running=running, queued=0, slots=slots, cpus=4, load=load, mem_free=mem_free, disk_free=0
+    )
+
+
+def pick(monkeypatch: pytest.MonkeyPatch, replies: dict[str, object]) -> Args | None:
+    """The host picked by :func:`least_loaded` when each host replies with ``replies``."""
+
+    async def probe(args: Args) -> HealthResp | OkayResp:
+        reply = next(r for h, r in replies.items() if split_host(h, 0)[0] == args.server_ip)
+        if isinstance(reply, BaseException):
+            raise reply
+        assert isinstance(reply, (HealthResp, OkayResp))
+        return reply
+
+    monkeypatch.setattr(client.health, "probe", probe)
+    args = Args(target_path="run.py", hosts=list(replies), server_port=5000)
+    return asyncio.run(least_loaded(args))
+
+
+def test_least_busy(monkeypatch: pytest.MonkeyPatch):
+    best = pick(monkeypatch, {"a": health(3), "b": health(1), "c": health(0, load=3.0)})
+    assert best is not None
+    assert (best.server_ip, best.server_port, best.hosts) == ("b", 5000, [])
+
+
+def test_ties(monkeypatch: pytest.MonkeyPatch):
+    # Equally busy: fewest runs per slot, then most free memory.
+    best = pick(monkeypatch, {"a": health(2, load=4.0), "b": health(4, load=4.0)})
+    assert best is not None and best.server_ip == "a"
+    best = pick(monkeypatch, {"a": health(1, mem_free=1), "b": health(1, mem_free=2)})
+    assert best is not None and best.server_ip == "b"
+
+
+def test_fallback(monkeypatch: pytest.MonkeyPatch):
+    # Text protocol servers do not report their load, and go after those which do.
+    best = pick(monkeypatch, {"old": OkayResp(), "busy:5001": health(8)})
+    assert best is not None and (best.server_ip, best.server_port) == ("busy", 5001)
+    best = pick(
+        monkeypatch,
+        {"down": ConnectionRefusedError(), "odd": HealthCheckError(), "old": OkayResp()},
+    )
+    assert best is not None and best.server_ip == "old"
+    assert pick(monkeypatch, {"down": OSError(), "slow": TimeoutError()}) is None
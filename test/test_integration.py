@@ -14,7 +14,7 @@ from testcontainers.core.generic import DockerContainer  # pyright: ignore[repor
 
 from client.args import Args as ClientArgs, parse_args
 from client.main import PsyncClient
-from client.main import __rsync as rsync  # pyright: ignore[reportPrivateUsage]
+from client.sync import rsync
 from test.conftest import assets_path
 
 pprint = PrettyPrinter().pformat
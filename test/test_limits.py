@@ -0,0 +1,64 @@
+import resource
+import subprocess
+import sys
+
+import pytest
+
+from common.data import Limits
+from server.args import Args
+from server.limits import CpuAllocator, Plan, plan
+
+
+def test_plan_ceilings():
+    args = Args(False, max_memory=2**30, max_cpu_seconds=60, run_nice=5, cpus_per_run=2)
+    limits = plan(Limits(memory=2**31, cpu_seconds=10, nice=2, cpus=4), args)
+    assert limits.rlimits == [(resource.RLIMIT_AS, 2**30), (resource.RLIMIT_CPU, 10)]
+    assert (limits.nice, limits.cpu_count) == (5, 2)
+    assert plan(None, Args(False)) == Plan()
+    with pytest.raises(ValueError):
+        _ = plan(Limits(memory=-1), args)
+
+
+def test_cpu_allocator():
+    cpus = CpuAllocator([0, 1, 2, 3])
+    a = cpus.allocate(2)
+    b = cpus.allocate(2)
+    assert a == [0, 1] and b == [2, 3]
+    cpus.release(a)
+    assert cpus.allocate(3) == [0, 1, 2]
+    assert cpus.allocate(0) == []
+
+
+def test_apply():
+    limits = Plan(rlimits=[(resource.RLIMIT_NOFILE, 64)], nice=1)
+    out = subprocess.run(
+        limits.command(
+            [
+                sys.executable,
+                "-c",
+                "import os, resource\n"
+                + "print(resource.getrlimit(resource.RLIMIT_NOFILE)[0], os.nice(0))",
+            ]
+        ),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    base = subprocess.run(
+        [sys.executable, "-c", "import os; print(os.nice(0))"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert out.stdout.split() == ["64", str(min(int(base.stdout) + 1, 19))]
+    assert Plan().command(["true"]) == ["true"]
+
+
+def test_apply_missing():
+    """The shim reports a target it cannot run."""
+    limits = Plan(nice=1)
+    out = subprocess.run(
+        limits.command(["/nonexistent"]), capture_output=True, text=True, check=False
+    )
+    assert out.returncode == 1
+    assert "cannot run /nonexistent" in out.stderr
@@ -0,0 +1,55 @@
+import io
+from pathlib import Path
+
+from server.mirror import FileMirror, StdoutMirror
+
+
+def test_file_rotation(tmp_path: Path):
+    mirror = FileMirror(tmp_path, max_bytes=8, backups=1)
+    for chunk in (b"first\n", b"second\n", b"third\n"):
+        mirror.write("r1", chunk)
+    mirror.end("r1")
+    mirror.close()
+    assert mirror.path("r1").read_bytes() == b"third\n"
+    assert mirror.path("r1", 1).read_bytes() == b"second\n"
+    assert not mirror.path("r1", 2).exists()
+
+
+def test_stdout_prefix():
+    stream = io.BytesIO()
+    mirror = StdoutMirror(stream=stream)
+    mirror.write("aaaaaaaaaaaa", b"one\ntw")
+    mirror.write("bbbbbbbb", b"x\n")
+    mirror.write("aaaaaaaaaaaa", b"o\nthree")
+    mirror.end("aaaaaaaaaaaa")
+    mirror.close()
+    assert stream.getvalue().splitlines() == [
+        b"[aaaaaaaa] one",
+        b"[bbbbbbbb] x",
+        b"[aaaaaaaa] two",
+        b"[aaaaaaaa] three",
+    ]
+
+
+def test_stdout_rate_limit():
+    stream = io.BytesIO()
+    mirror = StdoutMirror(rate=10, stream=stream)
+    mirror.write("r", b"fits\n")
+    mirror.write("r", b"does not fit\n")
+    mirror.end("r")
+    mirror.close()
+    assert stream.getvalue().splitlines() == [
+        b"[r] fits",
+        b"[r] [psync: 13 bytes not mirrored]",
+    ]
+
+
+def test_unsafe_run_id(tmp_path: Path):
+    mirror = FileMirror(tmp_path / "runs")
+    mirror.write("../escape", b"out\n")
+    mirror.end("../escape")
+    mirror.close()
+    path = mirror.path("../escape")
+    assert path.parent == tmp_path / "runs"
+    assert path.read_bytes() == b"out\n"
+    assert not (tmp_path / "escape.log").exists()
@@ -0,0 +1,69 @@
+import gzip
+import time
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+from client.args import Args
+from client.output import compression_for, open_output
+
+
+def output_args(
+    logfile: Path | StringIO | None, flush_bytes: int, flush_ms: float, tee: bool = False
+) -> Args:
+    return Args(
+        target_path="run.py",
+        logfile=logfile,
+        tee=tee,
+        output_flush_bytes=flush_bytes,
+        output_flush_ms=flush_ms,
+    )
+
+
+def test_compression_for():
+    assert compression_for(Path("run.log")) == "none"
+    assert compression_for(Path("run.log.gz")) == "gzip"
+    assert compression_for(Path("run.log.zst")) == "zstd"
+    assert compression_for(Path("run.log.gz"), "none") == "none"
+    with pytest.raises(ValueError):
+        _ = compression_for(Path("run.log"), "lz4")
+
+
+def test_gzip_and_tee(tmp_path: Path, capsysbinary: pytest.CaptureFixture[bytes]):
+    path = tmp_path / "run.log.gz"
+    writer = open_output(output_args(path, flush_bytes=4, flush_ms=1000, tee=True))
+    for chunk in (b"caf", b"\xc3", b"\xa9\n", b"done\n"):
+        writer.write(chunk)
+    writer.close()
+    writer.close()
+    assert gzip.decompress(path.read_bytes()) == "café\ndone\n".encode()
+    assert capsysbinary.readouterr().out == "café\ndone\n".encode()
+
+
+def test_text():
+    text = StringIO()
+    writer = open_output(output_args(text, flush_bytes=4, flush_ms=1000))
+    for chunk in (b"caf", b"\xc3", b"\xa9\n", b"done\n"):
+        writer.write(chunk)
+    writer.close()
+    assert text.getvalue() == "café\ndone\n"
+
+
+def test_flush_ms():
+    text = StringIO()
+    writer = open_output(output_args(text, flush_bytes=2**20, flush_ms=10))
+    writer.write(b"tick\n")
+    deadline = time.monotonic() + 5
+    while not text.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert text.getvalue() == "tick\n"
+    writer.close()
+
+
+def test_prefixed(capsysbinary: pytest.CaptureFixture[bytes]):
+    writer = open_output(output_args(None, flush_bytes=1, flush_ms=1), prefix="[a] ")
+    for chunk in (b"one\ntw", b"o\n", b"three"):
+        writer.write(chunk)
+    writer.close()
+    assert capsysbinary.readouterr().out == b"[a] one\n[a] two\n[a] three\n"
@@ -0,0 +1,89 @@
+import asyncio
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+
+from client.args import Args
+from client.parallel import Progress, partition, rsync_parallel
+
+FAKE_RSYNC = """#!/bin/sh
+echo "$*" >> "{log}"
+case "$*" in *--delete*) exit 0 ;; esac
+files=$(cat)
+case "$files" in *fail*) exit 23 ;; esac
+printf '      1,000  50%%\\r'
+sleep {delay} >/dev/null && touch "{finished}"
+"""
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    root = tmp_path / "project"
+    root.mkdir()
+    for name, size in [("big", 900), ("medium", 500), ("small", 400), ("fail", 10)]:
+        _ = (root / name).write_bytes(b"x" * size)
+    return root
+
+
+def fake_rsync(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, delay: float) -> Path:
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    script = bindir / "rsync"
+    _ = script.write_text(
+        FAKE_RSYNC.format(log=tmp_path / "log", delay=delay, finished=tmp_path / "finished")
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}:/usr/bin:/bin")
+    return tmp_path / "log"
+
+
+def test_partition(project: Path):
+    args = Args(target_path=f"{project}/")
+    parts = partition(args, 2)
+    assert sorted(p.size for p in parts) == [900, 910]
+    assert sorted(rel for p in parts for rels in p.files.values() for rel in rels) == [
+        "big",
+        "fail",
+        "medium",
+        "small",
+    ]
+    assert all(list(p.files) == [project] for p in parts)
+    assert len(partition(args, 10)) == 4
+
+
+def test_progress(capsys: pytest.CaptureFixture[str]):
+    progress = Progress(2, 4 * 2**20)
+    progress.update(0, 2**20)
+    progress.update(1, 2**20)
+    assert capsys.readouterr().err.endswith("2.0 / 4.0 MiB ( 50%) over 2 streams")
+    # A worker's count restarts with each rsync process it runs.
+    progress.finish(0)
+    progress.update(0, 2**20)
+    assert capsys.readouterr().err.endswith("3.0 / 4.0 MiB ( 75%) over 2 streams")
+    progress.close()
+    assert capsys.readouterr().err == "\n"
+
+
+def test_failure(project: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    log = fake_rsync(tmp_path, monkeypatch, delay=5)
+    args = Args(target_path=f"{project}/", jobs=2, server_ip="server")
+    start = time.monotonic()
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        asyncio.run(rsync_parallel(args))
+    assert e.value.returncode == 23
+    # The healthy worker was stopped before it could finish, and nothing was deleted.
+    assert time.monotonic() - start < 4
+    assert not (tmp_path / "finished").exists()
+    assert "--delete" not in log.read_text()
+
+
+def test_success(project: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    (project / "fail").unlink()
+    log = fake_rsync(tmp_path, monkeypatch, delay=0)
+    asyncio.run(rsync_parallel(Args(target_path=f"{project}/", jobs=2, server_ip="server")))
+    calls = log.read_text().splitlines()
+    assert len(calls) == 3
+    assert "--delete" in calls[-1]
+    assert all("--delay-updates" in call for call in calls[:2])
@@ -0,0 +1,81 @@
+import os
+import resource
+from pathlib import Path
+
+import pytest
+
+from common.data import OpenReq
+from server.limits import Plan
+from server.results import Result, ResultCache, result_key
+
+
+def test_result_key(tmp_path: Path):
+    project = tmp_path / "abc"
+    (project / "bin").mkdir(parents=True)
+    run = project / "bin" / "run.py"
+    _ = run.write_text("print('hi')")
+
+    def key(req: OpenReq, limits: Plan | None = None, user: str | None = None) -> str:
+        return result_key(req, tmp_path, req.env, limits or Plan(), user)
+
+    req = OpenReq(path=run, args=["-v"], env={"A": "1"})
+    first = key(req)
+    assert key(OpenReq(path=run, args=["-v"], env={"A": "1"})) == first
+    assert key(OpenReq(path=run, args=[], env={"A": "1"})) != first
+    assert key(OpenReq(path=run, args=["-v"], env={"A": "2"})) != first
+    assert key(req, user="other") != first
+    assert key(req, Plan(rlimits=[(resource.RLIMIT_AS, 2**30)])) != first
+    assert key(req, Plan(cpu_count=1, cpus=[0])) == key(req, Plan(cpu_count=1, cpus=[1]))
+    pty = OpenReq(path=run, args=["-v"], env={"A": "1"}, pty=True, rows=24, cols=80)
+    wide = OpenReq(path=run, args=["-v"], env={"A": "1"}, pty=True, rows=24, cols=120)
+    assert key(pty) != key(wide)
+
+    # Anything in the project counts, not only the executable's directory.
+    _ = (project / "data.txt").write_text("input")
+    assert key(req) != first
+
+
+def test_cache(tmp_path: Path):
+    cache = ResultCache(tmp_path, 1000, 100)
+    assert cache.get("a") is None
+
+    recording = cache.recording("a")
+    recording.outputs = {1: bytearray(), 2: bytearray()}
+    recording.add(1, b"out\n")
+    recording.add(2, b"err\n")
+    recording.add(1, b"more\n")
+    cache.put("a", recording.result(3))
+    assert cache.get("a") == Result(3, {1: b"out\nmore\n", 2: b"err\n"})
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Reloaded from disk.
+    assert ResultCache(tmp_path, 1000, 100).get("a") == Result(3, {1: b"out\nmore\n", 2: b"err\n"})
+
+    big = cache.recording("b")
+    big.add(1, b"x" * 101)
+    assert big.overflowed
+
+
+def test_eviction(tmp_path: Path):
+    cache = ResultCache(tmp_path, 250, 100)
+    for key in "abc":
+        cache.put(key, Result(0, {1: b"x" * 80}))
+        if key == "b":
+            # Used, so "a" is evicted first.
+            assert cache.get("a") is not None
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert not (tmp_path / "b.result").exists()
+
+
+def test_evicted_while_read(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """A result evicted between being read and being touched is still returned."""
+    cache = ResultCache(tmp_path, 1000, 100)
+    cache.put("a", Result(0, {1: b"out\n"}))
+
+    def evicted(path: Path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.get("a") == Result(0, {1: b"out\n"})
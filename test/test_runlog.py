@@ -0,0 +1,83 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from server.runlog import RunLog, utf8_boundary
+
+
+def test_utf8_boundary():
+    text = "aé€😀".encode()
+    assert utf8_boundary(text) == len(text)
+    assert utf8_boundary(text[:-1]) == len(text) - 4
+    assert utf8_boundary(text[:2]) == 1
+    assert utf8_boundary(b"\xff\xff") == 2
+    assert utf8_boundary(b"") == 0
+
+
+def test_spill(tmp_path: Path):
+    async def inner():
+        log = RunLog(memory=4, spill_dir=tmp_path)
+        for chunk in (b"hello ", b"wor", b"ld"):
+            await log.append(chunk)
+        assert log.end == 11
+        data = b""
+        while len(data) < log.end:
+            data += await log.read(len(data), 3)
+        assert data == b"hello world"
+        assert await log.read(log.end, 3) == b""
+        with pytest.raises(ValueError):
+            _ = await log.read(12, 1)
+
+        waiter = asyncio.create_task(log.wait(log.end))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        log.finish(0)
+        await asyncio.wait_for(waiter, 1)
+        log.close()
+
+    asyncio.run(inner())
+
+
+def test_drop_oldest():
+    async def inner():
+        log = RunLog(memory=4, overflow="drop-oldest")
+        await log.append(b"hello world")
+        assert (log.start, log.end) == (7, 11)
+        assert await log.read(log.start, 10) == b"orld"
+        with pytest.raises(ValueError):
+            _ = await log.read(0, 1)
+
+    asyncio.run(inner())
+
+
+def test_block():
+    async def inner():
+        log = RunLog(memory=4, overflow="block")
+        await log.append(b"hello")
+        writable = asyncio.create_task(log.writable())
+        await asyncio.sleep(0)
+        assert not writable.done()
+        log.sent(2)
+        await asyncio.wait_for(writable, 1)
+        assert await log.read(0, 5) + await log.read(1, 4) == b"hello"
+        log.close()
+
+    asyncio.run(inner())
+
+
+def test_spill_limit(tmp_path: Path):
+    async def inner():
+        log = RunLog(memory=4, spill_dir=tmp_path, spill_limit=4)
+        await log.append(b"hello ")
+        assert log.start == 0
+        assert await log.read(0, 2) == b"he"
+        # Spilling "world" would take the spill file past its limit.
+        await log.append(b"world")
+        assert (log.start, log.end) == (7, 11)
+        assert await log.read(log.start, 10) == b"orld"
+        with pytest.raises(ValueError):
+            _ = await log.read(0, 1)
+        log.close()
+
+    asyncio.run(inner())
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+
+from server.scheduler import JobState, Scheduler
+
+
+def test_slots():
+    async def inner():
+        scheduler = Scheduler(2)
+        jobs = [scheduler.submit(f"r{i}", "a") for i in range(3)]
+        assert [job.state for job in jobs] == [
+            JobState.Running,
+            JobState.Running,
+            JobState.Waiting,
+        ]
+        assert scheduler.position(jobs[2]) == 1
+        assert (scheduler.running(), scheduler.queued()) == (2, 1)
+        scheduler.done(jobs[0])
+        assert jobs[2].state is JobState.Running
+        assert (scheduler.running(), scheduler.queued()) == (2, 0)
+        assert jobs[2].granted.done()
+
+    asyncio.run(inner())
+
+
+def test_fair_share():
+    async def inner():
+        scheduler = Scheduler(1)
+        first = scheduler.submit("a0", "a")
+        a = [scheduler.submit(f"a{i}", "a") for i in range(1, 3)]
+        b = scheduler.submit("b0", "b")
+        # b has no running jobs, so it goes before a's backlog.
+        assert scheduler.position(b) == 1
+        scheduler.done(first)
+        assert b.state is JobState.Running
+        scheduler.done(b)
+        assert a[0].state is JobState.Running
+
+    asyncio.run(inner())
+
+
+def test_priority():
+    async def inner():
+        scheduler = Scheduler(1)
+        running = scheduler.submit("r", "a")
+        batch = scheduler.submit("batch", "b")
+        interactive = scheduler.submit("interactive", "a", priority=1)
+        assert scheduler.position(interactive) == 1
+        assert scheduler.eta(interactive) is None
+        scheduler.done(running)
+        assert interactive.state is JobState.Running
+        assert batch.state is JobState.Waiting
+        assert scheduler.eta(batch) is not None
+
+    asyncio.run(inner())
+
+
+def test_cancel_waiting():
+    async def inner():
+        scheduler = Scheduler(1)
+        running = scheduler.submit("r", "a")
+        waiting = scheduler.submit("w", "a")
+        scheduler.done(waiting)
+        assert waiting.granted.cancelled()
+        scheduler.done(running)
+        scheduler.done(running)
+        assert scheduler.submit("n", "a").state is JobState.Running
+
+    asyncio.run(inner())
+
+
+def test_eta(monkeypatch: pytest.MonkeyPatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+
+    async def inner():
+        scheduler = Scheduler(1)
+        first = scheduler.submit("r0", "a")
+        now[0] = 10
+        scheduler.done(first)
+        running = scheduler.submit("r1", "a")
+        waiting = [scheduler.submit(f"w{i}", "b") for i in range(2)]
+        assert scheduler.eta(waiting[0]) == 10
+        assert scheduler.eta(waiting[1]) == 20
+        # The running job is expected to finish sooner the longer it has run.
+        now[0] = 14
+        assert scheduler.eta(waiting[0]) == 6
+        # Past every recent job's duration, it is expected to run as long again.
+        now[0] = 25
+        assert scheduler.eta(waiting[0]) == 15
+        assert scheduler.eta(waiting[1]) == 25
+        scheduler.done(running)
+
+    asyncio.run(inner())
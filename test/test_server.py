@@ -0,0 +1,216 @@
+import asyncio
+import socket
+import ssl
+import subprocess
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+import pytest
+import websockets
+from websockets.typing import Origin
+
+from common.data import (
+    ArtifactResp,
+    ExitResp,
+    KillReq,
+    Limits,
+    LogResp,
+    OpenReq,
+    Protocol,
+    Req,
+    Resp,
+    SetPidResp,
+    decode,
+    encode,
+)
+from server.args import Args
+from server.main import PsyncServer
+
+Connection = websockets.ClientConnection
+
+
+@pytest.fixture
+def args(tmp_path: Path) -> Args:
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    _ = subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-subj", "/CN=localhost", "-keyout", str(key), "-out", str(cert)],
+        check=True,
+        capture_output=True,
+    )
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port: int = s.getsockname()[1]
+    dest = tmp_path / "dest"
+    (dest / "project").mkdir(parents=True)
+    return Args(
+        cert_path=cert,
+        key_path=key,
+        host="127.0.0.1",
+        port=str(port),
+        server_dest=str(dest),
+        mirror="off",
+        slots=4,
+        use_base_env=True,
+    )
+
+
+def script(args: Args, name: str, body: str) -> Path:
+    """An executable shell script in the synced project."""
+    path = Path(args.server_dest) / "project" / name
+    _ = path.write_text(f"#!/bin/sh\n{body}\n")
+    path.chmod(0o755)
+    return path
+
+
+def session(args: Args, body: Callable[[Connection], Awaitable[None]]):
+    """Start the server, then run ``body`` over a binary protocol connection to it."""
+    ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ssl_ctx.load_verify_locations(args.cert_path)
+    ssl_ctx.check_hostname = False
+
+    async def main():
+        server = asyncio.create_task(PsyncServer(args).serve())
+        try:
+            for _ in range(100):
+                try:
+                    ws = await websockets.connect(
+                        f"wss://{args.host}:{args.port}",
+                        ssl=ssl_ctx,
+                        origin=Origin("wss://localhost"),
+                        subprotocols=[Protocol.Binary.value],
+                    )
+                    break
+                except OSError:
+                    await asyncio.sleep(0.05)
+            else:
+                pytest.fail("Server did not start")
+            async with ws:
+                assert ws.subprotocol == Protocol.Binary.value
+                await asyncio.wait_for(body(ws), 10)
+        finally:
+            _ = server.cancel()
+
+    asyncio.run(main())
+
+
+async def send(ws: Connection, msg: Req):
+    await ws.send(encode(msg))
+
+
+async def recv(ws: Connection) -> Resp:
+    data = await ws.recv()
+    assert isinstance(data, bytes)
+    msg = decode(data)
+    assert not isinstance(msg, Req)
+    return msg
+
+
+def test_multiplexed_runs(args: Args):
+    """Runs sharing a connection get their own output, exits and kills."""
+    echo = script(args, "echo.sh", 'for i in 1 2 3; do echo "$1 $i"; sleep 0.05; done')
+    slow = script(args, "slow.sh", "echo started\nexec sleep 30")
+
+    async def body(ws: Connection):
+        for run_id, word in [("a", "apple"), ("b", "banana")]:
+            await send(ws, OpenReq(path=echo, args=[word], env={}, run_id=run_id))
+        await send(ws, OpenReq(path=slow, args=[], env={}, run_id="slow"))
+        output: dict[str, str] = {"a": "", "b": "", "slow": ""}
+        exits: dict[str, str] = {}
+        killed = False
+        while len(exits) < 3:
+            resp = await recv(ws)
+            match resp:
+                case LogResp():
+                    output[resp.run_id] += resp.msg
+                    if output["slow"] and not killed:
+                        await send(ws, KillReq(pid=0, run_id="slow"))
+                        killed = True
+                case ExitResp():
+                    exits[resp.run_id] = resp.exit_code
+                case SetPidResp():
+                    assert resp.run_id in output
+                case _:
+                    pytest.fail(f"Unexpected {resp}")
+        assert output["a"] == "apple 1\napple 2\napple 3\n"
+        assert output["b"] == "banana 1\nbanana 2\nbanana 3\n"
+        assert exits == {"a": "0", "b": "0", "slow": "-9"}
+
+    session(args, body)
+
+
+def test_spilled_output(args: Args):
+    """Output larger than a run's memory is spilled to disk and still sent in full."""
+    args.run_log_memory = 4096
+    args.run_log_dir = Path(args.server_dest)
+    flood = script(args, "flood.sh", "seq 1 50000")
+
+    async def body(ws: Connection):
+        await send(ws, OpenReq(path=flood, args=[], env={}, run_id="f"))
+        output = ""
+        while not isinstance(resp := await recv(ws), ExitResp):
+            if isinstance(resp, LogResp):
+                output += resp.msg
+        assert resp.exit_code == "0"
+        assert output == "".join(f"{i}\n" for i in range(1, 50001))
+
+    session(args, body)
+
+
+def test_split_stderr(args: Args):
+    """Split runs send stdout and stderr separately; merged runs send both as fd 1."""
+    both = script(args, "both.sh", "echo out; echo err >&2; echo out2; echo err2 >&2")
+
+    async def run(ws: Connection, run_id: str, split: bool) -> dict[int, str]:
+        req = OpenReq(path=both, args=[], env={}, run_id=run_id, split_stderr=split)
+        await send(ws, req)
+        output: dict[int, str] = {}
+        while not isinstance(resp := await recv(ws), ExitResp):
+            if isinstance(resp, LogResp):
+                output[resp.fd] = output.get(resp.fd, "") + resp.msg
+        assert resp.exit_code == "0"
+        return output
+
+    async def body(ws: Connection):
+        assert await run(ws, "split", True) == {1: "out\nout2\n", 2: "err\nerr2\n"}
+        merged = await run(ws, "merged", False)
+        assert list(merged) == [1]
+        assert sorted(merged[1].splitlines()) == ["err", "err2", "out", "out2"]
+
+    session(args, body)
+
+
+def test_relative_artifacts(args: Args):
+    """Runs start in their project directory, so files they write there are fetched."""
+    (Path(args.server_dest) / "project" / "bin").mkdir()
+    write = script(args, "bin/write.sh", "mkdir -p out && echo result > out/result.txt")
+
+    async def body(ws: Connection):
+        req = OpenReq(path=write, args=[], env={}, run_id="w", artifacts=["out/*.txt"])
+        await send(ws, req)
+        fetched: dict[str, bytes] = {}
+        while not isinstance(resp := await recv(ws), ExitResp):
+            if isinstance(resp, ArtifactResp):
+                assert not resp.compressed
+                fetched[resp.path] = fetched.get(resp.path, b"") + resp.data
+        assert resp.exit_code == "0"
+        assert fetched == {"out/result.txt": b"result\n"}
+
+    session(args, body)
+
+
+def test_limits(args: Args):
+    """Limits hold from the start of the target, and for the processes it starts."""
+    check = script(args, "check.sh", "ulimit -n; (ulimit -n) &\nwait")
+
+    async def body(ws: Connection):
+        req = OpenReq(path=check, args=[], env={}, run_id="l", limits=Limits(open_files=64))
+        await send(ws, req)
+        output = ""
+        while not isinstance(resp := await recv(ws), ExitResp):
+            if isinstance(resp, LogResp):
+                output += resp.msg
+        assert resp.exit_code == "0"
+        assert output == "64\n64\n"
+
+    session(args, body)
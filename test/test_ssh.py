@@ -0,0 +1,58 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from client.args import Args
+from client.ssh import control, control_options, ssh_command
+
+
+@pytest.fixture
+def runtime(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    return tmp_path / "psync"
+
+
+def test_master_options(runtime: Path):
+    args = Args(target_path="run.py", ssh_persist=60, server_ssh_port=2222)
+    command = ssh_command(args)
+    assert command[:1] == ["/usr/bin/ssh"]
+    assert command[command.index("-p") + 1] == "2222"
+    options = control_options(args)
+    assert options == [
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        f"ControlPath={runtime / '%C'}",
+        "-o",
+        "ControlPersist=60",
+    ]
+    assert all(option in command for option in options)
+    assert runtime.stat().st_mode & 0o777 == 0o700
+
+
+def test_master_disabled(runtime: Path):
+    args = Args(target_path="run.py", ssh_persist=0)
+    assert control_options(args) == []
+    assert not any(arg.startswith("Control") for arg in ssh_command(args))
+    assert not runtime.exists()
+
+
+def test_control(runtime: Path, monkeypatch: pytest.MonkeyPatch):
+    commands: list[list[str]] = []
+
+    def run(cmd: list[str], check: bool) -> subprocess.CompletedProcess[bytes]:
+        assert not check
+        commands.append(cmd)
+        return subprocess.CompletedProcess(cmd, 255)
+
+    monkeypatch.setattr(subprocess, "run", run)
+    args = Args(target_path="run.py", ssh_persist=60, server_ip="10.0.0.2")
+    for command in ("check", "exit"):
+        assert control(args, command) == 255
+        assert commands[-1][-3:] == ["-O", command, "10.0.0.2"]
+        assert f"ControlPath={runtime / '%C'}" in commands[-1]
+
+    commands.clear()
+    assert control(Args(target_path="run.py", ssh_persist=0), "exit") == 1
+    assert not commands
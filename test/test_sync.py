@@ -0,0 +1,128 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from client.sync import delta
+from common.data import SyncReq
+from common.sync import BLOCK_SIZE, entry, walk
+from server.store import LINK_MODES, BlobStore
+from server.sync import SyncSession, project_root, tree_token
+
+
+def sync(src: Path, dest: Path, store: BlobStore | None = None) -> int:
+    """Sync ``src/`` into ``dest`` in-process. Returns the number of blocks sent."""
+    files = {rel: (path, entry(path)) for rel, path in walk([f"{src}/"])}
+    req = SyncReq(root=dest, files={k: v[1] for k, v in files.items()})
+    session = SyncSession(req, dest.parent, store)
+    resp = session.plan()
+    sent = 0
+    for rel, remote in resp.blocks.items():
+        for block in delta(rel, files[rel][0], remote):
+            session.write(block)
+            sent += 1
+    session.commit()
+    return sent
+
+
+def tree(root: Path) -> dict[str, bytes]:
+    return {
+        p.relative_to(root).as_posix(): p.read_bytes()
+        for p in root.rglob("*")
+        if p.is_file()
+    }
+
+
+def test_sync(tmp_path: Path):
+    src, dest = tmp_path / "src", tmp_path / "dest"
+    (src / "dir").mkdir(parents=True)
+    big = src / "big.bin"
+    _ = big.write_bytes(os.urandom(BLOCK_SIZE * 4 + 10))
+    _ = (src / "dir" / "small.txt").write_text("hello")
+    _ = (src / "empty").write_bytes(b"")
+    (src / "run.sh").touch(0o755)
+
+    assert sync(src, dest) == 6
+    assert tree(dest) == tree(src)
+    assert os.access(dest / "run.sh", os.X_OK)
+    assert sync(src, dest) == 0
+
+    with open(big, "r+b") as f:
+        _ = f.seek(BLOCK_SIZE * 2 + 1)
+        _ = f.write(b"changed")
+    (src / "dir" / "small.txt").unlink()
+    _ = (dest / "stray").write_text("deleted by sync")
+    assert sync(src, dest) == 1
+    assert tree(dest) == tree(src)
+
+    with open(big, "r+b") as f:
+        _ = f.truncate(BLOCK_SIZE)
+    assert sync(src, dest) == 0
+    assert tree(dest) == tree(src)
+
+
+@pytest.mark.parametrize("link", LINK_MODES)
+def test_sync_store(tmp_path: Path, link: str):
+    src, store = tmp_path / "src", BlobStore(tmp_path / "store", link, retention=0)
+    src.mkdir()
+    _ = (src / "asset.bin").write_bytes(os.urandom(BLOCK_SIZE * 2))
+    _ = (src / "run.sh").write_text("#!/bin/sh\n")
+
+    assert sync(src, tmp_path / "a", store) == 3
+    assert sync(src, tmp_path / "b", store) == 0
+    assert tree(tmp_path / "b") == tree(src)
+
+    _ = store.gc()
+    assert sync(src, tmp_path / "c", store) == (3 if link != "hardlink" else 0)
+    for project in "abc":
+        for path in (tmp_path / project).iterdir():
+            path.unlink()
+    _ = store.gc()
+    assert not any(p.is_file() for p in (tmp_path / "store").rglob("*"))
+
+
+@pytest.mark.parametrize("rel", ["../escape", "/abs", "a/../../b", ""])
+def test_sync_rejects_escaping_paths(tmp_path: Path, rel: str):
+    root = tmp_path / "project"
+    root.mkdir()
+    _ = (root / "kept").write_text("not deleted")
+    req = SyncReq(root=root, files={rel: entry(__file__)})
+    with pytest.raises(ValueError):
+        _ = SyncSession(req, tmp_path).plan()
+    assert (root / "kept").exists()
+
+
+@pytest.mark.parametrize("root", [".", "..", "../elsewhere", "/"])
+def test_sync_rejects_roots_outside_base(tmp_path: Path, root: str):
+    base = tmp_path / "dest"
+    base.mkdir()
+    _ = (tmp_path / "kept").write_text("not deleted")
+    with pytest.raises(ValueError):
+        _ = SyncSession(SyncReq(root=base / root, files={}), base)
+    assert (tmp_path / "kept").exists()
+
+
+def test_tree_token(tmp_path: Path):
+    assert tree_token(tmp_path / "missing") == ""
+    (tmp_path / "dir").mkdir()
+    _ = (tmp_path / "dir" / "a.txt").write_text("a")
+    token = tree_token(tmp_path)
+    assert token and tree_token(tmp_path) == token
+
+    st = (tmp_path / "dir" / "a.txt").stat()
+    os.utime(tmp_path / "dir" / "a.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert tree_token(tmp_path) != token
+    token = tree_token(tmp_path)
+    (tmp_path / "dir" / "a.txt").chmod(0o600)
+    assert tree_token(tmp_path) != token
+    token = tree_token(tmp_path)
+    _ = (tmp_path / "b.txt").write_text("")
+    assert tree_token(tmp_path) != token
+
+
+def test_project_root(tmp_path: Path):
+    base = tmp_path / "dest"
+    assert project_root(base, base / "abc" / "run.py") == base / "abc"
+    assert project_root(base, base / "abc" / "bin" / "run.py") == base / "abc"
+    assert project_root(base, base / "run.py") == base
+    assert project_root(base, tmp_path / "other" / "run.py") == tmp_path / "other"
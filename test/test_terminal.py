@@ -0,0 +1,38 @@
+import asyncio
+import os
+
+from server.terminal import open_pty, read_pty, set_size
+
+
+def test_size():
+    controller, terminal = open_pty(24, 80)
+    try:
+        assert os.get_terminal_size(terminal) == os.terminal_size((80, 24))
+        set_size(controller, 50, 132)
+        assert os.get_terminal_size(terminal) == os.terminal_size((132, 50))
+    finally:
+        os.close(controller)
+        os.close(terminal)
+
+
+def test_read_pty():
+    async def inner():
+        controller, terminal = open_pty()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "sh",
+                "-c",
+                "test -t 1 && echo tty",
+                stdin=terminal,
+                stdout=terminal,
+                stderr=terminal,
+                start_new_session=True,
+            )
+        finally:
+            os.close(terminal)
+        stdout = await read_pty(controller)
+        os.close(controller)
+        assert await stdout.read() == b"tty\n"
+        assert await process.wait() == 0
+
+    asyncio.run(inner())
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from server.child import PIPE, spawn
+from server.usage import UsageSampler
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_sample():
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import sys, time\n"
+            + "data = bytearray(64 * 2**20)\n"
+            + "end = time.process_time() + 0.2\n"
+            + "while time.process_time() < end: pass\n"
+            + "sys.stdin.read()",
+        ],
+        stdin=subprocess.PIPE,
+    )
+    sampler = UsageSampler(process.pid)
+    deadline = time.monotonic() + 10
+    try:
+        while sampler.sample().user_seconds + sampler.usage.sys_seconds < 0.2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        usage = sampler.sample()
+    finally:
+        _ = process.communicate(b"")
+    assert usage.max_rss >= 64 * 2**20
+    assert usage.wall_seconds > 0
+    final = sampler.finish()
+    assert final.user_seconds == usage.user_seconds
+    assert sampler.sample() is final
+
+
+def test_final_usage():
+    """The final usage is the reaped process' own, even once it has exited."""
+    burn = (
+        "import sys, time\n"
+        + "data = bytearray(64 * 2**20)\n"
+        + "end = time.process_time() + 0.2\n"
+        + "while time.process_time() < end: pass\n"
+    )
+
+    async def main():
+        child = await spawn(sys.executable, "-c", burn)
+        sampler = UsageSampler(child.pid)
+        assert await child.wait() == 0
+        final = sampler.finish(child.rusage)
+        assert final.user_seconds + final.sys_seconds >= 0.2
+        assert final.max_rss >= 64 * 2**20
+
+        # Usage from before the sampler started is not counted.
+        wait = "print(flush=True)\nsys.stdin.read()"
+        child = await spawn(sys.executable, "-c", burn + wait, stdin=PIPE, stdout=PIPE)
+        assert child.stdin is not None and child.stdout is not None
+        _ = await child.stdout.readline()
+        sampler = UsageSampler(child.pid, since_now=True)
+        child.stdin.close()
+        assert await child.wait() == 0
+        final = sampler.finish(child.rusage)
+        assert final.user_seconds + final.sys_seconds < 0.1
+
+    asyncio.run(main())
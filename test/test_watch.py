@@ -0,0 +1,80 @@
+import asyncio
+import ctypes
+from pathlib import Path
+
+import pytest
+
+import client.watch
+from client.watch import Watcher
+
+
+async def touch(path: Path, times: int, interval: float):
+    for i in range(times):
+        _ = path.write_text(str(i))
+        await asyncio.sleep(interval)
+
+
+def test_coalesce(tmp_path: Path):
+    async def inner():
+        (tmp_path / "dir").mkdir()
+        target = tmp_path / "run.py"
+        _ = target.write_text("")
+        with Watcher([str(target), str(tmp_path / "dir")], debounce=0.1) as watcher:
+            changes = asyncio.create_task(watcher.changes())
+            await touch(target, 3, 0)
+            await touch(tmp_path / "dir" / "a.txt", 3, 0)
+            (tmp_path / "dir" / "sub").mkdir()
+            await asyncio.sleep(0.05)
+            await touch(tmp_path / "dir" / "sub" / "b.txt", 1, 0)
+            # Not watched.
+            _ = (tmp_path / "other.txt").write_text("")
+            changed = await asyncio.wait_for(changes, 2)
+        assert target in changed
+        assert tmp_path / "dir" / "a.txt" in changed
+        assert tmp_path / "dir" / "sub" / "b.txt" in changed
+        assert tmp_path / "other.txt" not in changed
+
+    asyncio.run(inner())
+
+
+def test_debounce(tmp_path: Path):
+    async def inner():
+        target = tmp_path / "run.py"
+        _ = target.write_text("")
+        with Watcher([str(target)], debounce=0.1) as watcher:
+            loop = asyncio.get_running_loop()
+            changes = asyncio.create_task(watcher.changes())
+            start = loop.time()
+            # Changes keep coming faster than the debounce, so they form one batch.
+            await touch(target, 6, 0.05)
+            assert not changes.done()
+            assert await asyncio.wait_for(changes, 2) == {target}
+            assert loop.time() - start >= 0.3
+
+            second = asyncio.create_task(watcher.changes())
+            await asyncio.sleep(0.2)
+            assert not second.done()
+            await touch(target, 1, 0)
+            assert await asyncio.wait_for(second, 2) == {target}
+
+    asyncio.run(inner())
+
+
+def test_poll(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    def unavailable(*_args: object, **_kwargs: object):
+        raise OSError("no libc")
+
+    monkeypatch.setattr(ctypes, "CDLL", unavailable)
+    monkeypatch.setattr(client.watch, "POLL_INTERVAL", 0.02)
+
+    async def inner():
+        target = tmp_path / "run.py"
+        _ = target.write_text("")
+        with Watcher([str(tmp_path)], debounce=0.1) as watcher:
+            await asyncio.sleep(0.05)
+            changes = asyncio.create_task(watcher.changes())
+            _ = target.write_text("changed")
+            _ = (tmp_path / "new.txt").write_text("")
+            assert await asyncio.wait_for(changes, 2) == {target, tmp_path / "new.txt"}
+
+    asyncio.run(inner())
@@ -0,0 +1,63 @@
+import asyncio
+from pathlib import Path
+
+from server.zygote import ZygotePool, is_python
+
+
+def test_is_python(tmp_path: Path):
+    script = tmp_path / "script"
+    _ = script.write_text("#!/usr/bin/env python3\n")
+    shell = tmp_path / "shell"
+    _ = shell.write_text("#!/bin/sh\n")
+    assert is_python(script)
+    assert is_python(tmp_path / "missing.py")
+    assert not is_python(shell)
+    assert not is_python(tmp_path / "missing")
+
+
+def test_spawn(tmp_path: Path):
+    script = tmp_path / "script.py"
+    _ = script.write_text(
+        "import os, sys, json\n"
+        + "print(__name__, sys.argv[1:], os.environ['X'], sys.path[0] == os.path.dirname(__file__))\n"
+        + "print(os.getcwd())\n"
+        + "sys.exit(3)\n"
+    )
+    assert run(script, tmp_path) == f"__main__ ['a', 'b'] 1 True\n{tmp_path}\n".encode()
+
+
+def test_script_packages(tmp_path: Path):
+    """The script imports its own packages, not the zygote's of the same name."""
+    package = tmp_path / "server"
+    package.mkdir()
+    _ = (package / "__init__.py").write_text("NAME = 'mine'\n")
+    script = tmp_path / "script.py"
+    _ = script.write_text(
+        "import sys, server\n"
+        + "print(server.NAME, 'server.zygote' in sys.modules)\n"
+        + "sys.exit(3)\n"
+    )
+    assert run(script) == b"mine False\n"
+
+
+def run(script: Path, cwd: Path | None = None) -> bytes:
+    """Output of ``script`` run with arguments ``a b`` in a zygote, in ``cwd``."""
+
+    async def inner():
+        pool = ZygotePool(1, ["json"])
+        assert await pool.spawn(script, [], {}) is None
+        pool.start()
+        for _ in range(100):
+            process = await pool.spawn(script, ["a", "b"], {"X": "1"}, cwd=cwd)
+            if process is not None:
+                break
+            await asyncio.sleep(0.05)
+        else:
+            raise TimeoutError("zygote did not start")
+        assert process.stdout is not None
+        output = await process.stdout.read()
+        assert await process.wait() == 3
+        await pool.close()
+        return output
+
+    return asyncio.run(inner())